@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""Teste de carga do responder: N usuários sintéticos concorrentes contra um banco local.
+
+Monta Update/Context falsos (só o que o responder usa), popula um SQLite temporário
+(DB_BACKEND=sqlite) e dispara uma mistura realista de mensagens: adições, saldo,
+extratos, gráficos e exportações. Mede a latência do handler por tipo de operação
+(p50/p95/p99), a vazão e as leituras/escritas no banco por operação (contadores do
+Database; no SQLite contam linhas devolvidas/alteradas, no Firestore documentos).
+
+Uso:
+    python benchmarks/bench_carga.py --usuarios 50 --mensagens 40 --historico 200
+    python benchmarks/bench_carga.py --saida benchmarks/out/atual.json --comparar benchmarks/out/anterior.json
+
+Sem --saida o resultado só é impresso; benchmarks/out/ fica fora do git.
+
+Para rodar contra outro backend, exporte DB_BACKEND/SQLITE_PATH antes (o padrão é
+um SQLite novo num diretório temporário).
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+from types import SimpleNamespace
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+if 'DB_BACKEND' not in os.environ:
+    os.environ['DB_BACKEND'] = 'sqlite'
+    os.environ['SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(prefix="bench_carga_"), "financeiro.db")
+
+import bot  # noqa: E402  (o banco é escolhido na importação de db)
+from db import db  # noqa: E402
+from graficos import graficos  # noqa: E402
+
+PRIMEIRO_USER_ID = 10_000_000 # longe do ADMIN_USER_ID: o bloco de admin não entra na medição
+
+# (peso, operação, mensagem) — "add" sorteia uma mensagem de transação
+MISTURA = [
+    (55, "add", None),
+    (10, "saldo", "⚖️ Saldo Geral"),
+    (8, "saidas", "📤 Ver Saídas"),
+    (5, "entradas", "📥 Ver Entradas"),
+    (6, "cartao", "💳 Gastos por Cartão"),
+    (6, "pizza", "🍕 Gráfico Pizza"),
+    (4, "barras", "📊 Gráfico Barras"),
+    (3, "pdf", "📄 Gerar PDF"),
+    (3, "xlsx", "📈 Gerar XLSX"),
+]
+TRANSACOES = [
+    "150 mercado", "50 lanche", "30 uber", "12 café", "89,90 ifood nubank", "1.200 aluguel", "2500 salário",
+    "300 cliente pagou", "45 farmácia remédio", "60 gasolina cartão santander", "15 netflix", "120 internet celular",
+    "80 pet ração", "35 padaria", "1000 investimento cdb", "25 estacionamento", "70 cartao xp alimentação", "10 pix recebi",
+]
+
+# ===================================================================
+# --- Update/Context falsos ---
+# ===================================================================
+class MensagemFalsa:
+    """Imita telegram.Message no que o responder usa; as respostas ficam guardadas."""
+    def __init__(self, user_id, nome, texto, latencia):
+        self.from_user = SimpleNamespace(id=user_id, first_name=nome)
+        self.text = texto; self.respostas = []; self._latencia = latencia
+
+    async def _responder(self, conteudo):
+        if self._latencia: await asyncio.sleep(self._latencia) # round-trip simulado da API do Telegram
+        self.respostas.append(conteudo)
+
+    async def reply_text(self, texto, **kwargs): await self._responder(texto)
+    async def reply_photo(self, foto, **kwargs): await self._responder(foto)
+    async def reply_document(self, documento, **kwargs): await self._responder(documento)
+
+def atualizacao_falsa(user_id, texto, latencia=0.0):
+    return SimpleNamespace(message=MensagemFalsa(user_id, f"Usuário {user_id}", texto, latencia))
+
+def contexto_falso(user_data):
+    return SimpleNamespace(user_data=user_data, bot=None)
+
+# ===================================================================
+# --- Carga ---
+# ===================================================================
+def percentil(valores, p):
+    """Percentil pelo método nearest-rank (valores já ordenados)."""
+    if not valores: return 0.0
+    return valores[min(len(valores) - 1, max(0, math.ceil(p / 100.0 * len(valores)) - 1))]
+
+def popular(usuarios, historico, rng):
+    """Histórico inicial de cada usuário, gravado direto pelo Database (fora da medição)."""
+    from classificador import interpretar_mensagem
+    for uid in usuarios:
+        for _ in range(historico):
+            r = interpretar_mensagem(rng.choice(TRANSACOES))
+            db.add_transacao(uid, r["tipo"], r["valor_num"], r["valor_txt"], r["categoria"], r["descricao"], r["metodo"], r["cartao"], f"Usuário {uid}")
+    db.cache.invalidar()
+
+def sortear(rng):
+    _, operacao, mensagem = rng.choices(MISTURA, weights=[m[0] for m in MISTURA])[0]
+    return operacao, mensagem or rng.choice(TRANSACOES)
+
+async def simular_usuario(uid, mensagens, rng, latencia, amostras, pausa):
+    user_data = {}
+    for _ in range(mensagens):
+        operacao, texto = sortear(rng)
+        inicio = time.perf_counter()
+        await bot.responder(atualizacao_falsa(uid, texto, latencia), contexto_falso(user_data))
+        amostras.append((operacao, time.perf_counter() - inicio))
+        if pausa: await asyncio.sleep(rng.uniform(0, pausa))
+
+async def medir_leituras_por_operacao(uid, rng):
+    """Leituras/escritas de cada operação isolada (sequencial), com cache frio e quente."""
+    resultado = {}
+    for _, operacao, mensagem in MISTURA:
+        texto = mensagem or rng.choice(TRANSACOES); medida = {}
+        for estado in ("frio", "quente"):
+            if estado == "frio": db.cache.invalidar()
+            antes = db.contadores()
+            await bot.responder(atualizacao_falsa(uid, texto), contexto_falso({}))
+            depois = db.contadores()
+            medida[estado] = {k: depois[k] - antes[k] for k in depois}
+        resultado[operacao] = medida
+    return resultado
+
+async def executar(args):
+    rng = random.Random(args.semente)
+    usuarios = [PRIMEIRO_USER_ID + i for i in range(args.usuarios)]
+    t0 = time.perf_counter()
+    await bot.adb.executar(popular, usuarios, args.historico, rng)
+    print(f"Banco populado: {args.usuarios} usuários x {args.historico} transações em {time.perf_counter() - t0:.1f}s")
+
+    amostras = []; antes = db.contadores(); inicio = time.perf_counter()
+    await asyncio.gather(*(simular_usuario(uid, args.mensagens, random.Random(args.semente + uid), args.latencia_telegram / 1000.0, amostras, args.pausa)
+                           for uid in usuarios))
+    duracao = time.perf_counter() - inicio; depois = db.contadores()
+    por_operacao = await medir_leituras_por_operacao(usuarios[0], rng)
+    return resumir(args, amostras, duracao, {k: depois[k] - antes[k] for k in depois}, por_operacao)
+
+def estatisticas(latencias):
+    latencias = sorted(latencias)
+    return {'n': len(latencias), 'p50_ms': round(percentil(latencias, 50) * 1000, 3), 'p95_ms': round(percentil(latencias, 95) * 1000, 3),
+            'p99_ms': round(percentil(latencias, 99) * 1000, 3), 'max_ms': round(latencias[-1] * 1000, 3) if latencias else 0.0}
+
+def versao_atual():
+    try: return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception: return None
+
+def resumir(args, amostras, duracao, contadores, por_operacao):
+    operacoes = {}
+    for operacao, latencia in amostras: operacoes.setdefault(operacao, []).append(latencia)
+    total = len(amostras)
+    return {
+        'versao': versao_atual(), 'quando': datetime.now().isoformat(timespec='seconds'), 'backend': os.environ.get('DB_BACKEND'),
+        'parametros': {'usuarios': args.usuarios, 'mensagens': args.mensagens, 'historico': args.historico,
+                       'latencia_telegram_ms': args.latencia_telegram, 'pausa_s': args.pausa, 'semente': args.semente},
+        'total': dict(estatisticas([l for _, l in amostras]), duracao_s=round(duracao, 3),
+                      vazao_ops_s=round(total / duracao, 1) if duracao else 0.0,
+                      leituras_por_op=round(contadores['leituras'] / total, 2) if total else 0.0,
+                      escritas_por_op=round(contadores['escritas'] / total, 2) if total else 0.0),
+        'operacoes': {op: estatisticas(lat) for op, lat in sorted(operacoes.items())},
+        'banco_por_operacao': por_operacao,
+        'cache': db.cache.estatisticas(),
+    }
+
+def imprimir(resultado, anterior=None):
+    t = resultado['total']
+    print(f"\n{t['n']} operações em {t['duracao_s']:.2f}s -> {t['vazao_ops_s']:.1f} ops/s | "
+          f"{t['leituras_por_op']:.2f} leituras/op | {t['escritas_por_op']:.2f} escritas/op")
+    print(f"{'operação':<10} {'n':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'leit. frio':>11} {'leit. quente':>13}")
+    for op, e in [('total', t)] + list(resultado['operacoes'].items()):
+        banco = resultado['banco_por_operacao'].get(op, {})
+        frio = banco.get('frio', {}).get('leituras', ''); quente = banco.get('quente', {}).get('leituras', '')
+        linha = f"{op:<10} {e['n']:>6} {e['p50_ms']:>9.2f} {e['p95_ms']:>9.2f} {e['p99_ms']:>9.2f} {frio!s:>11} {quente!s:>13}"
+        if anterior:
+            ant = anterior['total'] if op == 'total' else anterior.get('operacoes', {}).get(op)
+            if ant and ant['p95_ms']: linha += f"   p95 {100.0 * (e['p95_ms'] - ant['p95_ms']) / ant['p95_ms']:+.1f}%"
+        print(linha)
+    if anterior and anterior['total'].get('vazao_ops_s'):
+        print(f"Vazão vs {anterior.get('versao') or 'anterior'}: {100.0 * (t['vazao_ops_s'] - anterior['total']['vazao_ops_s']) / anterior['total']['vazao_ops_s']:+.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--usuarios", type=int, default=50, help="usuários concorrentes")
+    parser.add_argument("--mensagens", type=int, default=40, help="mensagens por usuário")
+    parser.add_argument("--historico", type=int, default=200, help="transações pré-existentes por usuário")
+    parser.add_argument("--latencia-telegram", type=float, default=0.0, help="ms simulados por resposta enviada")
+    parser.add_argument("--pausa", type=float, default=0.0, help="pausa máxima (s) entre mensagens do mesmo usuário")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--saida", help="arquivo JSON com o resultado (ex.: benchmarks/out/atual.json)")
+    parser.add_argument("--comparar", help="JSON de uma rodada anterior, para mostrar a variação")
+    args = parser.parse_args()
+
+    graficos.iniciar() # como no bot: o pool de processos sobe antes das threads do banco
+    try: resultado = asyncio.run(executar(args))
+    finally: graficos.encerrar()
+    anterior = None
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f: anterior = json.load(f)
+    imprimir(resultado, anterior)
+    if args.saida:
+        if os.path.dirname(args.saida): os.makedirs(os.path.dirname(args.saida), exist_ok=True)
+        with open(args.saida, "w", encoding="utf-8") as f: json.dump(resultado, f, ensure_ascii=False, indent=2)
+        print(f"\nResultado salvo em {args.saida}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Micro-benchmark de interpretar_mensagem: implementação anterior x índice pré-compilado.
+
+Uso: python benchmarks/bench_interpretar.py [repeticoes]
+"""
+import os
+import re
+import sys
+import time
+import decimal
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from classificador import MAPEAMENTO_CATEGORIAS, interpretar_mensagem  # noqa: E402
+
+# Mensagens típicas dos usuários (adições simples, cartões, entradas, acentos, plurais, lixo)
+CORPUS = [
+    "150 mercado", "50 lanche", "30 uber", "12 café", "12 cafe", "89,90 ifood nubank", "1.200 aluguel",
+    "2500 salário", "2500 salario empresa", "300 cliente pagou", "45 farmácia remédio", "60 gasolina cartão santander",
+    "15 netflix", "120 internet celular", "200 presente mae", "80 pet ração", "35 padaria pão", "1000 investimento cdb",
+    "40 lanches escola", "25 estacionamento shopping", "90 conta de luz", "70 cartao xp alimentação", "500 venda bolo",
+    "18,50 99 corrida", "250 dentista", "oi tudo bem", "0 nada", "abc", "1.234,56 fatura nubank", "10 pix recebi",
+    "55 barbeiro", "300 material escolar", "22 ônibus metrô", "130 roupas", "75 churrasco amigos",
+]
+
+def _encontrar_legado(palavras: list):
+    for palavra in palavras:
+        for categoria_pai, keywords in MAPEAMENTO_CATEGORIAS.items():
+            if palavra in keywords:
+                return (categoria_pai, palavra.capitalize()) # Retorna (ex: "Alimentação", "Lanche")
+    return (None, None) # Nenhuma palavra-chave encontrada
+
+
+def interpretar_mensagem_legado(texto: str):
+    texto = texto.lower().strip()
+    match = re.search(r"(\d[\d.,]*)", texto)
+    if match:
+        valor_txt = match.group(1).strip(); valor_num = Decimal("0.00")
+        if not valor_txt: return {"acao": "desconhecido"}
+        try: valor_num = Decimal(valor_txt.replace(".", "").replace(",", "."))
+        except decimal.InvalidOperation: return {"acao": "desconhecido"}
+        if valor_num <= 0: return {"acao": "desconhecido"}
+        palavras = texto.split(); palavras_texto = [p for p in palavras if valor_txt not in p]
+        
+        # --- Lógica de Cartão (Sem alteração) ---
+        cartao = None; metodo = "dinheiro"; cartoes_lista = ["nubank", "santander", "inter", "caixa"]; stop_words_cartao = cartoes_lista + ["cartão", "cartao"]
+        for c in cartoes_lista:
+            if c in palavras_texto: cartao = c.capitalize(); metodo = "cartao"; break
+        if cartao is None:
+            idx = -1
+            if "cartão" in palavras_texto: idx = palavras_texto.index("cartão")
+            elif "cartao" in palavras_texto: idx = palavras_texto.index("cartao")
+            if idx != -1:
+                metodo = "cartao"; nome_cartao_palavras = []
+                temp_stop_words = stop_words_cartao + list(MAPEAMENTO_CATEGORIAS.keys())
+                for i in range(idx + 1, len(palavras_texto)):
+                    if palavras_texto[i] not in temp_stop_words: nome_cartao_palavras.append(palavras_texto[i])
+                    else: break
+                if nome_cartao_palavras: cartao = " ".join(nome_cartao_palavras).capitalize()
+                else: cartao = "Cartão"
+        
+        # --- Determina Tipo e Categoria (MODIFICADO) ---
+        entradas_keywords = [kw for cat, kws in MAPEAMENTO_CATEGORIAS.items() if cat in ["Salário", "Vendas", "Outras Entradas", "Investimentos"] for kw in kws]
+        is_entrada = any(p in entradas_keywords for p in palavras_texto)
+        
+        # Encontra a categoria-pai e a descrição (palavra-chave)
+        categoria_pai, descricao_item = _encontrar_legado(palavras_texto)
+        
+        # Define as stopwords gerais
+        stop_words_fallback = stop_words_cartao
+        if cartao: stop_words_fallback.extend(cartao.lower().split())
+
+        # Encontra a primeira palavra (fallback)
+        fallback_word = next((p for p in palavras_texto if p.isalpha() and p not in stop_words_fallback), "Outros")
+
+        if is_entrada:
+            categoria_final = categoria_pai if categoria_pai else "Entrada"
+            # Se a descrição não foi encontrada, usa o fallback. Se não, usa a palavra-chave.
+            descricao_final = descricao_item if descricao_item else fallback_word.capitalize()
+            
+            return {"acao": "add", "tipo": "entrada", "valor_num": valor_num, "valor_txt": valor_txt, 
+                    "categoria": categoria_final.capitalize(), 
+                    "descricao": descricao_final, # <-- NOVO CAMPO
+                    "metodo": metodo, "cartao": cartao}
+        else: # É um gasto
+            categoria_final = categoria_pai if categoria_pai else fallback_word.capitalize()
+            descricao_final = descricao_item if descricao_item else fallback_word.capitalize()
+
+            return {"acao": "add", "tipo": "gasto", "valor_num": valor_num, "valor_txt": valor_txt, 
+                    "categoria": categoria_final.capitalize(), 
+                    "descricao": descricao_final, # <-- NOVO CAMPO
+                    "metodo": metodo, "cartao": cartao}
+    return {"acao": "desconhecido"}
+
+
+def medir(func, repeticoes):
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        for msg in CORPUS: func(msg)
+    duracao = time.perf_counter() - inicio
+    return repeticoes * len(CORPUS) / duracao
+
+def main():
+    repeticoes = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    iguais = sum(interpretar_mensagem_legado(m) == interpretar_mensagem(m) for m in CORPUS)
+    antes = medir(interpretar_mensagem_legado, repeticoes); depois = medir(interpretar_mensagem, repeticoes)
+    print(f"Corpus: {len(CORPUS)} mensagens x {repeticoes} repetições")
+    print(f"Antes (legado):     {antes:12,.0f} msgs/s")
+    print(f"Depois (índice):    {depois:12,.0f} msgs/s  ({depois / antes:.2f}x)")
+    print(f"Resultados idênticos ao legado: {iguais}/{len(CORPUS)} (diferenças = acentos, plurais e chaves compostas)")
+
+if __name__ == "__main__":
+    main()
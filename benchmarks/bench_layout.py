@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Compara os layouts do Firestore ('plano' x 'usuario') nas consultas do bot: latência e leituras.
+
+Roda as mesmas consultas, para os mesmos usuários, contra duas instâncias do FirestoreDatabase
+(uma por layout), sempre no backend (sem o cache de transações). Só faz sentido depois do
+`migrar_layout.py copiar` (os dois layouts com os mesmos dados). Precisa de FIREBASE_CREDENTIALS,
+ou de FIRESTORE_EMULATOR_HOST apontando para o emulador.
+
+Uso:
+    python benchmarks/bench_layout.py --usuarios 20 --repeticoes 5
+    python benchmarks/bench_layout.py --ids 853716041,123 --saida layout.json
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db import FirestoreDatabase  # noqa: E402
+
+def _inicio_mes():
+    return datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+CAMPOS_ULTIMA = ['tipo', 'valor_num', 'categoria', 'cartao', 'data']
+
+# nome -> função(database, user_id); todas consomem o resultado inteiro
+CONSULTAS = {
+    "extrato_completo": lambda d, u: list(d.iter_todas(u)),
+    "ultimos_30_dias": lambda d, u: list(d.iter_todas(u, inicio=datetime.now() - timedelta(days=30))),
+    "pagina_saidas": lambda d, u: d._consultar_pagina(u, "gasto", 10, None, None),
+    "categorias_mes": lambda d, u: d._agrupar_gastos("categoria", u, _inicio_mes(), None),
+    # A mesma consulta do "Último valor" (limpar_transacoes opcao="ultimo")
+    "ultima_transacao": lambda d, u: list(d._contando(d._consulta_transacoes(u).order_by('data', direction='DESCENDING')
+                                                     .limit(1).select(CAMPOS_ULTIMA).stream())),
+}
+
+def percentil(valores, p):
+    """Percentil pelo método nearest-rank (valores já ordenados)."""
+    if not valores: return 0.0
+    return valores[min(len(valores) - 1, max(0, math.ceil(p / 100.0 * len(valores)) - 1))]
+
+def medir(database, usuarios, repeticoes):
+    resultado = {}
+    for nome, consulta in CONSULTAS.items():
+        latencias = []; antes = database.contadores()
+        for _ in range(repeticoes):
+            for user_id in usuarios:
+                inicio = time.perf_counter(); consulta(database, user_id); latencias.append(time.perf_counter() - inicio)
+        depois = database.contadores(); latencias.sort()
+        resultado[nome] = {'n': len(latencias), 'p50_ms': round(percentil(latencias, 50) * 1000, 2),
+                           'p95_ms': round(percentil(latencias, 95) * 1000, 2),
+                           'leituras_por_consulta': round((depois['leituras'] - antes['leituras']) / len(latencias), 2)}
+    return resultado
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--usuarios", type=int, default=20, help="usuários sorteados da coleção 'usuarios'")
+    parser.add_argument("--ids", help="IDs separados por vírgula (no lugar do sorteio)")
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--saida", help="arquivo JSON com o resultado")
+    args = parser.parse_args()
+
+    bancos = {layout: FirestoreDatabase(layout=layout) for layout in FirestoreDatabase.LAYOUTS}
+    if args.ids: usuarios = [int(i) for i in args.ids.split(",")]
+    else:
+        todos = bancos['plano'].listar_usuarios()
+        usuarios = random.Random(args.semente).sample(todos, min(args.usuarios, len(todos)))
+    for database in bancos.values(): medir(database, usuarios[:1], 1) # aquecimento: conexão e canal gRPC
+
+    resultado = {layout: medir(database, usuarios, args.repeticoes) for layout, database in bancos.items()}
+    print(f"{len(usuarios)} usuários x {args.repeticoes} repetições")
+    print(f"{'consulta':<18} {'layout':<8} {'p50 ms':>9} {'p95 ms':>9} {'leituras':>9}")
+    for nome in CONSULTAS:
+        for layout in FirestoreDatabase.LAYOUTS:
+            r = resultado[layout][nome]
+            print(f"{nome:<18} {layout:<8} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['leituras_por_consulta']:>9.2f}")
+        plano, usuario = resultado['plano'][nome], resultado['usuario'][nome]
+        if plano['p95_ms']: print(f"{'':<18} {'Δ p95':<8} {100.0 * (usuario['p95_ms'] - plano['p95_ms']) / plano['p95_ms']:>+8.1f}%")
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump({'quando': datetime.now().isoformat(timespec='seconds'), 'usuarios': usuarios, 'repeticoes': args.repeticoes,
+                       'resultado': resultado}, f, ensure_ascii=False, indent=2)
+        print(f"\nResultado salvo em {args.saida}")
+
+if __name__ == "__main__":
+    main()
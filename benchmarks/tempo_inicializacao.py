@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Tempo de inicialização: quanto custa `import bot`, quebrado por pacote.
+
+Roda `python -X importtime -c "import bot"` num processo novo (várias vezes, para tirar
+a mediana), soma o tempo próprio (self) de cada módulo no seu pacote de topo, em qualquer
+profundidade (telegram.ext conta para telegram mesmo quando é o bot que o importa), e
+mostra os mais pesados, o total de imports e o tempo de parede do processo. Por padrão usa um
+SQLite temporário (DB_BACKEND=sqlite), como o bench_carga.py.
+
+Uso:
+    python benchmarks/tempo_inicializacao.py --rodadas 5 --top 15
+    python benchmarks/tempo_inicializacao.py --modulo db --saida inicio.json --comparar anterior.json
+
+Medido neste repositório (CPython 3, SQLite, sem firebase-admin instalado; mediana de 11
+processos, ms). O commit base (38a5adf) importa firebase_admin no topo do db.py e não sobe sem
+ele; a comparação parte do d8a6eb5, o último antes do import preguiçoso (be6e781), que já
+tinha o backend SQLite. Com firebase-admin instalado o "antes" ainda paga o cliente gRPC.
+
+    pacote          d8a6eb5   be6e781   atual
+    reportlab         109.5         -       -
+    telegram          104.7     103.0    88.6
+    openpyxl           88.2         -       -
+    numpy              60.3         -       -
+    werkzeug           33.4      33.2    26.5
+    db                 27.3      31.9    11.6
+    jinja2             23.9      48.7    35.0
+    httpx              13.8      15.1    11.0
+    bot                12.5      11.7     1.1
+    PIL                11.8         -       -
+    flask              11.6      11.3     9.6
+    imports           699.1     452.7   330.9
+    processo          875.9     593.0   437.8
+
+Os números variam ~10% entre rodadas nesta máquina (jinja2, por exemplo); o que importa é
+reportlab/openpyxl/numpy/PIL saírem do início.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def medir(modulo, ambiente):
+    """Uma rodada: (tempo de parede em s, {pacote: µs próprios}, total de imports em µs)."""
+    inicio = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {modulo}"], cwd=RAIZ, env=ambiente,
+                          capture_output=True, text=True)
+    parede = time.perf_counter() - inicio
+    if proc.returncode != 0:
+        raise SystemExit(f"`import {modulo}` falhou:\n{proc.stderr[-2000:]}")
+    pacotes = {}; total = 0
+    for linha in proc.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"; a indentação marca a profundidade.
+        # Somando o self de cada linha cada µs entra uma vez só, no pacote que o gastou.
+        if not linha.startswith("import time:") or "cumulative" in linha: continue
+        try: proprio, _, nome = linha[len("import time:"):].split("|")
+        except ValueError: continue
+        topo = nome.strip().split(".")[0]; proprio = int(proprio)
+        pacotes[topo] = pacotes.get(topo, 0) + proprio; total += proprio
+    return parede, pacotes, total
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--modulo", default="bot", help="módulo a importar")
+    parser.add_argument("--rodadas", type=int, default=5, help="processos medidos (vale a mediana)")
+    parser.add_argument("--top", type=int, default=15, help="pacotes mostrados")
+    parser.add_argument("--saida", help="arquivo JSON com o resultado")
+    parser.add_argument("--comparar", help="JSON de uma rodada anterior, para mostrar a variação")
+    args = parser.parse_args()
+
+    ambiente = dict(os.environ)
+    if 'DB_BACKEND' not in ambiente:
+        ambiente['DB_BACKEND'] = 'sqlite'
+        ambiente['SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(prefix="tempo_inicio_"), "financeiro.db")
+
+    rodadas = [medir(args.modulo, ambiente) for _ in range(args.rodadas)]
+    nomes = set().union(*(p for _, p, _ in rodadas))
+    pacotes = {n: statistics.median(p.get(n, 0) for _, p, _ in rodadas) / 1000.0 for n in nomes}
+    resultado = {
+        'quando': datetime.now().isoformat(timespec='seconds'), 'modulo': args.modulo, 'backend': ambiente['DB_BACKEND'],
+        'rodadas': args.rodadas, 'parede_ms': round(statistics.median(r[0] for r in rodadas) * 1000, 1),
+        'imports_ms': round(statistics.median(r[2] for r in rodadas) / 1000.0, 1),
+        'pacotes_ms': {n: round(ms, 1) for n, ms in sorted(pacotes.items(), key=lambda i: -i[1])},
+    }
+    anterior = None
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f: anterior = json.load(f)
+
+    print(f"`import {args.modulo}` ({resultado['backend']}, mediana de {args.rodadas}): "
+          f"{resultado['imports_ms']:.1f} ms em imports, {resultado['parede_ms']:.1f} ms de processo")
+    for nome, ms in list(resultado['pacotes_ms'].items())[:args.top]:
+        linha = f"  {nome:<28} {ms:>9.1f} ms"
+        if anterior: linha += f"   ({ms - anterior['pacotes_ms'].get(nome, 0.0):+.1f})"
+        print(linha)
+    if anterior:
+        print(f"Imports vs anterior: {resultado['imports_ms'] - anterior['imports_ms']:+.1f} ms | "
+              f"processo: {resultado['parede_ms'] - anterior['parede_ms']:+.1f} ms")
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f: json.dump(resultado, f, ensure_ascii=False, indent=2)
+        print(f"\nResultado salvo em {args.saida}")
+
+if __name__ == "__main__":
+    main()
@@ -1,157 +1,64 @@
 # -*- coding: utf-8 -*-
 import os
-import re
 import io
+import sys
+import hmac
+import time
+import signal
+import tempfile
+import hashlib
 import decimal
 from decimal import Decimal
 from datetime import datetime, timedelta
 import asyncio
-import pytz # Importa biblioteca de fuso horário
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 
 # Imports do Bot
-from telegram import Update, ReplyKeyboardMarkup, Bot
-from telegram.ext import Application, MessageHandler, filters, ContextTypes, CommandHandler
-from telegram.error import Forbidden, ChatMigrated
-
-# Imports dos Gráficos/Relatórios
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
-from openpyxl import Workbook
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.ext import Application, MessageHandler, filters, ContextTypes, CommandHandler, CallbackQueryHandler
 
 # Import do Flask e Thread
-from flask import Flask
+from flask import Flask, request
 from threading import Thread
 # ----------------------------------------
 
-from db import db # importa a instância do db.py (PostgreSQL)
+from db import db, adb, SnapshotUsuario, agora_local, LOCAL_TIMEZONE # importa a instância do db.py (e a versão assíncrona para os handlers)
+from graficos import graficos # renderização dos gráficos em pool de processos
+from classificador import interpretar_mensagem, interpretar_mensagens, separar_lancamentos # índice de palavras-chave montado na importação
+from broadcast import broadcast_com_relatorio # envio em massa com limite de taxa
+from metricas import metricas, vigiar_loop # /metrics e /healthz
+from despacho import ProcessadorPorChat # chats em paralelo, cada chat em ordem
+from persistencia import PersistenciaBanco # user_data no banco (réplicas e restarts)
+import importacao # extratos CSV/OFX/XLSX enviados como documento
 
 # =======================
 # CONFIGURAÇÃO ADMIN
 # =======================
 ADMIN_USER_ID = 853716041 # ID @maiconjbf
 
-# ===================================================================
-# --- MAPEAMENTO DE CATEGORIAS (Sem alteração) ---
-# ===================================================================
-MAPEAMENTO_CATEGORIAS = {
-    "Alimentação": ["supermercado", "mercado", "lanche", "churrasco", "restaurante", "ifood", "rappi", "padaria", "açougue", "hortifruti", "pizza", "comida", "jantar", "almoço", "café", "bebida"],
-    "Transporte": ["gasolina", "uber", "99", "estacionamento", "ipva", "seguro", "carro", "manutenção", "onibus", "metrô", "passagem", "combustível", "pedagio", "taxi", "aplicativo", "app"],
-    "Moradia": ["aluguel", "condomínio", "iptu", "luz", "água", "internet", "gás", "diarista", "faxina", "energia", "net", "claro", "vivo", "oi", "tim", "conserto", "reparo", "internet celular", "celular internet"],
-    "Construção/Reforma": ["construção", "reforma", "material", "pedreiro", "tinta", "cimento", "leroy", "telhanorte", "ferramenta", "obra", "ferragens"],
-    "Casa/Decoração": ["casa", "decoração", "móvel", "utensílio", "cama", "mesa", "banho", "eletrodoméstico", "manutenção", "casa", "jardinagem", "ikea", "tokstok"],
-    "Saúde": ["farmácia", "remédio", "médico", "consulta", "plano", "saude", "exame", "dentista", "hospital", "terapia", "psicologo"],
-    "Lazer/Entretenimento": ["lazer", "cinema", "show", "bar", "festa", "viagem", "hotel", "streaming", "netflix", "spotify", "hobby", "jogo", "steam", "passeio", "presente", "ingresso", "assinatura", "disney", "hbo"],
-    "Educação": ["escola", "faculdade", "curso", "livro", "material", "escolar", "udemy", "mensalidade", "papelaria"],
-    "Vestuário/Cuidados": ["roupa", "sapato", "tênis", "acessório", "vestido", "calça", "beleza", "cabelereiro", "cosmético", "perfume", "barbeiro"],
-    "Dívidas/Contas": ["fatura", "empréstimo", "juros", "boleto", "imposto", "taxa", "ir", "multa", "cartorio"],
-    "Pets": ["pet", "ração", "veterinário", "petshop", "cachorro", "gato"],
-    "Salário": ["salário", "salario", "pagamento", "holerite"],
-    "Vendas": ["venda", "cliente", "recebimento", "comissao", "serviço", "cliente pagou"],
-    "Investimentos": ["investimento", "ação", "ações", "b3", "fundo", "tesouro", "cdb", "cripto", "resgate", "dividendo", "jcp"],
-    "Outras Entradas": ["entrada", "ganhei", "recebi", "pix", "reembolso", "presente"]
-}
-
-# ===================================================================
-# --- MODIFICAÇÃO: FUNÇÃO HELPER ---
-# ===================================================================
-def encontrar_categoria_e_descricao(palavras: list):
-    """Procura por palavras-chave e retorna a Categoria-Pai E a palavra-chave."""
-    for palavra in palavras:
-        for categoria_pai, keywords in MAPEAMENTO_CATEGORIAS.items():
-            if palavra in keywords:
-                return (categoria_pai, palavra.capitalize()) # Retorna (ex: "Alimentação", "Lanche")
-    return (None, None) # Nenhuma palavra-chave encontrada
-
-LOCAL_TIMEZONE = pytz.timezone('America/Sao_Paulo') # Fuso de Brasília/SP
-
-def formatar_data(data_utc):
-    if data_utc is None: return "Data N/A"
+def formatar_data(data):
+    # As datas do db já vêm no horário de LOCAL_TIMEZONE, sem tzinfo (ver db.data_local)
+    if data is None: return "Data N/A"
     try:
-        if data_utc.tzinfo is None: data_utc = pytz.utc.localize(data_utc)
-        data_local = data_utc.astimezone(LOCAL_TIMEZONE)
-        return data_local.strftime("%d/%m/%Y %H:%M")
+        if data.tzinfo is not None: data = data.astimezone(LOCAL_TIMEZONE)
+        return data.strftime("%d/%m/%Y %H:%M")
     except Exception as e:
-        print(f"Erro ao formatar data {data_utc}: {e}")
-        return str(data_utc)
+        print(f"Erro ao formatar data {data}: {e}")
+        return str(data)
 
 def formatar_valor(valor):
     try: valor_decimal = Decimal(valor)
     except (decimal.InvalidOperation, TypeError, ValueError): valor_decimal = Decimal("0.00")
     return f"{valor_decimal:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
 
-# ===================================================================
-# --- MODIFICAÇÃO: Interpretação de mensagens ---
-# ===================================================================
-def interpretar_mensagem(texto: str):
-    texto = texto.lower().strip()
-    match = re.search(r"(\d[\d.,]*)", texto)
-    if match:
-        valor_txt = match.group(1).strip(); valor_num = Decimal("0.00")
-        if not valor_txt: return {"acao": "desconhecido"}
-        try: valor_num = Decimal(valor_txt.replace(".", "").replace(",", "."))
-        except decimal.InvalidOperation: return {"acao": "desconhecido"}
-        if valor_num <= 0: return {"acao": "desconhecido"}
-        palavras = texto.split(); palavras_texto = [p for p in palavras if valor_txt not in p]
-        
-        # --- Lógica de Cartão (Sem alteração) ---
-        cartao = None; metodo = "dinheiro"; cartoes_lista = ["nubank", "santander", "inter", "caixa"]; stop_words_cartao = cartoes_lista + ["cartão", "cartao"]
-        for c in cartoes_lista:
-            if c in palavras_texto: cartao = c.capitalize(); metodo = "cartao"; break
-        if cartao is None:
-            idx = -1
-            if "cartão" in palavras_texto: idx = palavras_texto.index("cartão")
-            elif "cartao" in palavras_texto: idx = palavras_texto.index("cartao")
-            if idx != -1:
-                metodo = "cartao"; nome_cartao_palavras = []
-                temp_stop_words = stop_words_cartao + list(MAPEAMENTO_CATEGORIAS.keys())
-                for i in range(idx + 1, len(palavras_texto)):
-                    if palavras_texto[i] not in temp_stop_words: nome_cartao_palavras.append(palavras_texto[i])
-                    else: break
-                if nome_cartao_palavras: cartao = " ".join(nome_cartao_palavras).capitalize()
-                else: cartao = "Cartão"
-        
-        # --- Determina Tipo e Categoria (MODIFICADO) ---
-        entradas_keywords = [kw for cat, kws in MAPEAMENTO_CATEGORIAS.items() if cat in ["Salário", "Vendas", "Outras Entradas", "Investimentos"] for kw in kws]
-        is_entrada = any(p in entradas_keywords for p in palavras_texto)
-        
-        # Encontra a categoria-pai e a descrição (palavra-chave)
-        categoria_pai, descricao_item = encontrar_categoria_e_descricao(palavras_texto)
-        
-        # Define as stopwords gerais
-        stop_words_fallback = stop_words_cartao
-        if cartao: stop_words_fallback.extend(cartao.lower().split())
-
-        # Encontra a primeira palavra (fallback)
-        fallback_word = next((p for p in palavras_texto if p.isalpha() and p not in stop_words_fallback), "Outros")
-
-        if is_entrada:
-            categoria_final = categoria_pai if categoria_pai else "Entrada"
-            # Se a descrição não foi encontrada, usa o fallback. Se não, usa a palavra-chave.
-            descricao_final = descricao_item if descricao_item else fallback_word.capitalize()
-            
-            return {"acao": "add", "tipo": "entrada", "valor_num": valor_num, "valor_txt": valor_txt, 
-                    "categoria": categoria_final.capitalize(), 
-                    "descricao": descricao_final, # <-- NOVO CAMPO
-                    "metodo": metodo, "cartao": cartao}
-        else: # É um gasto
-            categoria_final = categoria_pai if categoria_pai else fallback_word.capitalize()
-            descricao_final = descricao_item if descricao_item else fallback_word.capitalize()
-
-            return {"acao": "add", "tipo": "gasto", "valor_num": valor_num, "valor_txt": valor_txt, 
-                    "categoria": categoria_final.capitalize(), 
-                    "descricao": descricao_final, # <-- NOVO CAMPO
-                    "metodo": metodo, "cartao": cartao}
-    return {"acao": "desconhecido"}
-
-
 # ==========================================================
 # --- Teclados (Sem alteração) ---
 # ==========================================================
-def teclado_flutuante(user_id):
-    entradas = db.get_soma(user_id, "entrada"); gastos = db.get_soma(user_id, "gasto"); saldo = entradas - gastos
+async def teclado_flutuante(user_id, snap=None):
+    snap = snap or SnapshotUsuario(adb, user_id)
+    entradas, gastos = await snap.totais(); saldo = entradas - gastos
     status = "🟢😀 Finanças Saudáveis"
     if saldo < 0: status = "🔴😟 Saldo Negativo"
     elif entradas > 0 and (gastos / entradas) > Decimal("0.7"): status = "🟠🤔 Gastos altos!"
@@ -171,6 +78,13 @@ def teclado_admin_usuario_selecionado():
     teclado = [["💰 Entradas", "💸 Saídas"], ["🧾 Saldo Geral"], ["📑 Gerar PDF", "📊 Gerar XLSX"], ["⬅️ Voltar"]]
     return ReplyKeyboardMarkup(teclado, resize_keyboard=True, one_time_keyboard=False)
 
+def teclado_paginacao(alvo_id, tipo, primeira, ultima, tem_anterior, tem_proxima):
+    # callback_data: pg:<e|g>:<user_id>:<a|p>:<data em µs>:<id> (limite do Telegram: 64 bytes; o ID do Firestore tem 20)
+    t = "e" if tipo == "entrada" else "g"; botoes = []
+    if tem_anterior and primeira: botoes.append(InlineKeyboardButton("◀️ Anterior", callback_data=f"pg:{t}:{alvo_id}:a:{cursor_para_texto(primeira)}"))
+    if tem_proxima and ultima: botoes.append(InlineKeyboardButton("Próxima ▶️", callback_data=f"pg:{t}:{alvo_id}:p:{cursor_para_texto(ultima)}"))
+    return InlineKeyboardMarkup([botoes]) if botoes else None
+
 def teclado_filtros_periodo():
     teclado = [["Hoje", "Esta Semana", "Este Mês"], ["Mês Passado", "Este Ano"], ["Cancelar"]]
     return ReplyKeyboardMarkup(teclado, resize_keyboard=True, one_time_keyboard=True)
@@ -178,147 +92,206 @@ def teclado_filtros_periodo():
 # ===================================================================
 # --- MODIFICAÇÃO: Funções de Relatório (PDF, XLSX, Extratos) ---
 # ===================================================================
-# (Atualizadas para mostrar a nova 'descricao' t[7])
+# (Atualizadas para mostrar a nova 'descricao')
+# Os gráficos são desenhados no pool de processos de graficos.py (PNG em bytes, com cache).
 
-def grafico_gastos_pizza(user_id=None, inicio=None, fim=None):
-    # Gráfico de Pizza continua agrupando pela Categoria-Pai (t[3]). Correto.
-    rows = db.gastos_por_categoria(user_id=user_id, inicio=inicio, fim=fim)
+async def grafico_gastos_pizza(user_id=None, inicio=None, fim=None):
+    # Gráfico de Pizza continua agrupando pela Categoria-Pai. Correto.
+    rows = await adb.gastos_por_categoria(user_id=user_id, inicio=inicio, fim=fim)
     if not rows: return None
-    labels = [r[0] for r in rows]; valores = [float(r[1]) for r in rows]; fig, ax = plt.subplots()
-    ax.pie(valores, labels=labels, autopct="%1.1f%%", startangle=90); ax.set_title("Gastos por Categoria (Pai)")
-    buf = io.BytesIO(); plt.savefig(buf, format="png", bbox_inches="tight"); buf.seek(0); plt.close(fig); return buf
+    rows = sorted(rows); labels = [r[0] for r in rows]; valores = [round(float(r[1]), 2) for r in rows]
+    return await graficos.renderizar(user_id, "pizza", (labels, valores))
 
-def grafico_mensal_barras(user_id=None, meses=6):
-    # Sem alteração, pois usa get_soma()
-    labels, entradas_vals, gastos_vals = db.series_mensais(user_id=user_id, meses=meses)
+async def grafico_mensal_barras(user_id=None, meses=6):
+    labels, entradas_vals, gastos_vals = await adb.series_mensais(user_id=user_id, meses=meses)
     if not labels: return None
-    x = list(range(len(labels))); fig, ax = plt.subplots(); width = 0.4
-    ax.bar([i - width/2 for i in x], entradas_vals, width=width, label="Entradas", align="center")
-    ax.bar([i + width/2 for i in x], gastos_vals, width=width, label="Gastos", align="center")
-    ax.set_xticks(x); ax.set_xticklabels(labels, rotation=45); ax.set_ylabel("R$")
-    ax.set_title("Entradas x Gastos por Mês"); ax.legend(); fig.tight_layout()
-    buf = io.BytesIO(); plt.savefig(buf, format="png", bbox_inches="tight"); buf.seek(0); plt.close(fig); return buf
-
-def gerar_pdf(user_id=None, filename="relatorio.pdf", inicio=None, fim=None):
-    doc = SimpleDocTemplate(filename); styles = getSampleStyleSheet(); story = []
-    entradas = db.get_soma(user_id, "entrada", inicio=inicio, fim=fim); gastos = db.get_soma(user_id, "gasto", inicio=inicio, fim=fim); saldo = entradas - gastos
+    return await graficos.renderizar(user_id, "barras", (labels, entradas_vals, gastos_vals))
+
+# Os relatórios são montados em memória (io.BytesIO): nada de arquivo fixo no disco
+# compartilhado entre usuários. Rodam num pool de threads próprio (RELATORIOS_WORKERS), não no
+# do banco: um PDF grande ocupa uma thread por segundos e não pode segurar as leituras do bot.
+_pool_relatorios = ThreadPoolExecutor(max_workers=int(os.environ.get('RELATORIOS_WORKERS', '2')), thread_name_prefix="relatorio")
+
+async def executar_relatorio(func, *args, **kwargs):
+    """Como adb.executar, mas no pool dos relatórios (o contexto vai junto: métricas do handler)."""
+    contexto = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(_pool_relatorios, functools.partial(contexto.run, func, *args, **kwargs))
+
+@metricas.cronometrado("relatorio_segundos", contar_banco=True, formato="pdf")
+def gerar_pdf(user_id=None, inicio=None, fim=None):
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer # import tardio (ver preaquecer)
+    from reportlab.lib.styles import getSampleStyleSheet
+    # Uma única leitura; totais e listas saem das mesmas linhas
+    transacoes = db.get_todas(user_id=user_id, inicio=inicio, fim=fim)
+    trans_e = [t for t in transacoes if t.tipo == "entrada"]; trans_s = [t for t in transacoes if t.tipo == "gasto"]
+    entradas = sum((t.valor for t in trans_e), Decimal("0.00")); gastos = sum((t.valor for t in trans_s), Decimal("0.00")); saldo = entradas - gastos
+    buf = io.BytesIO(); doc = SimpleDocTemplate(buf); styles = getSampleStyleSheet(); story = []
     story.append(Paragraph("📑 Relatório Financeiro", styles["Title"])); story.append(Spacer(1, 20))
     story.append(Paragraph(f"Entradas: R$ {formatar_valor(entradas)}", styles["Normal"])); story.append(Paragraph(f"Gastos: R$ {formatar_valor(gastos)}", styles["Normal"]))
     story.append(Paragraph(f"Saldo: R$ {formatar_valor(saldo)}", styles["Normal"])); story.append(Spacer(1, 20))
     story.append(Paragraph("💰 Entradas:", styles["Heading2"]))
-    trans_e = db.get_todas(user_id=user_id, tipo="entrada", inicio=inicio, fim=fim)
     for t in trans_e:
         try: 
-            # t[3] = Categoria, t[7] = Descrição
-            story.append(Paragraph(f"➡️ R$ {formatar_valor(t[2])} ({t[3]} / {t[7]}) - {t[5] or 'Dinheiro'} - {formatar_data(t[6])}", styles["Normal"]))
+            story.append(Paragraph(f"➡️ R$ {formatar_valor(t.valor)} ({t.categoria} / {t.descricao}) - {t.cartao or 'Dinheiro'} - {formatar_data(t.data)}", styles["Normal"]))
         except (decimal.InvalidOperation, TypeError, ValueError): pass
     story.append(Spacer(1, 20)); story.append(Paragraph("💸 Saídas:", styles["Heading2"]))
-    trans_s = db.get_todas(user_id=user_id, tipo="gasto", inicio=inicio, fim=fim)
     for t in trans_s:
         try: 
-            # t[3] = Categoria, t[7] = Descrição
-            story.append(Paragraph(f"⬅️ R$ {formatar_valor(t[2])} ({t[3]} / {t[7]}) - {t[5] or 'Dinheiro'} - {formatar_data(t[6])}", styles["Normal"]))
+            story.append(Paragraph(f"⬅️ R$ {formatar_valor(t.valor)} ({t.categoria} / {t.descricao}) - {t.cartao or 'Dinheiro'} - {formatar_data(t.data)}", styles["Normal"]))
         except (decimal.InvalidOperation, TypeError, ValueError): pass
-    doc.build(story); return filename
+    doc.build(story); buf.seek(0); return buf
+
+@metricas.cronometrado("relatorio_segundos", contar_banco=True, formato="xlsx")
+def gerar_xlsx(user_id=None, inicio=None, fim=None):
+    from openpyxl import Workbook # import tardio (ver preaquecer)
+    from openpyxl.cell import WriteOnlyCell
+    # Modo write-only: as linhas vão direto para o arquivo, a memória não cresce com o histórico
+    wb = Workbook(write_only=True); ws = wb.create_sheet("Relatório"); num_format = 'R$ #,##0.00'
+
+    def valor_formatado(valor):
+        cell = WriteOnlyCell(ws, value=valor); cell.number_format = num_format; return cell
 
-def gerar_xlsx(user_id=None, filename="relatorio.xlsx", inicio=None, fim=None):
-    wb = Workbook(); ws = wb.active; ws.title = "Relatório"
     # Adiciona a coluna "Descrição"
     ws.append(["Tipo", "Valor", "Categoria (Pai)", "Descrição (Item)", "Método", "Cartão", "Data"])
-    transacoes = db.get_todas(user_id=user_id, inicio=inicio, fim=fim)
+    # Exportação geral (user_id=None) vem em streaming; por usuário, do cache
+    transacoes = db.get_todas(user_id=user_id, inicio=inicio, fim=fim) if user_id else db.iter_todas(None, inicio=inicio, fim=fim)
+    entradas = Decimal("0.00"); gastos = Decimal("0.00")
     for t in transacoes:
-        try: valor_num = Decimal(t[2])
-        except (decimal.InvalidOperation, TypeError, ValueError): valor_num = Decimal("0.00")
-        # Adiciona t[7] (Descrição) na nova coluna
-        ws.append([t[1], valor_num, t[3], t[7], t[4], t[5] or "Dinheiro", formatar_data(t[6])])
-        
-    entradas = db.get_soma(user_id, "entrada", inicio=inicio, fim=fim); gastos = db.get_soma(user_id, "gasto", inicio=inicio, fim=fim); saldo = entradas - gastos
-    ws.append([]); ws.append(["Entradas", entradas]); ws.append(["Gastos", gastos]); ws.append(["Saldo", saldo])
-    num_format = 'R$ #,##0.00'; max_row = ws.max_row
-    # Ajusta o loop para a nova coluna (agora coluna 'B')
-    for cell in ws['B']: cell.number_format = num_format
-    ws[f'B{max_row-2}'].number_format = num_format; ws[f'B{max_row-1}'].number_format = num_format; ws[f'B{max_row}'].number_format = num_format
-    wb.save(filename); return filename
-
-def gastos_por_cartao(user_id):
-    # Sem alteração
-    rows = db.get_gastos_por_cartao(user_id=user_id)
+        if t.tipo == "entrada": entradas += t.valor
+        elif t.tipo == "gasto": gastos += t.valor
+        ws.append([t.tipo, valor_formatado(t.valor), t.categoria, t.descricao, t.metodo, t.cartao or "Dinheiro", formatar_data(t.data)])
+    saldo = entradas - gastos
+    ws.append([]); ws.append(["Entradas", valor_formatado(entradas)]); ws.append(["Gastos", valor_formatado(gastos)]); ws.append(["Saldo", valor_formatado(saldo)])
+    buf = io.BytesIO(); wb.save(buf); buf.seek(0); return buf
+
+# --- Extrato paginado (Ver Entradas / Ver Saídas) ---
+TAMANHO_PAGINA = 15
+_EPOCA = datetime(1970, 1, 1)
+
+def cursor_para_texto(linha):
+    """(data, id) da linha: a data sozinha não separa lançamentos do mesmo instante."""
+    return f"{(linha.data - _EPOCA) // timedelta(microseconds=1)}:{linha.id}"
+
+def cursor_de_texto(texto):
+    micros, id_ = texto.split(":", 1) # botões antigos (só a data) dão ValueError: "Página inválida"
+    if not id_: raise ValueError(texto)
+    return _EPOCA + timedelta(microseconds=int(micros)), id_
+
+def linha_extrato(t, com_cartao=True):
+    seta = "➡️" if t.tipo == "entrada" else "⬅️"
+    cartao = f" - {t.cartao or 'Dinheiro'}" if com_cartao else ""
+    return f"{seta} R$ {formatar_valor(t.valor)} ({t.categoria} / {t.descricao}){cartao} - {formatar_data(t.data)}"
+
+async def pagina_extrato(alvo_id, tipo, titulo, com_cartao, apos=None, antes=None):
+    """Monta (texto, teclado inline) de uma página do extrato; lê só uma página do banco."""
+    linhas, tem_anterior, tem_proxima = await adb.get_pagina(alvo_id, tipo, TAMANHO_PAGINA, apos=apos, antes=antes)
+    if not linhas: return None, None
+    visiveis = [t for t in linhas if t.valor > 0]
+    texto = f"{titulo}\n" + "\n".join(linha_extrato(t, com_cartao) for t in visiveis)
+    return texto, teclado_paginacao(alvo_id, tipo, linhas[0], linhas[-1], tem_anterior, tem_proxima)
+
+@metricas.cronometrado("bot_handler_segundos", contar_banco=True, handler="paginar_extrato")
+async def paginar_extrato(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Callback dos botões Anterior/Próxima do extrato."""
+    query = update.callback_query
+    try:
+        _, t, alvo_id, direcao, cursor = query.data.split(":", 4); alvo_id = int(alvo_id); cursor = cursor_de_texto(cursor)
+    except ValueError:
+        await query.answer("Página inválida."); return
+    if query.from_user.id != alvo_id and query.from_user.id != ADMIN_USER_ID:
+        await query.answer("❌ Sem permissão."); return
+    tipo = "entrada" if t == "e" else "gasto"
+    if query.from_user.id == alvo_id:
+        titulo = "💰 Entradas:" if tipo == "entrada" else "💸 Saídas:"; com_cartao = tipo == "gasto"
+    else:
+        titulo = f"💰 Entradas de {alvo_id}" if tipo == "entrada" else f"💸 Saídas de {alvo_id}"; com_cartao = True
+    texto, teclado = await pagina_extrato(alvo_id, tipo, titulo, com_cartao,
+                                          apos=cursor if direcao == "p" else None, antes=cursor if direcao == "a" else None)
+    if texto is None:
+        await query.answer("Não há mais transações."); return
+    await query.answer()
+    await query.edit_message_text(texto, reply_markup=teclado)
+
+async def gastos_por_cartao(user_id):
+    rows = await adb.get_gastos_por_cartao(user_id=user_id)
     if not rows: return "💳 Gastos por Cartão:\nNenhum gasto registrado."
     texto = "💳 Gastos por Cartão:\n";
     for r in rows: texto += f"▪️ {r[0]}: R$ {formatar_valor(r[1])}\n"
     return texto
 
-def verificar_alerta(user_id):
-    # Sem alteração
-    entradas = db.get_soma(user_id, "entrada"); gastos = db.get_soma(user_id, "gasto"); saldo = entradas - gastos
+async def verificar_alerta(user_id, snap):
+    entradas, gastos = await snap.totais(); saldo = entradas - gastos
     status = None
     if saldo < 0: status = "🔴😟 Saldo Negativo"
     elif entradas > 0 and (gastos / entradas) > Decimal("0.7"): status = "🟠🤔 Gastos altos!"
     if status: return (f"{status}\n💰 Entradas: R$ {formatar_valor(entradas)}\n💸 Gastos: R$ {formatar_valor(gastos)}\n📌 Saldo: R$ {formatar_valor(saldo)}")
     return None
 
-async def enviar_extrato_filtrado(update: Update, context: ContextTypes.DEFAULT_TYPE, inicio: datetime, fim: datetime, titulo_periodo: str):
+async def enviar_extrato_filtrado(update: Update, context: ContextTypes.DEFAULT_TYPE, inicio: datetime, fim: datetime, titulo_periodo: str, snap: SnapshotUsuario):
     user_id = update.message.from_user.id
-    entradas = db.get_todas(user_id, tipo="entrada", inicio=inicio, fim=fim)
-    saidas = db.get_todas(user_id, tipo="gasto", inicio=inicio, fim=fim)
-    entradas_filtradas = [t for t in entradas if t[2] is not None and Decimal(t[2]) > 0]
-    saidas_filtradas = [t for t in saidas if t[2] is not None and Decimal(t[2]) > 0]
-    total_entradas = db.get_soma(user_id, "entrada", inicio=inicio, fim=fim); total_gastos = db.get_soma(user_id, "gasto", inicio=inicio, fim=fim); saldo_periodo = total_entradas - total_gastos
+    # Tudo sai do snapshot: as transações do usuário são lidas uma única vez
+    entradas, saidas, total_entradas, total_gastos = await asyncio.gather(
+        snap.todas("entrada", inicio, fim), snap.todas("gasto", inicio, fim),
+        snap.soma("entrada", inicio, fim), snap.soma("gasto", inicio, fim))
+    entradas_filtradas = [t for t in entradas if t.valor > 0]
+    saidas_filtradas = [t for t in saidas if t.valor > 0]
+    saldo_periodo = total_entradas - total_gastos
     texto = f"🧾 Extrato Filtrado: *{titulo_periodo}*\n\n"
     if not entradas_filtradas and not saidas_filtradas: texto += "Nenhuma transação neste período."
     else:
         if entradas_filtradas:
             texto += "--- *Entradas* ---\n";
-            # Mostra Categoria (t[3]) e Descrição (t[7])
-            for t in entradas_filtradas: texto += f"➡️ R$ {formatar_valor(t[2])} ({t[3]} / {t[7]}) - {formatar_data(t[6])}\n"
+            # Mostra Categoria e Descrição
+            for t in entradas_filtradas: texto += f"➡️ R$ {formatar_valor(t.valor)} ({t.categoria} / {t.descricao}) - {formatar_data(t.data)}\n"
             texto += "\n"
         if saidas_filtradas:
             texto += "--- *Saídas* ---\n"
-            # Mostra Categoria (t[3]) e Descrição (t[7])
-            for t in saidas_filtradas: texto += f"⬅️ R$ {formatar_valor(t[2])} ({t[3]} / {t[7]}) - {t[5] or 'Dinheiro'} - {formatar_data(t[6])}\n"
+            # Mostra Categoria e Descrição
+            for t in saidas_filtradas: texto += f"⬅️ R$ {formatar_valor(t.valor)} ({t.categoria} / {t.descricao}) - {t.cartao or 'Dinheiro'} - {formatar_data(t.data)}\n"
             texto += "\n"
         texto += "--- *Resumo do Período* ---\n"; texto += f"💰 Total Entradas: R$ {formatar_valor(total_entradas)}\n"; texto += f"💸 Total Gastos: R$ {formatar_valor(total_gastos)}\n"; texto += f"📌 Saldo Período: R$ {formatar_valor(saldo_periodo)}\n"
-    await update.message.reply_text(texto, parse_mode='Markdown', reply_markup=teclado_flutuante(user_id))
+    await update.message.reply_text(texto, parse_mode='Markdown', reply_markup=await teclado_flutuante(user_id, snap))
 
-async def enviar_extrato_por_categoria(update: Update, context: ContextTypes.DEFAULT_TYPE, categoria_desejada: str):
+async def enviar_extrato_por_categoria(update: Update, context: ContextTypes.DEFAULT_TYPE, categoria_desejada: str, snap: SnapshotUsuario):
     user_id = update.message.from_user.id
     categoria_lower = categoria_desejada.lower().strip()
-    entradas_todas = db.get_todas(user_id, tipo="entrada")
-    saidas_todas = db.get_todas(user_id, tipo="gasto")
-    entradas_filtradas = [t for t in entradas_todas if t[3].lower() == categoria_lower and t[2] is not None and Decimal(t[2]) > 0]
-    saidas_filtradas = [t for t in saidas_todas if t[3].lower() == categoria_lower and t[2] is not None and Decimal(t[2]) > 0]
-    total_entradas = sum(Decimal(t[2]) for t in entradas_filtradas)
-    total_gastos = sum(Decimal(t[2]) for t in saidas_filtradas)
+    entradas_todas, saidas_todas = await asyncio.gather(snap.todas("entrada"), snap.todas("gasto"))
+    entradas_filtradas = [t for t in entradas_todas if t.categoria.lower() == categoria_lower and t.valor > 0]
+    saidas_filtradas = [t for t in saidas_todas if t.categoria.lower() == categoria_lower and t.valor > 0]
+    total_entradas = sum(t.valor for t in entradas_filtradas)
+    total_gastos = sum(t.valor for t in saidas_filtradas)
     saldo_categoria = total_entradas - total_gastos
     texto = f"🧾 Extrato Filtrado: *Categoria: {categoria_desejada.capitalize()}*\n\n"
     if not entradas_filtradas and not saidas_filtradas:
         texto += "Nenhuma transação encontrada para esta categoria."
-        await update.message.reply_text(texto, parse_mode='Markdown', reply_markup=teclado_flutuante(user_id))
+        await update.message.reply_text(texto, parse_mode='Markdown', reply_markup=await teclado_flutuante(user_id, snap))
         return
     if entradas_filtradas:
         texto += "--- *Entradas* ---\n"
-        # Mostra Categoria (t[3]) e Descrição (t[7])
-        for t in entradas_filtradas: texto += f"➡️ R$ {formatar_valor(t[2])} ({t[3]} / {t[7]}) - {formatar_data(t[6])}\n"
+        # Mostra Categoria e Descrição
+        for t in entradas_filtradas: texto += f"➡️ R$ {formatar_valor(t.valor)} ({t.categoria} / {t.descricao}) - {formatar_data(t.data)}\n"
         texto += "\n"
     if saidas_filtradas:
         texto += "--- *Saídas* ---\n"
-        # Mostra Categoria (t[3]) e Descrição (t[7])
-        for t in saidas_filtradas: texto += f"⬅️ R$ {formatar_valor(t[2])} ({t[3]} / {t[7]}) - {t[5] or 'Dinheiro'} - {formatar_data(t[6])}\n"
+        # Mostra Categoria e Descrição
+        for t in saidas_filtradas: texto += f"⬅️ R$ {formatar_valor(t.valor)} ({t.categoria} / {t.descricao}) - {t.cartao or 'Dinheiro'} - {formatar_data(t.data)}\n"
         texto += "\n"
     texto += f"--- *Resumo da Categoria: {categoria_desejada.capitalize()}* ---\n"
     texto += f"💰 Total Entradas: R$ {formatar_valor(total_entradas)}\n"; texto += f"💸 Total Gastos: R$ {formatar_valor(total_gastos)}\n"; texto += f"📌 Saldo Categoria: R$ {formatar_valor(saldo_categoria)}\n"
-    await update.message.reply_text(texto, parse_mode='Markdown', reply_markup=teclado_flutuante(user_id))
+    await update.message.reply_text(texto, parse_mode='Markdown', reply_markup=await teclado_flutuante(user_id, snap))
 
 # =======================
 # Handlers
 # =======================
+@metricas.cronometrado("bot_handler_segundos", contar_banco=True, handler="start")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id; user_name = update.message.from_user.first_name
     await update.message.reply_text(f"Olá, {user_name}! Bem-vindo(a).\n"
                                      "Digite valor + descrição (ex: '150 mercado').\n"
                                      "Use o teclado para outras opções:",
-                                     reply_markup=teclado_flutuante(user_id))
+                                     reply_markup=await teclado_flutuante(user_id))
 
+@metricas.cronometrado("bot_handler_segundos", contar_banco=True, handler="broadcast_command")
 async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """(Admin) Envia uma mensagem manual para todos os usuários."""
     user_id = update.message.from_user.id
@@ -329,37 +302,124 @@ async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not mensagem_para_enviar:
         await update.message.reply_text("Uso: /broadcast [sua mensagem aqui]")
         return
-    total_usuarios = len(db.listar_usuarios())
-    await update.message.reply_text(f"🚀 Iniciando envio para {total_usuarios} usuários...")
-    await send_broadcast(context.bot, mensagem_para_enviar)
-    await update.message.reply_text("✅ Broadcast manual concluído.")
+    total_usuarios = await adb.contar_usuarios(apenas_ativos=True) # os mesmos alvos do job, sem ler os perfis
+    await update.message.reply_text(f"🚀 Iniciando envio para {total_usuarios} usuários (o progresso será atualizado aqui)...")
+    job_id = f"manual_{datetime.now().strftime('%Y%m%d%H%M%S')}_{update.message.message_id}"
+    await adb.criar_job_broadcast(job_id, mensagem_para_enviar)
+    em_segundo_plano(broadcast_com_relatorio(context.bot, job_id, user_id))
+
+@metricas.cronometrado("bot_handler_segundos", contar_banco=True, handler="recalcular_command")
+async def recalcular_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Recalcula os totais agregados a partir das transações (/recalcular; admin: /recalcular <id> ou todos)."""
+    user_id = update.message.from_user.id
+    alvos = [user_id]
+    if context.args:
+        if user_id != ADMIN_USER_ID:
+            await update.message.reply_text("❌ Você não tem permissão para recalcular outros usuários.")
+            return
+        if context.args[0] == "todos": alvos = await adb.listar_usuarios()
+        elif context.args[0].isdigit(): alvos = [int(context.args[0])]
+        else:
+            await update.message.reply_text("Uso: /recalcular [user_id | todos]")
+            return
+    await asyncio.gather(*(adb.reconstruir_agregado(alvo) for alvo in alvos))
+    await update.message.reply_text(f"✅ Totais recalculados ({len(alvos)} usuário(s)).", reply_markup=await teclado_flutuante(user_id))
+
+@metricas.cronometrado("bot_handler_segundos", contar_banco=True, handler="cache_command")
+async def cache_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """(Admin) Mostra os contadores do cache de transações."""
+    if update.message.from_user.id != ADMIN_USER_ID:
+        await update.message.reply_text("❌ Você não tem permissão para usar este comando.")
+        return
+    e = db.cache.estatisticas(); consultas = e['hits'] + e['misses']
+    taxa = (100.0 * e['hits'] / consultas) if consultas else 0.0
+    await update.message.reply_text(f"🗄️ Cache de transações\nUsuários: {e['usuarios']} | Linhas: {e['linhas']}\n"
+                                    f"Hits: {e['hits']} | Misses: {e['misses']} ({taxa:.1f}% de acerto)\n"
+                                    f"Evictions: {e['evictions']} | Expiradas: {e['expiradas']} | Desatualizadas: {e['desatualizadas']}")
+
+@metricas.cronometrado("bot_handler_segundos", contar_banco=True, handler="importar_extrato")
+async def importar_extrato(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Importa um extrato (CSV, OFX ou XLSX) enviado como documento, em lotes, com progresso na mesma mensagem."""
+    user_id = update.message.from_user.id; user_name = update.message.from_user.first_name
+    documento = update.message.document
+    formato = importacao.formato_arquivo(documento.file_name, documento.mime_type)
+    if formato is None:
+        await update.message.reply_text("❌ Envie o extrato em CSV, OFX ou XLSX (exportado pelo app ou site do banco).")
+        return
+    if (documento.file_size or 0) > importacao.TAMANHO_MAXIMO:
+        await update.message.reply_text(f"❌ Arquivo grande demais (máximo {importacao.TAMANHO_MAXIMO // (1024 * 1024)} MB). Divida o extrato por período.")
+        return
+    aviso = await update.message.reply_text("⏳ Importando o extrato...")
+
+    async def progresso(resumo):
+        try: await aviso.edit_text(f"⏳ Importando o extrato... {resumo['lidas']} linhas lidas, {resumo['novas']} registradas.")
+        except Exception as e: print(f"Progresso da importação não atualizado: {e}")
+
+    with tempfile.TemporaryDirectory(prefix="extrato_") as pasta:
+        caminho = os.path.join(pasta, f"extrato.{formato}")
+        await (await documento.get_file()).download_to_drive(caminho)
+        try: resumo = await importacao.importar(adb, user_id, user_name, caminho, formato, progresso)
+        except importacao.ErroImportacao as e:
+            await aviso.edit_text(f"❌ {e}\nO que já foi registrado continua salvo; reenviar o arquivo não duplica os lançamentos.")
+            return
+    msg_resp = f"✅ Extrato importado: {resumo['novas']} lançamentos registrados de {resumo['lidas']} linhas."
+    if resumo['duplicadas']: msg_resp += f"\n🔁 {resumo['duplicadas']} já tinham sido importados."
+    if resumo['invalidas']: msg_resp += f"\n⚠️ {resumo['invalidas']} linhas sem data ou valor foram ignoradas."
+    try: await aviso.delete()
+    except Exception: pass
+    await update.message.reply_text(msg_resp, reply_markup=await teclado_flutuante(user_id))
 
 # ==========================================================
 # --- MODIFICAÇÃO: Função Responder (Atualizada) ---
 # ==========================================================
+# Rótulo de cada botão nas métricas (bot_responder_segundos{ramo=...})
+RAMOS_BOTOES = {
+    "🗑️ Resetar Valores": "resetar_menu", "Último valor": "resetar", "Hoje": "resetar", "Última semana": "resetar",
+    "Este mês": "resetar", "Tudo": "resetar", "🍕 Gráfico Pizza": "grafico_pizza", "📊 Gráfico Barras": "grafico_barras",
+    "📥 Ver Entradas": "ver_entradas", "📤 Ver Saídas": "ver_saidas", "🗓️ Filtrar por Período": "filtro_periodo_menu",
+    "🏷️ Filtrar por Categoria": "filtro_categoria_menu", "💳 Gastos por Cartão": "gastos_cartao", "⚖️ Saldo Geral": "saldo",
+    "📄 Gerar PDF": "pdf", "📈 Gerar XLSX": "xlsx", "🤖 Quero um robô": "robo", "🧑‍💼 Ver Usuários": "admin_usuarios",
+}
+
+def ramo_responder(user_id, msg, user_data):
+    """Qual ramo do responder vai tratar a mensagem (calculado antes, pois o handler altera user_data)."""
+    if 'aguardando_filtro_categoria' in user_data: return "filtro_categoria"
+    if msg in ("⬅️ Voltar", "Cancelar"): return "cancelar"
+    if user_id == ADMIN_USER_ID and "admin_selecionado" in user_data: return "admin_usuario"
+    if 'aguardando_filtro' in user_data: return "filtro_periodo"
+    if msg not in RAMOS_BOTOES and len(separar_lancamentos(msg)) > 1: return "transacao_lote"
+    return RAMOS_BOTOES.get(msg, "transacao")
+
 async def responder(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    ramo = ramo_responder(update.message.from_user.id, update.message.text, context.user_data)
+    metricas.ultima_atualizacao = time.monotonic()
+    with metricas.cronometrar("bot_responder_segundos", contar_banco=True, ramo=ramo):
+        await _responder(update, context)
+
+async def _responder(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id; user_name = update.message.from_user.first_name
     msg = update.message.text
+    snap = SnapshotUsuario(adb, user_id) # leituras desta atualização
 
     # --- Bloco 1: Capturar resposta do filtro por categoria ---
     if 'aguardando_filtro_categoria' in context.user_data:
         del context.user_data['aguardando_filtro_categoria'] 
         categoria_digitada = msg.strip()
         if categoria_digitada.lower() != "cancelar":
-            await enviar_extrato_por_categoria(update, context, categoria_digitada)
+            await enviar_extrato_por_categoria(update, context, categoria_digitada, snap)
         else:
-             await update.message.reply_text("Filtro por categoria cancelado.", reply_markup=teclado_flutuante(user_id))
+             await update.message.reply_text("Filtro por categoria cancelado.", reply_markup=await teclado_flutuante(user_id, snap))
         return 
     # --- Fim Bloco 1 ---
 
     # --- Handlers Voltar/Cancelar padrão ---
     if msg == "⬅️ Voltar" and user_id == ADMIN_USER_ID:
         if "admin_selecionado" in context.user_data: del context.user_data["admin_selecionado"]
-        await update.message.reply_text("Voltando...", reply_markup=teclado_flutuante(user_id)); return
+        await update.message.reply_text("Voltando...", reply_markup=await teclado_flutuante(user_id, snap)); return
     if msg == "Cancelar":
         if 'aguardando_filtro' in context.user_data: del context.user_data['aguardando_filtro']
         if 'aguardando_filtro_categoria' in context.user_data: del context.user_data['aguardando_filtro_categoria']
-        await update.message.reply_text("Ação cancelada.", reply_markup=teclado_flutuante(user_id)); return
+        await update.message.reply_text("Ação cancelada.", reply_markup=await teclado_flutuante(user_id, snap)); return
 
     # --- Bloco Admin (MODIFICADO para mostrar descrição) ---
     if user_id == ADMIN_USER_ID and "admin_selecionado" in context.user_data:
@@ -367,77 +427,68 @@ async def responder(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if 'aguardando_filtro' in context.user_data: del context.user_data['aguardando_filtro']
         
         if msg == "💰 Entradas":
-            transacoes = db.get_todas(user_id=selecionado_id, tipo="entrada")
-            filtradas = [t for t in transacoes if t[2] is not None and Decimal(t[2]) > 0] 
-            # Mostra Categoria (t[3]) e Descrição (t[7])
-            texto = f"💰 Entradas de {selecionado_nome}\n" + "\n".join([f"➡️ R$ {formatar_valor(t[2])} ({t[3]} / {t[7]}) - {t[5] or 'Dinheiro'} - {formatar_data(t[6])}" for t in filtradas]);
-            if not filtradas: texto = f"{selecionado_nome} não tem entradas."; 
-            await update.message.reply_text(texto, reply_markup=teclado_admin_usuario_selecionado())
+            # Primeira página; as demais vêm pelos botões inline (paginar_extrato)
+            texto, teclado = await pagina_extrato(selecionado_id, "entrada", f"💰 Entradas de {selecionado_nome}", True)
+            if texto is None: await update.message.reply_text(f"{selecionado_nome} não tem entradas.", reply_markup=teclado_admin_usuario_selecionado())
+            else: await update.message.reply_text(texto, reply_markup=teclado or teclado_admin_usuario_selecionado())
         elif msg == "💸 Saídas":
-            transacoes = db.get_todas(user_id=selecionado_id, tipo="gasto")
-            filtradas = [t for t in transacoes if t[2] is not None and Decimal(t[2]) > 0] 
-            # Mostra Categoria (t[3]) e Descrição (t[7])
-            texto = f"💸 Saídas de {selecionado_nome}\n" + "\n".join([f"⬅️ R$ {formatar_valor(t[2])} ({t[3]} / {t[7]}) - {t[5] or 'Dinheiro'} - {formatar_data(t[6])}" for t in filtradas]);
-            if not filtradas: texto = f"{selecionado_nome} não tem saídas."; 
-            await update.message.reply_text(texto, reply_markup=teclado_admin_usuario_selecionado())
+            texto, teclado = await pagina_extrato(selecionado_id, "gasto", f"💸 Saídas de {selecionado_nome}", True)
+            if texto is None: await update.message.reply_text(f"{selecionado_nome} não tem saídas.", reply_markup=teclado_admin_usuario_selecionado())
+            else: await update.message.reply_text(texto, reply_markup=teclado or teclado_admin_usuario_selecionado())
         elif msg == "🧾 Saldo Geral":
-            entradas = db.get_soma(selecionado_id, "entrada"); gastos = db.get_soma(selecionado_id, "gasto"); saldo = entradas - gastos
+            entradas, gastos = await asyncio.gather(adb.get_soma(selecionado_id, "entrada"), adb.get_soma(selecionado_id, "gasto")); saldo = entradas - gastos
             await update.message.reply_text(f"Saldo de {selecionado_nome}\n💰 Entradas: R$ {formatar_valor(entradas)}\n💸 Gastos: R$ {formatar_valor(gastos)}\n📌 Saldo: R$ {formatar_valor(saldo)}", reply_markup=teclado_admin_usuario_selecionado())
         elif msg == "📑 Gerar PDF": 
-            filename = gerar_pdf(selecionado_id, f"rel_{selecionado_id}.pdf"); await update.message.reply_document(open(filename, "rb"), caption=f"PDF de {selecionado_nome}", reply_markup=teclado_admin_usuario_selecionado()); os.remove(filename)
+            buf = await executar_relatorio(gerar_pdf, selecionado_id); await update.message.reply_document(buf, filename=f"rel_{selecionado_id}.pdf", caption=f"PDF de {selecionado_nome}", reply_markup=teclado_admin_usuario_selecionado())
         elif msg == "📊 Gerar XLSX": 
-            filename = gerar_xlsx(selecionado_id, f"rel_{selecionado_id}.xlsx"); await update.message.reply_document(open(filename, "rb"), caption=f"XLSX de {selecionado_nome}", reply_markup=teclado_admin_usuario_selecionado()); os.remove(filename)
+            buf = await executar_relatorio(gerar_xlsx, selecionado_id); await update.message.reply_document(buf, filename=f"rel_{selecionado_id}.xlsx", caption=f"XLSX de {selecionado_nome}", reply_markup=teclado_admin_usuario_selecionado())
         else: 
             await update.message.reply_text("Inválido.", reply_markup=teclado_admin_usuario_selecionado())
         return
 
     # --- Resposta Filtro Período (Sem alteração) ---
     if 'aguardando_filtro' in context.user_data:
-        del context.user_data['aguardando_filtro']; hoje = datetime.now()
+        del context.user_data['aguardando_filtro']; hoje = agora_local()
         titulo_periodo = msg
         if msg == "Hoje": inicio = fim = hoje
         elif msg == "Esta Semana": inicio = hoje - timedelta(days=hoje.weekday()); fim = inicio + timedelta(days=6)
         elif msg == "Este Mês": inicio = hoje.replace(day=1); fim = (inicio + timedelta(days=32)).replace(day=1) - timedelta(days=1)
         elif msg == "Mês Passado": fim = hoje.replace(day=1) - timedelta(days=1); inicio = fim.replace(day=1)
         elif msg == "Este Ano": inicio = hoje.replace(day=1, month=1); fim = hoje.replace(day=31, month=12)
-        else: await update.message.reply_text("Filtro cancelado.", reply_markup=teclado_flutuante(user_id)); return
-        await enviar_extrato_filtrado(update, context, inicio, fim, titulo_periodo); return
+        else: await update.message.reply_text("Filtro cancelado.", reply_markup=await teclado_flutuante(user_id, snap)); return
+        await enviar_extrato_filtrado(update, context, inicio, fim, titulo_periodo, snap); return
 
     # --- Lógica Usuário Comum (MODIFICADA para mostrar descrição) ---
     if msg == "🗑️ Resetar Valores": 
         await update.message.reply_text("Período para resetar:", reply_markup=ReplyKeyboardMarkup([["Último valor", "Hoje"], ["Última semana", "Este mês"], ["Tudo"], ["Cancelar"]], resize_keyboard=True, one_time_keyboard=True)); return
     elif msg in ["Último valor", "Hoje", "Última semana", "Este mês", "Tudo"]: 
-        mapa = {"Último valor":"ultimo","Hoje":"dia","Última semana":"semana","Este mês":"mes","Tudo":"tudo"}; db.limpar_transacoes(user_id, mapa[msg]); await update.message.reply_text(f"✅ Removido ({msg})", reply_markup=teclado_flutuante(user_id)); return
+        mapa = {"Último valor":"ultimo","Hoje":"dia","Última semana":"semana","Este mês":"mes","Tudo":"tudo"}; resumo = await adb.limpar_transacoes(user_id, mapa[msg]); snap.invalidar()
+        aviso_falhas = f"\n⚠️ {resumo['falhas']} transação(ões) não puderam ser removidas agora; tente de novo." if resumo.get('falhas') else ""
+        if not resumo['removidos']: await update.message.reply_text(f"Nada para remover ({msg}).{aviso_falhas}", reply_markup=await teclado_flutuante(user_id, snap)); return
+        await update.message.reply_text(f"✅ Removido ({msg}): {resumo['removidos']} transação(ões)\n💰 Entradas: R$ {formatar_valor(resumo['entrada'])}\n💸 Gastos: R$ {formatar_valor(resumo['gasto'])}{aviso_falhas}", reply_markup=await teclado_flutuante(user_id, snap)); return
 
     if msg == "🍕 Gráfico Pizza": 
-        buf = grafico_gastos_pizza(user_id); await update.message.reply_photo(buf, caption="💸 Gastos por Categoria", reply_markup=teclado_flutuante(user_id)) if buf else await update.message.reply_text("Nenhum gasto.", reply_markup=teclado_flutuante(user_id)); return
+        buf = await grafico_gastos_pizza(user_id); await update.message.reply_photo(buf, caption="💸 Gastos por Categoria", reply_markup=await teclado_flutuante(user_id, snap)) if buf else await update.message.reply_text("Nenhum gasto.", reply_markup=await teclado_flutuante(user_id, snap)); return
     if msg == "📊 Gráfico Barras": 
-        buf = grafico_mensal_barras(user_id); await update.message.reply_photo(buf, caption="📊 Entradas x Gastos", reply_markup=teclado_flutuante(user_id)) if buf else await update.message.reply_text("Nenhuma transação.", reply_markup=teclado_flutuante(user_id)); return
+        buf = await grafico_mensal_barras(user_id); await update.message.reply_photo(buf, caption="📊 Entradas x Gastos", reply_markup=await teclado_flutuante(user_id, snap)) if buf else await update.message.reply_text("Nenhuma transação.", reply_markup=await teclado_flutuante(user_id, snap)); return
 
     if msg == "📥 Ver Entradas": 
-        transacoes = db.get_todas(user_id=user_id, tipo="entrada")
-        filtradas = [t for t in transacoes if t[2] is not None and Decimal(t[2]) > 0]
-        # Mostra Categoria (t[3]) e Descrição (t[7])
-        await update.message.reply_text("Nenhuma entrada.", reply_markup=teclado_flutuante(user_id)) if not filtradas else await update.message.reply_text("💰 Entradas:\n" + "\n".join([f"➡️ R$ {formatar_valor(t[2])} ({t[3]} / {t[7]}) - {formatar_data(t[6])}" for t in filtradas]), reply_markup=teclado_flutuante(user_id)); return
+        # Só a primeira página é lida; "Próxima ▶️" busca a seguinte pelo cursor
+        texto, teclado = await pagina_extrato(user_id, "entrada", "💰 Entradas:", False)
+        await update.message.reply_text("Nenhuma entrada.", reply_markup=await teclado_flutuante(user_id, snap)) if texto is None else await update.message.reply_text(texto, reply_markup=teclado or await teclado_flutuante(user_id, snap)); return
     
     if msg == "📤 Ver Saídas": 
-        transacoes = db.get_todas(user_id=user_id, tipo="gasto")
-        filtradas = [t for t in transacoes if t[2] is not None and Decimal(t[2]) > 0]
-        # Mostra Categoria (t[3]) e Descrição (t[7])
-        await update.message.reply_text("Nenhuma saída.", reply_markup=teclado_flutuante(user_id)) if not filtradas else await update.message.reply_text("💸 Saídas:\n" + "\n".join([f"⬅️ R$ {formatar_valor(t[2])} ({t[3]} / {t[7]}) - {t[5] or 'Dinheiro'} - {formatar_data(t[6])}" for t in filtradas]), reply_markup=teclado_flutuante(user_id)); return
+        texto, teclado = await pagina_extrato(user_id, "gasto", "💸 Saídas:", True)
+        await update.message.reply_text("Nenhuma saída.", reply_markup=await teclado_flutuante(user_id, snap)) if texto is None else await update.message.reply_text(texto, reply_markup=teclado or await teclado_flutuante(user_id, snap)); return
 
     if msg == "🗓️ Filtrar por Período": 
         context.user_data['aguardando_filtro'] = True; await update.message.reply_text("Selecione o período:", reply_markup=teclado_filtros_periodo()); return
 
     if msg == "🏷️ Filtrar por Categoria":
         context.user_data['aguardando_filtro_categoria'] = True 
-        trans_gastos = db.get_todas(user_id=user_id, tipo="gasto")
-        trans_entradas = db.get_todas(user_id=user_id, tipo="entrada")
-        cats_gasto = {t[3] for t in trans_gastos if t[2] is not None and Decimal(t[2]) > 0}
-        cats_entrada = {t[3] for t in trans_entradas if t[2] is not None and Decimal(t[2]) > 0}
-        categorias_unicas = sorted(list(cats_gasto.union(cats_entrada)))
+        categorias_unicas = await snap.categorias()
         if not categorias_unicas:
-            await update.message.reply_text("Nenhuma categoria registrada ainda.", reply_markup=teclado_flutuante(user_id))
+            await update.message.reply_text("Nenhuma categoria registrada ainda.", reply_markup=await teclado_flutuante(user_id, snap))
             del context.user_data['aguardando_filtro_categoria']; return
         
         teclado_categorias = []; linha_atual = []
@@ -449,43 +500,47 @@ async def responder(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Selecione uma categoria para filtrar:", reply_markup=ReplyKeyboardMarkup(teclado_categorias, resize_keyboard=True, one_time_keyboard=True)); return
 
     if msg == "💳 Gastos por Cartão": 
-        texto = gastos_por_cartao(user_id); await update.message.reply_text(texto, reply_markup=teclado_flutuante(user_id)); return
+        texto = await gastos_por_cartao(user_id); await update.message.reply_text(texto, reply_markup=await teclado_flutuante(user_id, snap)); return
     if msg == "⚖️ Saldo Geral":
-        entradas = db.get_soma(user_id, "entrada"); gastos = db.get_soma(user_id, "gasto"); saldo = entradas - gastos
+        entradas, gastos = await snap.totais(); saldo = entradas - gastos
         status = "🟢😀 Saudável";
         if saldo < 0: status = "🔴😟 Negativo"
         elif entradas > 0 and (gastos / entradas) > Decimal("0.7"): status = "🟠🤔 Gastos altos!"
-        await update.message.reply_text((f"🧾 Saldo Geral\n💰 Entradas: R$ {formatar_valor(entradas)}\n💸 Gastos: R$ {formatar_valor(gastos)}\n📌 Saldo: R$ {formatar_valor(saldo)}\n\nStatus: {status}"), reply_markup=teclado_flutuante(user_id)); return
+        await update.message.reply_text((f"🧾 Saldo Geral\n💰 Entradas: R$ {formatar_valor(entradas)}\n💸 Gastos: R$ {formatar_valor(gastos)}\n📌 Saldo: R$ {formatar_valor(saldo)}\n\nStatus: {status}"), reply_markup=await teclado_flutuante(user_id, snap)); return
 
     if msg == "📄 Gerar PDF": 
-        filename = gerar_pdf(user_id); await update.message.reply_document(open(filename, "rb"), reply_markup=teclado_flutuante(user_id)); os.remove(filename); return
+        buf = await executar_relatorio(gerar_pdf, user_id); await update.message.reply_document(buf, filename="relatorio.pdf", reply_markup=await teclado_flutuante(user_id, snap)); return
     if msg == "📈 Gerar XLSX": 
-        filename = gerar_xlsx(user_id); await update.message.reply_document(open(filename, "rb"), reply_markup=teclado_flutuante(user_id)); os.remove(filename); return
+        buf = await executar_relatorio(gerar_xlsx, user_id); await update.message.reply_document(buf, filename="relatorio.xlsx", reply_markup=await teclado_flutuante(user_id, snap)); return
 
     if msg == "🤖 Quero um robô":
         await update.message.reply_text(
             "Ótima ideia! Eu também posso criar um robô personalizado para você ou sua empresa.\n\n"
             "Me chame no Telegram para discutir seu projeto: 👉 https://t.me/maicon_junio",
-            reply_markup=teclado_flutuante(user_id) 
+            reply_markup=await teclado_flutuante(user_id, snap) 
         )
         return
 
     if msg == "🧑‍💼 Ver Usuários" and user_id == ADMIN_USER_ID: 
-        lista_id_nome = db.listar_usuarios_com_nome() # <-- USA A FUNÇÃO CORRETA
+        lista_id_nome = await adb.listar_usuarios_com_nome() # <-- USA A FUNÇÃO CORRETA
         if not lista_id_nome: 
-            await update.message.reply_text("Nenhum usuário.", reply_markup=teclado_flutuante(user_id)); return
+            await update.message.reply_text("Nenhum usuário.", reply_markup=await teclado_flutuante(user_id, snap)); return
         teclado_usuarios = [[f"{u[0]} - {u[1]}"] for u in lista_id_nome] + [["⬅️ Voltar"]]
         await update.message.reply_text("Gerenciar usuário:", reply_markup=ReplyKeyboardMarkup(teclado_usuarios, resize_keyboard=True, one_time_keyboard=True)); return
     
     if user_id == ADMIN_USER_ID and " - " in msg and msg.split(" - ")[0].isdigit(): 
         selecionado_id = int(msg.split(" - ")[0]); selecionado_nome = msg.split(" - ")[1]; context.user_data["admin_selecionado"] = (selecionado_id, selecionado_nome); await update.message.reply_text(f"Gerenciando: {selecionado_nome}.", reply_markup=teclado_admin_usuario_selecionado()); return
 
+    # --- Várias transações numa mensagem (uma por linha ou separadas por ';') ---
+    partes = interpretar_mensagens(msg)
+    if len(partes) > 1: await adicionar_lote(update, user_id, user_name, partes, snap); return
+
     # --- Interpretação de Mensagem (Adicionar transação) ---
     # --- MODIFICADO para passar a 'descricao' ---
     resultado = interpretar_mensagem(msg)
     if resultado["acao"] == "add":
         # Passa a nova 'descricao' para o banco
-        db.add_transacao(
+        linha = await adb.add_transacao(
             user_id, resultado["tipo"], resultado["valor_num"], resultado["valor_txt"], 
             resultado["categoria"], resultado["descricao"], # <-- NOVO ARGUMENTO
             resultado["metodo"], resultado["cartao"], user_name
@@ -493,11 +548,54 @@ async def responder(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Mostra a Categoria (Pai) e a Descrição (Item) na confirmação
         msg_resp = f"✅ {resultado['tipo'].capitalize()} R$ {formatar_valor(resultado['valor_num'])} (Cat: {resultado['categoria']} / {resultado['descricao']})"
         if resultado['cartao']: msg_resp += f"\n💳 Cartão: {resultado['cartao']}"
-        alerta = verificar_alerta(user_id)
+        snap.registrar(linha) # aplica a escrita no snapshot: alerta e teclado não releem o banco
+        alerta = await verificar_alerta(user_id, snap)
         if alerta: msg_resp += f"\n\n{alerta}"
-        await update.message.reply_text(msg_resp, reply_markup=teclado_flutuante(user_id))
+        await update.message.reply_text(msg_resp, reply_markup=await teclado_flutuante(user_id, snap))
     else:
-        await update.message.reply_text("❌ Não entendi. Digite valor + descrição (ex: '50 lanche').", reply_markup=teclado_flutuante(user_id))
+        await update.message.reply_text("❌ Não entendi. Digite valor + descrição (ex: '50 lanche').", reply_markup=await teclado_flutuante(user_id, snap))
+
+MAX_LANCAMENTOS_MENSAGEM = 50
+
+# A confirmação de um lote cabe numa mensagem do Telegram (4096 caracteres): lista os primeiros
+# lançamentos e linhas não entendidas, com descrições encurtadas, e resume o resto em "e mais N".
+MAX_LISTADOS = 15
+MAX_IGNORADAS = 10
+MAX_TEXTO_ITEM = 60
+
+def _encurtar(texto, limite=MAX_TEXTO_ITEM):
+    texto = " ".join(str(texto).split())
+    return texto if len(texto) <= limite else texto[:limite - 1] + "…"
+
+def texto_confirmacao_lote(registrados, lancamentos, excedentes, ignoradas):
+    """Texto da confirmação de adicionar_lote (sem o saldo/alerta)."""
+    msg_resp = f"✅ {registrados} lançamentos registrados:"
+    for r in lancamentos[:MAX_LISTADOS]:
+        msg_resp += f"\n{'📥' if r['tipo'] == 'entrada' else '📤'} R$ {formatar_valor(r['valor_num'])} ({_encurtar(r['categoria'])} / {_encurtar(r['descricao'])})"
+        if r['cartao']: msg_resp += f" 💳 {_encurtar(r['cartao'])}"
+    if len(lancamentos) > MAX_LISTADOS: msg_resp += f"\n… e mais {len(lancamentos) - MAX_LISTADOS}"
+    if excedentes:
+        msg_resp += f"\n\n⚠️ Só os primeiros {MAX_LANCAMENTOS_MENSAGEM} foram registrados; envie o restante em outra mensagem."
+    if ignoradas:
+        msg_resp += "\n\n❌ Não entendi: " + "; ".join(_encurtar(parte) for parte in ignoradas[:MAX_IGNORADAS])
+        if len(ignoradas) > MAX_IGNORADAS: msg_resp += f" e mais {len(ignoradas) - MAX_IGNORADAS}"
+    return msg_resp
+
+async def adicionar_lote(update, user_id, user_name, partes, snap):
+    """Grava todos os lançamentos entendidos num único commit e responde com uma confirmação só."""
+    entendidos = [r for _, r in partes if r["acao"] == "add"]; lancamentos = entendidos[:MAX_LANCAMENTOS_MENSAGEM]
+    ignoradas = [parte for parte, r in partes if r["acao"] != "add"]
+    if not lancamentos:
+        await update.message.reply_text("❌ Não entendi nenhuma linha. Digite valor + descrição, uma por linha (ex: '50 lanche').",
+                                        reply_markup=await teclado_flutuante(user_id, snap)); return
+    linhas = await adb.add_transacoes(user_id, lancamentos, user_name)
+    for linha in linhas: snap.registrar(linha) # alerta, saldo e teclado sem reler o banco
+    msg_resp = texto_confirmacao_lote(len(linhas), lancamentos, len(entendidos) > MAX_LANCAMENTOS_MENSAGEM, ignoradas)
+    alerta = await verificar_alerta(user_id, snap) # já traz o saldo quando há alerta
+    if alerta: msg_resp += f"\n\n{alerta}"
+    else:
+        entradas, gastos = await snap.totais(); msg_resp += f"\n\n⚖️ Saldo: R$ {formatar_valor(entradas - gastos)}"
+    await update.message.reply_text(msg_resp, reply_markup=await teclado_flutuante(user_id, snap))
 
 # ===================================================================
 # --- Lógica de Inicialização e Broadcast (Sem alteração) ---
@@ -512,44 +610,155 @@ O bot foi atualizado com novas melhorias e correções.
 Obrigado por usar!
 """
 
-async def send_broadcast(bot: Bot, message: str):
-    user_ids = db.listar_usuarios() # Chama a função correta (só IDs)
-    if not user_ids:
-        print("Broadcast: Nenhum usuário encontrado para enviar.")
-        return
-    print(f"Iniciando broadcast para {len(user_ids)} usuários...")
-    for user_id in user_ids:
-        try:
-            await bot.send_message(chat_id=user_id, text=message)
-            print(f"Sucesso: Mensagem enviada para {user_id}")
-            await asyncio.sleep(0.1) 
-        except Forbidden: print(f"Falha: Usuário {user_id} bloqueou o bot.")
-        except ChatMigrated as e: print(f"Falha: Chat {user_id} migrou para {e.new_chat_id}")
-        except Exception as e: print(f"Falha: Erro desconhecido com user_id {user_id}: {e}")
-    print("Broadcast concluído.")
-
-def run_telegram_bot_thread(app: Application):
-    """Função alvo da Thread: cria um loop asyncio e roda a lógica principal."""
-    loop = asyncio.new_event_loop()
+# Depois disso o aviso de deploy não é mais enviado (nem retomado): virou notícia velha
+BROADCAST_DEPLOY_MAX_HORAS = float(os.environ.get('BROADCAST_DEPLOY_MAX_HORAS', '24'))
+
+# Segundos entre o início do polling e o pré-aquecimento (conexão do banco + libs de relatório)
+PREAQUECER_ATRASO = float(os.environ.get('PREAQUECER_ATRASO', '1'))
+
+# Tarefas em segundo plano (referência forte para não serem coletadas)
+_tarefas_fundo = set()
+
+def em_segundo_plano(coro):
+    tarefa = asyncio.get_running_loop().create_task(coro)
+    _tarefas_fundo.add(tarefa); tarefa.add_done_callback(_tarefas_fundo.discard)
+    return tarefa
+
+def deploy_expirado(job):
+    return time.time() - (job.get('criado_ts') or 0) > BROADCAST_DEPLOY_MAX_HORAS * 3600
+
+async def broadcast_de_deploy(application: Application):
+    """Envia o aviso de atualização quando o commit mudou (sem atrasar o polling).
+
+    Várias réplicas sobem juntas: todas criam (ou encontram) o mesmo job e só a que pega o
+    lease envia. Um job deste commit que ficou pela metade é retomado mesmo depois de o hash
+    ter sido salvo, até BROADCAST_DEPLOY_MAX_HORAS depois de criado."""
+    current_commit = os.environ.get("RENDER_GIT_COMMIT")
+    last_commit_sent = await adb.get_config("last_commit_hash")
+    print(f"Commit Atual (Render): {current_commit}")
+    print(f"Último Commit (Banco): {last_commit_sent}")
+    if not current_commit:
+        print("Inicialização normal (sem broadcast)."); return
+    # Job idempotente por commit: se o processo reiniciar no meio, é retomado (não recomeça)
+    job_id = f"deploy_{current_commit}"
+    if current_commit != last_commit_sent:
+        print("Detectado novo deploy! Enviando broadcast em segundo plano...")
+        job = await adb.criar_job_broadcast(job_id, BROADCAST_MESSAGE)
+    else:
+        job = await adb.get_job_broadcast(job_id)
+    if job is None or job.get('status') not in ('pendente', 'executando'):
+        print("Inicialização normal (sem broadcast).")
+    elif deploy_expirado(job):
+        print(f"Broadcast {job_id} criado há mais de {BROADCAST_DEPLOY_MAX_HORAS:g} h: expirado, não será enviado.")
+        await adb.atualizar_job_broadcast(job_id, {'status': 'expirado'})
+    else:
+        await broadcast_com_relatorio(application.bot, job_id, ADMIN_USER_ID)
+    if current_commit != last_commit_sent:
+        await adb.set_config("last_commit_hash", current_commit)
+        print("Hash do commit salvo.")
+
+async def retomar_broadcasts(application: Application):
+    """Retoma jobs manuais interrompidos por um restart. O de deploy do commit atual fica com
+    broadcast_de_deploy; os de commits anteriores expiram (o aviso já não vale)."""
+    commit_atual = os.environ.get("RENDER_GIT_COMMIT")
+    for job_id in await adb.listar_jobs_pendentes():
+        if job_id == f"deploy_{commit_atual}": continue
+        if job_id.startswith("deploy_"):
+            print(f"Broadcast {job_id} é de um deploy anterior: expirado.")
+            await adb.atualizar_job_broadcast(job_id, {'status': 'expirado'}); continue
+        print(f"Retomando broadcast pendente: {job_id}")
+        await broadcast_com_relatorio(application.bot, job_id, ADMIN_USER_ID)
+
+def _importar_relatorios():
+    import reportlab.platypus, reportlab.lib.styles, openpyxl, openpyxl.cell # noqa: F401
+
+async def preaquecer(atraso=PREAQUECER_ATRASO):
+    """Depois que o polling sobe: conecta o banco e importa reportlab/openpyxl no pool dos relatórios,
+    para que a primeira mensagem e o primeiro relatório não paguem esse custo."""
+    await asyncio.sleep(atraso)
+    for nome, tarefa in (("banco", adb.conectar), ("relatorios", lambda: executar_relatorio(_importar_relatorios))):
+        inicio = time.perf_counter()
+        try: await tarefa()
+        except Exception as e: print(f"Pré-aquecimento ({nome}) falhou: {e}"); continue
+        print(f"Pré-aquecimento ({nome}): {time.perf_counter() - inicio:.2f}s")
+
+async def ao_iniciar(application: Application):
+    em_segundo_plano(vigiar_loop()) # atraso do event loop e batimento para o /healthz
+    em_segundo_plano(preaquecer())
+    em_segundo_plano(broadcast_de_deploy(application))
+    em_segundo_plano(retomar_broadcasts(application))
+
+async def ao_encerrar(application: Application):
+    """Depois que o Application parou (e a persistência já gravou): esvazia a fila write-behind do banco."""
+    await adb.encerrar()
+    print("Escritas pendentes gravadas.")
+
+def run_telegram_bot_thread(app: Application, loop):
+    """Função alvo da Thread: usa o loop asyncio criado pela thread principal e roda o polling."""
     asyncio.set_event_loop(loop)
     print("🤖 Bot do Telegram iniciando em background...")
     try:
-        current_commit = os.environ.get("RENDER_GIT_COMMIT")
-        last_commit_sent = db.get_config("last_commit_hash")
-        print(f"Commit Atual (Render): {current_commit}")
-        print(f"Último Commit (Banco): {last_commit_sent}")
-        if current_commit and (current_commit != last_commit_sent):
-            print("Detectado novo deploy! Enviando broadcast...")
-            loop.run_until_complete(send_broadcast(app.bot, BROADCAST_MESSAGE))
-            db.set_config("last_commit_hash", current_commit)
-            print("Broadcast enviado e hash salvo.")
-        else:
-            print("Inicialização normal (sem broadcast).")
+        # O broadcast de deploy roda em segundo plano a partir de ao_iniciar (post_init)
         print("Iniciando Polling do bot...")
         app.run_polling(stop_signals=None) 
     except Exception as e:
         print(f"!!! ERRO FATAL NO POLLING: {e} !!!")
 
+def parar_polling(app: Application, loop, bot_thread, timeout=30):
+    """Chamado da thread principal no desligamento (SIGTERM): o run_polling para, drena e roda o ao_encerrar."""
+    print("Encerrando o bot (polling)...")
+    try: loop.call_soon_threadsafe(app.stop_running)
+    except RuntimeError: pass # loop já fechado: o polling terminou sozinho
+    bot_thread.join(timeout=timeout)
+    if bot_thread.is_alive(): print("!!! O bot não encerrou a tempo !!!")
+
+# ===================================================================
+# --- Webhook (BOT_MODE=webhook) ---
+# ===================================================================
+# O Telegram faz POST das atualizações na mesma porta do Flask; a rota só enfileira em
+# app.update_queue e o Application (sem Updater) as processa no loop da thread do bot.
+BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '').rstrip('/') # URL pública do serviço, ex.: https://meubot.onrender.com
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/telegram')
+# Chats atendidos em paralelo pelo Application (o mesmo chat é sempre em ordem, ver despacho.py)
+BOT_CONCORRENCIA = int(os.environ.get('BOT_CONCORRENCIA', '16'))
+BOT_FILA_POR_CHAT = int(os.environ.get('BOT_FILA_POR_CHAT', '20')) # além disso, descarta (flood)
+
+def segredo_webhook(token):
+    """Valor do header X-Telegram-Bot-Api-Secret-Token. Sem WEBHOOK_SECRET, deriva do token:
+    estável entre instâncias e deploys (todas aceitam o mesmo set_webhook)."""
+    return os.environ.get('WEBHOOK_SECRET') or hashlib.sha256(f"webhook:{token}".encode()).hexdigest()
+
+async def iniciar_webhook(app: Application, segredo):
+    await app.initialize()
+    if app.post_init: await app.post_init(app) # o run_polling chamaria sozinho; aqui é manual
+    await app.bot.set_webhook(url=WEBHOOK_URL + WEBHOOK_PATH, secret_token=segredo, allowed_updates=Update.ALL_TYPES)
+    await app.start()
+    print(f"Webhook registrado em {WEBHOOK_URL + WEBHOOK_PATH}")
+
+async def encerrar_webhook(app: Application):
+    # O webhook não é apagado: as outras instâncias (ou o próximo deploy) continuam recebendo
+    if app.running: await app.stop() # termina as atualizações em andamento
+    await app.shutdown()
+    if app.post_shutdown: await app.post_shutdown(app) # como no run_polling
+
+def run_webhook_thread(app: Application, loop, segredo):
+    """Função alvo da Thread: sobe o Application sem Updater e mantém o loop rodando."""
+    asyncio.set_event_loop(loop)
+    print("🤖 Bot do Telegram iniciando em modo webhook...")
+    try:
+        loop.run_until_complete(iniciar_webhook(app, segredo))
+        loop.run_forever()
+    except Exception as e:
+        print(f"!!! ERRO FATAL NO WEBHOOK: {e} !!!")
+
+def parar_webhook(app: Application, loop, timeout=30):
+    """Chamado da thread principal no desligamento (SIGTERM): drena e fecha o Application."""
+    print("Encerrando o bot (webhook)...")
+    try: asyncio.run_coroutine_threadsafe(encerrar_webhook(app), loop).result(timeout=timeout)
+    except Exception as e: print(f"Erro ao encerrar o webhook: {e}")
+    finally: loop.call_soon_threadsafe(loop.stop)
+
 def run_flask(app_flask):
     """Roda o Flask (Waitress) na thread principal (bloqueando)."""
     print("\n--- INICIANDO FLASK (Waitress) ---")
@@ -570,16 +779,62 @@ if __name__ == "__main__":
     @app_flask.route('/')
     def home(): return "Estou vivo!"
 
+    @app_flask.route('/metrics')
+    def rota_metricas(): return metricas.exportar(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+    @app_flask.route('/healthz')
+    def healthz():
+        # Saudável = recebendo atualizações (polling, ou o Application rodando no webhook) e o event loop respondendo
+        batimento = None if metricas.batimento is None else round(time.monotonic() - metricas.batimento, 3)
+        if BOT_MODE == 'webhook': recebendo = bool(app is not None and app.running)
+        else: recebendo = bool(app is not None and app.updater is not None and app.updater.running)
+        saudavel = recebendo and batimento is not None and batimento < 10
+        ultima = None if metricas.ultima_atualizacao is None else round(time.monotonic() - metricas.ultima_atualizacao, 1)
+        return ({'status': 'ok' if saudavel else 'falha', 'modo': BOT_MODE, 'recebendo': recebendo, 'loop_lag_s': round(metricas.loop_lag, 4),
+                 'batimento_ha_s': batimento, 'ultima_atualizacao_ha_s': ultima}, 200 if saudavel else 503)
+
     if not TOKEN:
         print("ERRO CRÍTICO: Token não encontrado.")
     else:
-        app = Application.builder().token(TOKEN).build()
+        graficos.iniciar() # sobe e aquece os workers de gráfico antes das threads do bot
+        construtor = Application.builder().token(TOKEN).post_init(ao_iniciar).post_shutdown(ao_encerrar).concurrent_updates(ProcessadorPorChat(BOT_CONCORRENCIA, BOT_FILA_POR_CHAT))
+        if os.environ.get('BOT_PERSISTENCIA', '1') == '1': construtor = construtor.persistence(PersistenciaBanco(adb))
+        if BOT_MODE == 'webhook': construtor = construtor.updater(None) # sem long polling: as atualizações chegam pela rota
+        app = construtor.build()
         app.add_handler(CommandHandler("start", start))
         app.add_handler(CommandHandler("broadcast", broadcast_command)) 
+        app.add_handler(CommandHandler("recalcular", recalcular_command))
+        app.add_handler(CommandHandler("cache", cache_command))
+        app.add_handler(CallbackQueryHandler(paginar_extrato, pattern=r"^pg:"))
         app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, responder))
+        app.add_handler(MessageHandler(filters.Document.ALL, importar_extrato))
         print("🤖 Bot configurado.")
-        
-        bot_thread = Thread(target=run_telegram_bot_thread, args=(app,), daemon=True)
-        bot_thread.start()
-        
-        run_flask(app_flask)
\ No newline at end of file
+
+        if BOT_MODE == 'webhook':
+            if not WEBHOOK_URL: sys.exit("ERRO CRÍTICO: BOT_MODE=webhook precisa de WEBHOOK_URL.")
+            segredo = segredo_webhook(TOKEN); loop_bot = asyncio.new_event_loop()
+
+            @app_flask.route(WEBHOOK_PATH, methods=['POST'])
+            def webhook():
+                if not hmac.compare_digest(request.headers.get('X-Telegram-Bot-Api-Secret-Token', ''), segredo): return "", 403
+                if not app.running: return "", 503 # o Telegram reenvia depois
+                dados = request.get_json(force=True, silent=True)
+                if not dados: return "", 400
+                # Só enfileira: o processamento (e a concorrência) fica com o Application no loop do bot
+                asyncio.run_coroutine_threadsafe(app.update_queue.put(Update.de_json(dados, app.bot)), loop_bot).result(timeout=5)
+                return "", 200
+
+            bot_thread = Thread(target=run_webhook_thread, args=(app, loop_bot, segredo), daemon=True)
+            bot_thread.start()
+            # Desligamento gracioso: o SIGTERM do deploy encerra o Waitress e o bot drena o que está em andamento
+            signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+            try: run_flask(app_flask)
+            finally: parar_webhook(app, loop_bot)
+        else:
+            loop_bot = asyncio.new_event_loop()
+            bot_thread = Thread(target=run_telegram_bot_thread, args=(app, loop_bot), daemon=True)
+            bot_thread.start()
+            # Mesmo desligamento do webhook: sem isso o SIGTERM mata o processo sem gravar a fila nem o user_data
+            signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+            try: run_flask(app_flask)
+            finally: parar_polling(app, loop_bot, bot_thread)
\ No newline at end of file
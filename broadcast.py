@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""Envio de mensagens em massa (broadcast) com concorrência limitada.
+
+Respeita os limites do Telegram com token buckets (global e por chat), pausa todos
+os envios quando o Telegram responde RetryAfter e grava no banco quem bloqueou o
+bot (Forbidden) ou teve o chat migrado (ChatMigrated). Roda em segundo plano e
+informa o progresso ao admin editando uma única mensagem.
+
+Cada broadcast é um job persistido (coleção broadcast_jobs) que percorre os usuários
+em lotes, com checkpoint por envio, e é retomado do cursor depois de um restart.
+Quem executa o job tem um lease no banco (dono/lease_ate, BROADCAST_LEASE segundos),
+renovado nos checkpoints: duas réplicas (ou o deploy e a retomada) nunca enviam o mesmo
+job ao mesmo tempo, e o job de um processo que caiu é assumido quando o lease expira.
+"""
+import os
+import time
+import uuid
+import socket
+import asyncio
+from datetime import datetime, timedelta
+
+from telegram import Bot
+from telegram.error import Forbidden, ChatMigrated, RetryAfter, BadRequest
+
+from db import adb
+from metricas import metricas
+
+# Telegram: ~30 mensagens/s no total e ~1 mensagem/s por chat
+TAXA_GLOBAL = float(os.environ.get('BROADCAST_TAXA', '25'))
+CONCORRENCIA = int(os.environ.get('BROADCAST_CONCORRENCIA', '10'))
+TAMANHO_LOTE = int(os.environ.get('BROADCAST_LOTE', '100'))
+INTERVALO_POR_CHAT = 1.0
+MAX_TENTATIVAS = 3
+LEASE = float(os.environ.get('BROADCAST_LEASE', '120'))
+SITUACOES = {'enviado': 'enviados', 'bloqueado': 'bloqueados', 'falha': 'falhas'} # resultado do envio -> contador
+
+class LimitadorTaxa:
+    """Token bucket assíncrono; pausar() segura todos os consumidores (RetryAfter)."""
+    def __init__(self, taxa, capacidade=None):
+        self.taxa = taxa; self.capacidade = capacidade or max(1.0, taxa)
+        self._tokens = self.capacidade; self._ultimo = time.monotonic()
+        self._pausado_ate = 0.0
+        self._lock = asyncio.Lock()
+
+    async def aguardar(self):
+        async with self._lock:
+            while True:
+                agora = time.monotonic()
+                if agora < self._pausado_ate:
+                    await asyncio.sleep(self._pausado_ate - agora); continue
+                self._tokens = min(self.capacidade, self._tokens + (agora - self._ultimo) * self.taxa); self._ultimo = agora
+                if self._tokens >= 1:
+                    self._tokens -= 1; return
+                await asyncio.sleep((1 - self._tokens) / self.taxa)
+
+    def pausar(self, segundos):
+        self._pausado_ate = max(self._pausado_ate, time.monotonic() + segundos); self._tokens = 0
+
+class LeasePerdido(Exception):
+    """Outro processo tem (ou assumiu) o lease do job: este para de enviar."""
+
+class Lease:
+    """Lease de um job no banco. renovar() só vai ao banco a cada duracao/3 (ou com forcar=True)
+    e, perdido o lease, levanta LeasePerdido em todas as chamadas seguintes."""
+    def __init__(self, job_id, duracao=None):
+        self.job_id = job_id; self.duracao = duracao or LEASE
+        self.dono = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}" # um por execução, não por processo
+        self.renovado = 0.0; self.perdido = False
+
+    async def adquirir(self):
+        job = await adb.reivindicar_job_broadcast(self.job_id, self.dono, self.duracao)
+        if job is not None: self.renovado = time.monotonic()
+        return job
+
+    async def renovar(self, forcar=False):
+        if not self.perdido and not forcar and time.monotonic() - self.renovado < self.duracao / 3: return
+        if not self.perdido and await self.adquirir() is None: self.perdido = True
+        if self.perdido: raise LeasePerdido(f"o broadcast {self.job_id} passou para outra instância (lease expirado)")
+
+class ResultadoBroadcast:
+    def __init__(self, total):
+        self.total = total; self.enviados = 0; self.bloqueados = 0; self.migrados = 0; self.falhas = 0; self.incertos = 0
+        self.inicio = time.monotonic(); self.fim = None
+
+    def contadores(self):
+        return {'enviados': self.enviados, 'bloqueados': self.bloqueados, 'migrados': self.migrados, 'falhas': self.falhas}
+
+    @property
+    def processados(self): return self.enviados + self.bloqueados + self.falhas
+
+    @property
+    def duracao(self): return (self.fim or time.monotonic()) - self.inicio
+
+    @property
+    def vazao(self): return self.processados / self.duracao if self.duracao > 0 else 0.0
+
+    def resumo(self):
+        return (f"✅ Enviados: {self.enviados}/{self.total} | 🚫 Bloqueados: {self.bloqueados} | 🔀 Migrados: {self.migrados} | "
+                f"❌ Falhas: {self.falhas}\n⏱️ {self.duracao:.1f}s ({self.vazao:.1f} msg/s)")
+
+def _segundos(retry_after):
+    return retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+
+def _medir_envio(situacao, inicio):
+    metricas.observar("broadcast_envio_segundos", time.perf_counter() - inicio, ajuda="Duração de cada send_message do broadcast")
+    metricas.contar("broadcast_envios_total", situacao=situacao, ajuda="Tentativas de envio do broadcast por resultado")
+
+async def _enviar(bot: Bot, chat_id, texto, limitador, ultimo_por_chat, resultado):
+    """Envia com novas tentativas; devolve o resultado ('enviado', 'bloqueado' ou 'falha')."""
+    for _ in range(MAX_TENTATIVAS):
+        espera_chat = ultimo_por_chat.get(chat_id, 0.0) + INTERVALO_POR_CHAT - time.monotonic()
+        if espera_chat > 0: await asyncio.sleep(espera_chat)
+        await limitador.aguardar()
+        ultimo_por_chat[chat_id] = time.monotonic(); inicio = time.perf_counter()
+        try:
+            await bot.send_message(chat_id=chat_id, text=texto)
+            resultado.enviados += 1; _medir_envio("enviado", inicio)
+            return "enviado"
+        except RetryAfter as e:
+            print(f"Broadcast: RetryAfter {e.retry_after}s (chat {chat_id})")
+            limitador.pausar(_segundos(e.retry_after)); _medir_envio("retry_after", inicio)
+        except Forbidden:
+            print(f"Falha: Usuário {chat_id} bloqueou o bot.")
+            _medir_envio("bloqueado", inicio)
+            resultado.bloqueados += 1; await adb.marcar_usuario_bloqueado(chat_id)
+            return "bloqueado"
+        except ChatMigrated as e:
+            print(f"Chat {chat_id} migrou para {e.new_chat_id}; reenviando.")
+            _medir_envio("migrado", inicio)
+            resultado.migrados += 1; await adb.registrar_migracao(chat_id, e.new_chat_id)
+            chat_id = e.new_chat_id
+        except Exception as e:
+            print(f"Falha: Erro desconhecido com user_id {chat_id}: {e}")
+            _medir_envio("erro", inicio)
+            break
+    resultado.falhas += 1
+    return "falha"
+
+async def send_broadcast(bot: Bot, message: str, user_ids=None, ao_progresso=None, concorrencia=None, resultado=None, checkpoint=None):
+    """Envia message para user_ids (padrão: usuários ativos). Retorna um ResultadoBroadcast.
+    checkpoint(uid, estado) é aguardado antes ('iniciado') e depois (resultado) de cada envio."""
+    if user_ids is None: user_ids = await adb.listar_usuarios(apenas_ativos=True)
+    proprio = resultado is None # quando vem de um job, o resultado acumula vários lotes
+    if proprio: resultado = ResultadoBroadcast(len(user_ids))
+    if not user_ids:
+        print("Broadcast: Nenhum usuário encontrado para enviar.")
+        if proprio: resultado.fim = time.monotonic()
+        return resultado
+    print(f"Iniciando broadcast para {len(user_ids)} usuários...")
+
+    fila = asyncio.Queue()
+    for uid in user_ids: fila.put_nowait(uid)
+    limitador = LimitadorTaxa(TAXA_GLOBAL); ultimo_por_chat = {}
+
+    async def trabalhador():
+        while True:
+            try: uid = fila.get_nowait()
+            except asyncio.QueueEmpty: return
+            if checkpoint: await checkpoint(uid, "iniciado")
+            situacao = await _enviar(bot, uid, message, limitador, ultimo_por_chat, resultado)
+            if checkpoint: await checkpoint(uid, situacao)
+
+    trabalhadores = [asyncio.create_task(trabalhador()) for _ in range(min(concorrencia or CONCORRENCIA, len(user_ids)))]
+    if ao_progresso:
+        while not all(t.done() for t in trabalhadores):
+            await asyncio.wait(trabalhadores, timeout=10)
+            if not all(t.done() for t in trabalhadores): await ao_progresso(resultado)
+    # espera todos: com o lease perdido cada trabalhador para no próximo checkpoint
+    erro = next((r for r in await asyncio.gather(*trabalhadores, return_exceptions=True) if isinstance(r, BaseException)), None)
+    if erro is not None: raise erro
+    if proprio:
+        resultado.fim = time.monotonic()
+        print(f"Broadcast concluído. {resultado.resumo()}")
+    return resultado
+
+async def _rodar_lote(bot: Bot, lease, mensagem, ids, fim, resultado, ao_progresso, estados=None):
+    """Envia um lote com checkpoint por envio e avança o cursor do job até `fim`.
+    estados: envios já marcados de um lote interrompido (retomada)."""
+    job_id = lease.job_id; estados = estados or {}; antes = resultado.contadores()
+    # Quem já tinha resultado conta sem reenviar; 'iniciado' caiu durante o send_message (incerto)
+    for estado in estados.values():
+        if estado in SITUACOES: setattr(resultado, SITUACOES[estado], getattr(resultado, SITUACOES[estado]) + 1)
+    incertos = sum(1 for estado in estados.values() if estado == "iniciado"); resultado.incertos += incertos
+    pendentes = [uid for uid in ids if uid not in estados]
+
+    async def checkpoint(uid, estado):
+        if estado == "iniciado": await lease.renovar() # sem lease o envio nem começa
+        await adb.marcar_envio_broadcast(job_id, uid, estado)
+
+    if pendentes:
+        await send_broadcast(bot, mensagem, user_ids=pendentes, ao_progresso=ao_progresso, resultado=resultado, checkpoint=checkpoint)
+    await lease.renovar(forcar=True) # o cursor só avança com o lease confirmado
+    depois = resultado.contadores(); incrementos = {k: depois[k] - antes[k] for k in depois}; incrementos['incertos'] = incertos
+    await adb.atualizar_job_broadcast(job_id, {'cursor': fim, 'lote_em_andamento': [], 'lote_fim': None}, incrementos)
+    await adb.limpar_envios_broadcast(job_id, ids)
+
+async def executar_job(bot: Bot, job_id, ao_progresso=None):
+    """Executa (ou retoma) o job de broadcast job_id, com checkpoint por envio.
+
+    Antes de enviar um lote, os IDs dele são gravados em lote_em_andamento; cada envio é
+    marcado 'iniciado' antes do send_message e com o resultado depois. Se o processo cair,
+    a retomada termina o lote: pula quem já tem resultado, envia quem não começou e só os
+    envios que estavam em andamento (no máximo CONCORRENCIA) entram como 'incertos'.
+
+    O job só roda com o lease (ver Lease); levanta LeasePerdido se outro processo o tem
+    ou o assumir no meio do envio.
+    """
+    lease = Lease(job_id)
+    job = await lease.adquirir()
+    if job is None:
+        job = await adb.get_job_broadcast(job_id)
+        if job is None or job.get('status') not in ('pendente', 'executando'): return None
+        raise LeasePerdido(f"o broadcast {job_id} já está sendo enviado por outra instância ({job.get('dono')})")
+    total = await adb.contar_usuarios(apenas_ativos=True)
+    resultado = ResultadoBroadcast(total)
+    resultado.enviados = job.get('enviados', 0); resultado.bloqueados = job.get('bloqueados', 0)
+    resultado.migrados = job.get('migrados', 0); resultado.falhas = job.get('falhas', 0); resultado.incertos = job.get('incertos', 0)
+    cursor = job.get('cursor')
+    if job.get('lote_em_andamento'):
+        lote = job['lote_em_andamento']; cursor = job.get('lote_fim')
+        estados = await adb.envios_broadcast(job_id, lote)
+        print(f"Broadcast {job_id}: retomando lote interrompido ({len(lote)} usuários, {len(estados)} já marcados).")
+        await _rodar_lote(bot, lease, job['mensagem'], lote, cursor, resultado, ao_progresso, estados)
+
+    while True:
+        ids, ultimo = await adb.listar_usuarios_lote(apos=cursor, limite=TAMANHO_LOTE)
+        if ultimo is None: break
+        await lease.renovar(forcar=True) # antes de gravar o próximo lote
+        if ids:
+            await adb.atualizar_job_broadcast(job_id, {'lote_em_andamento': ids, 'lote_fim': ultimo})
+            await _rodar_lote(bot, lease, job['mensagem'], ids, ultimo, resultado, ao_progresso)
+        else:
+            await adb.atualizar_job_broadcast(job_id, {'cursor': ultimo})
+        cursor = ultimo
+        if ao_progresso: await ao_progresso(resultado)
+
+    resultado.fim = time.monotonic()
+    await adb.atualizar_job_broadcast(job_id, {'status': 'concluido', 'concluido_em': datetime.now()})
+    print(f"Broadcast {job_id} concluído. {resultado.resumo()}")
+    return resultado
+
+async def broadcast_com_relatorio(bot: Bot, job_id, admin_id):
+    """Roda (ou retoma) o job e mantém o admin informado (uma mensagem editada a cada lote / ~10s)."""
+    status = None
+    try: status = await bot.send_message(chat_id=admin_id, text=f"📣 Broadcast {job_id} iniciando...")
+    except Exception as e: print(f"Broadcast: não consegui avisar o admin: {e}")
+    ultima_edicao = [0.0]
+
+    async def ao_progresso(resultado):
+        if status is None or time.monotonic() - ultima_edicao[0] < 10: return
+        ultima_edicao[0] = time.monotonic()
+        try: await status.edit_text(f"📣 Broadcast {job_id} em andamento: {resultado.processados}/{resultado.total}\n{resultado.resumo()}")
+        except BadRequest: pass
+
+    try: resultado = await executar_job(bot, job_id, ao_progresso=ao_progresso)
+    except LeasePerdido as e:
+        print(f"Broadcast {job_id}: parado, {e}.")
+        if status is not None:
+            try: await status.edit_text(f"📣 Broadcast {job_id}: {e}.")
+            except BadRequest: pass
+        return None
+    if status is not None:
+        texto = f"📣 Broadcast {job_id} concluído.\n{resultado.resumo()}" if resultado else f"📣 Broadcast {job_id} já estava concluído."
+        if resultado and resultado.incertos: texto += f"\n⚠️ {resultado.incertos} envio(s) interrompido(s) por um restart não foram repetidos (podem ter chegado ou não)."
+        try: await status.edit_text(texto)
+        except BadRequest: pass
+    return resultado
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""Interpretação das mensagens de transação ("150 mercado", "50 uber nubank").
+
+Os índices de palavras-chave são montados uma única vez, na importação:
+palavra-chave (normalizada, sem acento) -> categoria, inclusive chaves com mais de
+uma palavra ("internet celular"), e o conjunto de chaves que indicam entrada.
+"""
+import re
+import decimal
+import functools
+import unicodedata
+from decimal import Decimal
+
+# ===================================================================
+# --- MAPEAMENTO DE CATEGORIAS (Sem alteração) ---
+# ===================================================================
+MAPEAMENTO_CATEGORIAS = {
+    "Alimentação": ["supermercado", "mercado", "lanche", "churrasco", "restaurante", "ifood", "rappi", "padaria", "açougue", "hortifruti", "pizza", "comida", "jantar", "almoço", "café", "bebida"],
+    "Transporte": ["gasolina", "uber", "99", "estacionamento", "ipva", "seguro", "carro", "manutenção", "onibus", "metrô", "passagem", "combustível", "pedagio", "taxi", "aplicativo", "app"],
+    "Moradia": ["aluguel", "condomínio", "iptu", "luz", "água", "internet", "gás", "diarista", "faxina", "energia", "net", "claro", "vivo", "oi", "tim", "conserto", "reparo", "internet celular", "celular internet"],
+    "Construção/Reforma": ["construção", "reforma", "material", "pedreiro", "tinta", "cimento", "leroy", "telhanorte", "ferramenta", "obra", "ferragens"],
+    "Casa/Decoração": ["casa", "decoração", "móvel", "utensílio", "cama", "mesa", "banho", "eletrodoméstico", "manutenção", "casa", "jardinagem", "ikea", "tokstok"],
+    "Saúde": ["farmácia", "remédio", "médico", "consulta", "plano", "saude", "exame", "dentista", "hospital", "terapia", "psicologo"],
+    "Lazer/Entretenimento": ["lazer", "cinema", "show", "bar", "festa", "viagem", "hotel", "streaming", "netflix", "spotify", "hobby", "jogo", "steam", "passeio", "presente", "ingresso", "assinatura", "disney", "hbo"],
+    "Educação": ["escola", "faculdade", "curso", "livro", "material", "escolar", "udemy", "mensalidade", "papelaria"],
+    "Vestuário/Cuidados": ["roupa", "sapato", "tênis", "acessório", "vestido", "calça", "beleza", "cabelereiro", "cosmético", "perfume", "barbeiro"],
+    "Dívidas/Contas": ["fatura", "empréstimo", "juros", "boleto", "imposto", "taxa", "ir", "multa", "cartorio"],
+    "Pets": ["pet", "ração", "veterinário", "petshop", "cachorro", "gato"],
+    "Salário": ["salário", "salario", "pagamento", "holerite"],
+    "Vendas": ["venda", "cliente", "recebimento", "comissao", "serviço", "cliente pagou"],
+    "Investimentos": ["investimento", "ação", "ações", "b3", "fundo", "tesouro", "cdb", "cripto", "resgate", "dividendo", "jcp"],
+    "Outras Entradas": ["entrada", "ganhei", "recebi", "pix", "reembolso", "presente"]
+}
+CATEGORIAS_ENTRADA = ("Salário", "Vendas", "Outras Entradas", "Investimentos")
+CARTOES = ("nubank", "santander", "inter", "caixa")
+PALAVRAS_CARTAO = ("cartão", "cartao")
+
+# ===================================================================
+# --- Normalização ---
+# ===================================================================
+_RE_VALOR = re.compile(r"(\d[\d.,]*)")
+_RE_LANCAMENTOS = re.compile(r"[\n;]+") # separa vários lançamentos numa mensagem (a vírgula é decimal)
+_PONTUACAO = ".,;:!?()\"'"
+
+@functools.lru_cache(maxsize=8192)
+def normalizar(palavra: str) -> str:
+    """Minúsculas, sem acentos e sem pontuação nas pontas ("Café," -> "cafe")."""
+    palavra = unicodedata.normalize("NFKD", palavra.lower().strip(_PONTUACAO))
+    return "".join(c for c in palavra if not unicodedata.combining(c))
+
+def singulares(palavra: str):
+    """Formas candidatas de singular de uma palavra normalizada (lanches -> lanche, acoes -> acao)."""
+    if len(palavra) <= 3 or not palavra.endswith("s"): return ()
+    formas = [palavra[:-1]]
+    if palavra.endswith("es"): formas.append(palavra[:-2])
+    if palavra.endswith(("oes", "aes")): formas.append(palavra[:-3] + "ao")
+    return formas
+
+# ===================================================================
+# --- Índices (montados uma vez) ---
+# ===================================================================
+def _chave(keyword: str):
+    return tuple(normalizar(p) for p in keyword.split())
+
+# chave normalizada -> (categoria-pai, palavra-chave original). A primeira categoria que lista a chave vence.
+INDICE_CATEGORIAS = {}
+for _categoria, _keywords in MAPEAMENTO_CATEGORIAS.items():
+    for _kw in _keywords: INDICE_CATEGORIAS.setdefault(_chave(_kw), (_categoria, _kw))
+CHAVES_ENTRADA = frozenset(_chave(kw) for cat in CATEGORIAS_ENTRADA for kw in MAPEAMENTO_CATEGORIAS[cat])
+MAX_PALAVRAS_CHAVE = max(len(k) for k in INDICE_CATEGORIAS)
+PARADAS_CARTAO = frozenset(CARTOES + PALAVRAS_CARTAO)
+PARADAS_NOME_CARTAO = PARADAS_CARTAO | frozenset(MAPEAMENTO_CATEGORIAS.keys())
+
+def _chaves_exatas(normalizadas: list):
+    """Gera as chaves possíveis na ordem da mensagem: a maior sequência de palavras primeiro."""
+    for i in range(len(normalizadas)):
+        for n in range(min(MAX_PALAVRAS_CHAVE, len(normalizadas) - i), 0, -1):
+            yield tuple(normalizadas[i:i + n])
+
+def _chaves_singulares(normalizadas: list):
+    for palavra in normalizadas:
+        for forma in singulares(palavra): yield (forma,)
+
+def _procurar(chaves):
+    categoria = descricao = None; entrada = False
+    for chave in chaves:
+        if categoria is None:
+            achado = INDICE_CATEGORIAS.get(chave)
+            if achado: categoria, descricao = achado[0], achado[1].capitalize()
+        if not entrada and chave in CHAVES_ENTRADA: entrada = True
+        if categoria is not None and entrada: break
+    return categoria, descricao, entrada
+
+def classificar(palavras: list):
+    """Retorna (categoria-pai, palavra-chave, é_entrada). A primeira palavra-chave da mensagem vence,
+    como sempre foi; o singular ("lanches" -> "lanche") só é tentado quando nenhuma palavra casa
+    como está, para não tirar a vez de uma palavra-chave exata mais adiante ("40 lanches escola")."""
+    normalizadas = [normalizar(p) for p in palavras]
+    resultado = _procurar(_chaves_exatas(normalizadas))
+    if resultado[0] is None: resultado = _procurar(_chaves_singulares(normalizadas))
+    return resultado
+
+def encontrar_categoria_e_descricao(palavras: list):
+    """Procura por palavras-chave e retorna a Categoria-Pai E a palavra-chave."""
+    categoria, descricao, _ = classificar(palavras)
+    return (categoria, descricao) # (ex: "Alimentação", "Lanche") ou (None, None)
+
+# ===================================================================
+# --- Interpretação de mensagens ---
+# ===================================================================
+def interpretar_mensagem(texto: str):
+    texto = texto.lower().strip()
+    match = _RE_VALOR.search(texto)
+    if match:
+        valor_txt = match.group(1).strip(); valor_num = Decimal("0.00")
+        if not valor_txt: return {"acao": "desconhecido"}
+        try: valor_num = Decimal(valor_txt.replace(".", "").replace(",", "."))
+        except decimal.InvalidOperation: return {"acao": "desconhecido"}
+        if valor_num <= 0: return {"acao": "desconhecido"}
+        palavras = texto.split(); palavras_texto = [p for p in palavras if valor_txt not in p]
+        conjunto_palavras = set(palavras_texto)
+
+        # --- Lógica de Cartão ---
+        cartao = None; metodo = "dinheiro"
+        for c in CARTOES:
+            if c in conjunto_palavras: cartao = c.capitalize(); metodo = "cartao"; break
+        if cartao is None:
+            idx = next((i for i, p in enumerate(palavras_texto) if p in PALAVRAS_CARTAO), -1)
+            if idx != -1:
+                metodo = "cartao"; nome_cartao_palavras = []
+                for p in palavras_texto[idx + 1:]:
+                    if p not in PARADAS_NOME_CARTAO: nome_cartao_palavras.append(p)
+                    else: break
+                if nome_cartao_palavras: cartao = " ".join(nome_cartao_palavras).capitalize()
+                else: cartao = "Cartão"
+
+        # --- Determina Tipo e Categoria ---
+        categoria_pai, descricao_item, is_entrada = classificar(palavras_texto)
+
+        stop_words_fallback = PARADAS_CARTAO | set(cartao.lower().split()) if cartao else PARADAS_CARTAO
+        fallback_word = next((p for p in palavras_texto if p.isalpha() and p not in stop_words_fallback), "Outros")
+
+        if is_entrada:
+            categoria_final = categoria_pai if categoria_pai else "Entrada"
+            # Se a descrição não foi encontrada, usa o fallback. Se não, usa a palavra-chave.
+            descricao_final = descricao_item if descricao_item else fallback_word.capitalize()
+            return {"acao": "add", "tipo": "entrada", "valor_num": valor_num, "valor_txt": valor_txt,
+                    "categoria": categoria_final.capitalize(),
+                    "descricao": descricao_final,
+                    "metodo": metodo, "cartao": cartao}
+        else: # É um gasto
+            categoria_final = categoria_pai if categoria_pai else fallback_word.capitalize()
+            descricao_final = descricao_item if descricao_item else fallback_word.capitalize()
+            return {"acao": "add", "tipo": "gasto", "valor_num": valor_num, "valor_txt": valor_txt,
+                    "categoria": categoria_final.capitalize(),
+                    "descricao": descricao_final,
+                    "metodo": metodo, "cartao": cartao}
+    return {"acao": "desconhecido"}
+
+def separar_lancamentos(texto: str):
+    """Partes não vazias de uma mensagem com vários lançamentos (uma por linha ou separadas por ';')."""
+    return [parte.strip() for parte in _RE_LANCAMENTOS.split(texto) if parte.strip()]
+
+def interpretar_mensagens(texto: str):
+    """Versão para vários lançamentos: [(parte, resultado de interpretar_mensagem)], na ordem da mensagem."""
+    return [(parte, interpretar_mensagem(parte)) for parte in separar_lancamentos(texto)]
@@ -1,40 +1,716 @@
 import os
+import sys
 import json
-from datetime import datetime, timedelta
+import time
+import asyncio
+import functools
+import atexit
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
-import firebase_admin
-from firebase_admin import credentials
-from firebase_admin import firestore
-# Import novo para corrigir o aviso "UserWarning"
-from google.cloud.firestore_v1.base_query import FieldFilter 
 import pytz
+from metricas import metricas, registrar_banco
+
+# O firebase-admin (e o cliente gRPC do Firestore) é pesado de importar: fica para a primeira
+# conexão do FirestoreDatabase. O backend SQLite roda sem ele instalado.
+firebase_admin = credentials = firestore = FieldFilter = None
+ERROS_TRANSITORIOS = () # exceções do Firestore que valem nova tentativa (preenchido junto com o firebase-admin)
+
+def _importar_firebase():
+    global firebase_admin, credentials, firestore, FieldFilter, ERROS_TRANSITORIOS
+    if firebase_admin is not None: return
+    try:
+        import firebase_admin as _firebase_admin
+        from firebase_admin import credentials as _credentials, firestore as _firestore
+        # Import novo para corrigir o aviso "UserWarning"
+        from google.cloud.firestore_v1.base_query import FieldFilter as _FieldFilter
+        from google.api_core import exceptions as _erros
+    except ImportError as e:
+        raise ImportError("Erro: DB_BACKEND=firestore precisa do pacote firebase-admin instalado.") from e
+    credentials, firestore, FieldFilter = _credentials, _firestore, _FieldFilter
+    ERROS_TRANSITORIOS = (_erros.Aborted, _erros.ServiceUnavailable, _erros.DeadlineExceeded, _erros.ResourceExhausted, ConnectionError)
+    firebase_admin = _firebase_admin
 
 # Configuração de Fuso Horário
 LOCAL_TIMEZONE = pytz.timezone('America/Sao_Paulo')
 
+# Em memória (cache, filtros de período, cursores, SQLite) as datas são o horário de LOCAL_TIMEZONE,
+# sem tzinfo, qualquer que seja o fuso do servidor. O Firestore guarda instantes: converte na fronteira.
+def agora_local():
+    return datetime.now(LOCAL_TIMEZONE).replace(tzinfo=None)
+
+def data_local(dt):
+    """Data com fuso (vinda do Firestore) -> horário de LOCAL_TIMEZONE sem tzinfo; ingênua passa direto."""
+    if dt is None or getattr(dt, 'tzinfo', None) is None: return dt
+    return dt.astimezone(LOCAL_TIMEZONE).replace(tzinfo=None)
+
+def data_no_banco(dt):
+    """Horário local ingênuo -> instante com fuso, para gravar e filtrar no Firestore (que lê ingênuo como UTC)."""
+    if dt is None or dt.tzinfo is not None: return dt
+    return LOCAL_TIMEZONE.localize(dt)
+
+def _intern(valor):
+    return sys.intern(valor) if isinstance(valor, str) else valor
+
+# --- LINHA DE TRANSAÇÃO ---
+class Transacao:
+    """Transação decodificada uma única vez: valor já em Decimal e strings repetidas internadas."""
+    __slots__ = ('id', 'tipo', 'valor', 'categoria', 'metodo', 'cartao', 'data', 'descricao')
+
+    def __init__(self, id, tipo, valor, categoria, metodo, cartao, data, descricao):
+        self.id = id; self.tipo = _intern(tipo); self.valor = valor
+        self.categoria = _intern(categoria); self.metodo = _intern(metodo); self.cartao = _intern(cartao)
+        self.data = data; self.descricao = descricao
+
+    @classmethod
+    def de_documento(cls, doc):
+        d = doc.to_dict()
+        dt = data_local(d.get('data')) # o Firestore devolve UTC com fuso
+        valor = d.get('valor_num')
+        try: valor = Decimal(f"{float(valor):.2f}")
+        except (TypeError, ValueError): valor = Decimal("0.00")
+        return cls(doc.id, d.get('tipo'), valor, d.get('categoria'), d.get('metodo'), d.get('cartao'), dt, d.get('descricao'))
+
+    def __repr__(self):
+        return f"Transacao({self.id!r}, {self.tipo!r}, {self.valor}, {self.categoria!r}, {self.data})"
+
+# --- CACHE DE TRANSAÇÕES ---
+class CacheTransacoes:
+    """Cache do processo, por user_id: linhas decodificadas (Transacao) e agregado.
+
+    LRU limitado por número de usuários e total de linhas, com TTL por entrada.
+    add_transacao/limpar_transacoes atualizam as entradas no lugar (write-through).
+
+    Escritas de outros processos (outra réplica, migrar_layout.py) não passam por aqui: com um
+    validador (Firestore), cada entrada guarda a revisão do agregado do usuário e, no máximo a
+    cada CACHE_REVALIDAR segundos, confere a do banco; se mudou, a entrada é descartada.
+    """
+    def __init__(self, max_usuarios=None, max_linhas=None, ttl=None, revalidar=None, validador=None):
+        self.max_usuarios = max_usuarios or int(os.environ.get('CACHE_MAX_USUARIOS', '500'))
+        self.max_linhas = max_linhas or int(os.environ.get('CACHE_MAX_LINHAS', '200000'))
+        self.ttl = ttl if ttl is not None else float(os.environ.get('CACHE_TTL', '300'))
+        self.revalidar = revalidar if revalidar is not None else float(os.environ.get('CACHE_REVALIDAR', '2'))
+        self.validador = validador # user_id -> agregado atual no banco (com 'revisao') ou None
+        self._entradas = OrderedDict() # user_id -> {'linhas', 'agregado', 'expira', 'revisao', 'validado'}
+        self._total_linhas = 0
+        self._lock = threading.Lock()
+        self.hits = 0; self.misses = 0; self.evictions = 0; self.expiradas = 0; self.desatualizadas = 0
+
+    def _entrada(self, user_id, criar=False):
+        e = self._entradas.get(user_id)
+        if e is not None and e['expira'] < time.monotonic():
+            self._descartar(user_id); self.expiradas += 1; e = None
+        if e is None and criar:
+            agora = time.monotonic()
+            e = self._entradas[user_id] = {'linhas': None, 'agregado': None, 'expira': agora + self.ttl, 'revisao': None, 'validado': agora}
+        if e is not None: self._entradas.move_to_end(user_id)
+        return e
+
+    def _revalidar(self, user_id):
+        """Confere a revisão da entrada com a do banco; descarta a entrada se outro processo gravou."""
+        with self._lock:
+            e = self._entradas.get(user_id)
+            if e is None or time.monotonic() < e['validado'] + self.revalidar: return
+            e['validado'] = time.monotonic()
+        agregado = self.validador(user_id) # fora do lock: ida ao banco
+        revisao = (agregado or {}).get('revisao', 0)
+        with self._lock:
+            e = self._entradas.get(user_id)
+            if e is None or e['revisao'] == revisao: return
+            # Revisão diferente (ou desconhecida): recomeça a entrada já marcada com a revisão lida,
+            # para o que for carregado a seguir ser conferido contra ela
+            self._descartar(user_id); self.desatualizadas += 1
+            self._entrada(user_id, criar=True)['revisao'] = revisao
+
+    def _descartar(self, user_id):
+        e = self._entradas.pop(user_id, None)
+        if e and e['linhas'] is not None: self._total_linhas -= len(e['linhas'])
+
+    def _ajustar_orcamento(self):
+        while self._entradas and (len(self._entradas) > self.max_usuarios or self._total_linhas > self.max_linhas):
+            self._descartar(next(iter(self._entradas))); self.evictions += 1
+
+    def _obter(self, user_id, campo):
+        if self.validador is not None: self._revalidar(user_id)
+        with self._lock:
+            e = self._entrada(user_id)
+            valor = e[campo] if e is not None else None
+            if valor is None: self.misses += 1
+            else: self.hits += 1
+            return list(valor) if campo == 'linhas' and valor is not None else valor
+
+    def obter_linhas(self, user_id): return self._obter(user_id, 'linhas')
+    def obter_agregado(self, user_id): return self._obter(user_id, 'agregado')
+
+    def guardar_linhas(self, user_id, linhas):
+        with self._lock:
+            e = self._entrada(user_id, criar=True)
+            if e['linhas'] is not None: self._total_linhas -= len(e['linhas'])
+            e['linhas'] = list(linhas); self._total_linhas += len(linhas)
+            self._ajustar_orcamento()
+
+    def guardar_agregado(self, user_id, agregado):
+        with self._lock:
+            e = self._entrada(user_id, criar=True); e['agregado'] = agregado
+            if 'revisao' in agregado: e['revisao'] = agregado['revisao']
+            self._ajustar_orcamento()
+
+    def avancar_revisao(self, user_id):
+        """Este processo gravou (o Increment de 'revisao' no agregado): a entrada continua valendo."""
+        with self._lock:
+            e = self._entradas.get(user_id)
+            if e is not None and e['revisao'] is not None: e['revisao'] += 1
+
+    def adicionar(self, user_id, linha, dados):
+        """Aplica uma transação recém-gravada às entradas em cache do usuário."""
+        with self._lock:
+            e = self._entrada(user_id)
+            if e is None: return
+            if e['linhas'] is not None: e['linhas'].insert(0, linha); self._total_linhas += 1
+            if e['agregado'] is not None: Database._aplicar_no_agregado(e['agregado'], [dados], sinal=1)
+            self._ajustar_orcamento()
+
+    def remover(self, user_id, ids, dados):
+        """Retira transações apagadas (ids + dicts com tipo/valor/categoria/data)."""
+        with self._lock:
+            e = self._entrada(user_id)
+            if e is None: return
+            if e['linhas'] is not None:
+                ids = set(ids); antes = len(e['linhas'])
+                e['linhas'] = [t for t in e['linhas'] if t.id not in ids]
+                self._total_linhas -= antes - len(e['linhas'])
+            if e['agregado'] is not None: Database._aplicar_no_agregado(e['agregado'], dados, sinal=-1)
+
+    def invalidar(self, user_id=None):
+        with self._lock:
+            if user_id is None: self._entradas.clear(); self._total_linhas = 0
+            else: self._descartar(user_id)
+
+    def estatisticas(self):
+        with self._lock:
+            return {'usuarios': len(self._entradas), 'linhas': self._total_linhas, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'expiradas': self.expiradas, 'desatualizadas': self.desatualizadas}
+
+# --- FILA DE ESCRITA (WRITE-BEHIND) ---
+class FilaEscrita:
+    """Agrupa escritas de rajadas de mensagens em commits em lote (opcional: DB_WRITE_BEHIND=1).
+
+    Uma thread grava quando acumula MAX_ESCRITAS ou quando a escrita mais antiga
+    espera DB_WRITE_BEHIND_MS. fechar() (chamado no desligamento do bot e no atexit)
+    grava tudo que falta. Cada enfileirar() é um grupo atômico (o commit de um add_transacoes),
+    marcado com o usuário: descarregar(user_id) espera só os grupos dele.
+
+    Erros transitórios (Aborted, Unavailable, DeadlineExceeded, ResourceExhausted) são refeitos
+    com backoff, até DB_WRITE_BEHIND_TENTATIVAS vezes. Um erro permanente (InvalidArgument,
+    PermissionDenied, documento grande demais) não trava a fila: o lote é refeito grupo a grupo e
+    só o grupo que falhou vai para o log e para a coleção escritas_falhas (dead letter).
+    """
+    MAX_ESCRITAS = 450 # limite do Firestore é 500 por batch
+    MAX_ESPERA = 30.0 # teto do backoff entre tentativas
+    COLECAO_FALHAS = 'escritas_falhas'
+
+    def __init__(self, client, latencia_ms=None, transitorios=None):
+        self._client = client
+        self.latencia = (latencia_ms or int(os.environ.get('DB_WRITE_BEHIND_MS', '200'))) / 1000.0
+        self.tentativas = int(os.environ.get('DB_WRITE_BEHIND_TENTATIVAS', '8'))
+        self.transitorios = ERROS_TRANSITORIOS if transitorios is None else transitorios
+        # No fechamento, quanto tempo insistir com o banco fora do ar (dentro da carência do SIGTERM)
+        self.prazo_fechamento = float(os.environ.get('DB_WRITE_BEHIND_PRAZO', '20'))
+        self._limite_fechamento = None
+        self._pendentes = []; self._primeira = None # _pendentes: grupos (chave, escritas)
+        self._em_voo = [] # chaves dos grupos no commit em andamento
+        self._urgentes = [] # chaves com alguém esperando em descarregar(chave)
+        self._cond = threading.Condition()
+        self._fechada = False
+        self._thread = threading.Thread(target=self._laco, name="db-write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.fechar)
+
+    def enfileirar(self, escritas, chave=None):
+        with self._cond:
+            if self._fechada: raise RuntimeError("Fila de escrita já fechada.")
+            if not self._pendentes: self._primeira = time.monotonic()
+            self._pendentes.append((chave, list(escritas)))
+            self._cond.notify_all()
+
+    def _tamanho(self): return sum(len(g) for _, g in self._pendentes)
+
+    def _laco(self):
+        while True:
+            with self._cond:
+                while not self._pendentes and not self._fechada: self._cond.wait()
+                if not self._pendentes and self._fechada: return
+                while self._tamanho() < self.MAX_ESCRITAS and not self._fechada and time.monotonic() < self._primeira + self.latencia:
+                    self._cond.wait(timeout=max(0.0, self._primeira + self.latencia - time.monotonic()))
+                chaves, grupos = [], []; total = 0 # um grupo cabe sozinho (MAX_ITENS_LOTE)
+                # Grupos de quem espera em descarregar(chave) vão num commit só deles
+                so_urgentes = self._pendentes[0][0] in self._urgentes
+                while self._pendentes and (not grupos or total + len(self._pendentes[0][1]) <= self.MAX_ESCRITAS) \
+                        and (not so_urgentes or self._pendentes[0][0] in self._urgentes):
+                    chave, grupo = self._pendentes.pop(0); chaves.append(chave); grupos.append(grupo); total += len(grupo)
+                self._primeira = time.monotonic() if self._pendentes else None
+                self._em_voo = chaves
+            try: self._gravar(grupos)
+            finally:
+                with self._cond: self._em_voo = []; self._cond.notify_all()
+
+    def _gravar(self, grupos):
+        """Commit dos grupos juntos; com erro permanente, um a um, para só o grupo ruim ser descartado."""
+        erro = self._commit([e for g in grupos for e in g])
+        if erro is None: return
+        if len(grupos) > 1 and not isinstance(erro, self.transitorios):
+            for grupo in grupos:
+                erro_grupo = self._commit(grupo)
+                if erro_grupo is not None: self._descartar(grupo, erro_grupo)
+        else:
+            for grupo in grupos: self._descartar(grupo, erro)
+
+    def _commit(self, lote):
+        """Grava o lote; devolve None ou a exceção que fez desistir (permanente, tentativas esgotadas
+        ou o prazo do fechamento vencido)."""
+        tentativa = 0
+        while True:
+            try:
+                batch = self._client.batch()
+                for ref, dados, merge in lote: batch.set(ref, dados, merge=merge)
+                batch.commit(); return None
+            except Exception as e:
+                tentativa += 1
+                metricas.contar("db_fila_falhas_total", ajuda="Commits da fila write-behind que falharam")
+                print(f"!!! Fila de escrita: falha no commit ({len(lote)} escritas, tentativa {tentativa}): {e!r} !!!")
+                if not isinstance(e, self.transitorios) or tentativa >= self.tentativas: return e
+                if self._limite_fechamento is not None and time.monotonic() >= self._limite_fechamento: return e
+                espera = min(self.MAX_ESPERA, 0.5 * 2 ** min(tentativa, 6))
+                if self._limite_fechamento is not None: espera = min(espera, max(0.0, self._limite_fechamento - time.monotonic()))
+                time.sleep(espera)
+
+    def _descartar(self, grupo, erro):
+        """Dead letter: cada escrita não gravada vai para o log e (se o banco aceitar) para escritas_falhas."""
+        metricas.contar("db_fila_descartadas_total", len(grupo), ajuda="Escritas da fila write-behind não gravadas (dead letter)",
+                        motivo="transitorio" if isinstance(erro, self.transitorios) else "permanente")
+        for ref, dados, merge in grupo: print(f"!!! Escrita NÃO gravada ({erro!r}): {ref.path} merge={merge} {dados!r} !!!")
+        try:
+            batch = self._client.batch(); colecao = self._client.collection(self.COLECAO_FALHAS)
+            for ref, dados, merge in grupo:
+                # repr: os sentinelas (Increment, SERVER_TIMESTAMP) não são gravados como valor
+                batch.set(colecao.document(), {'caminho': ref.path, 'dados': repr(dados)[:50000], 'merge': merge,
+                                               'erro': repr(erro)[:2000], 'em': datetime.now(timezone.utc)})
+            batch.commit()
+        except Exception as e: print(f"!!! Dead letter não gravado em {self.COLECAO_FALHAS} (só no log): {e!r} !!!")
+
+    def descarregar(self, chave=None):
+        """Bloqueia até que o que foi enfileirado (com essa chave, ou tudo) tenha sido gravado (ou descartado).
+        Com chave, os grupos dela passam à frente dos outros (as escritas de cada usuário seguem em ordem)."""
+        with self._cond:
+            if chave is not None:
+                self._urgentes.append(chave)
+                self._pendentes.sort(key=lambda g: g[0] not in self._urgentes) # estável: mantém a ordem de cada usuário
+                pendente = lambda: any(c == chave for c, _ in self._pendentes) or chave in self._em_voo
+            else: pendente = lambda: bool(self._pendentes or self._em_voo)
+            try:
+                if pendente() and self._pendentes: self._primeira = time.monotonic() - self.latencia; self._cond.notify_all()
+                while pendente(): self._cond.wait()
+            finally:
+                if chave is not None: self._urgentes.remove(chave)
+
+    def fechar(self):
+        with self._cond:
+            if not self._fechada: self._limite_fechamento = time.monotonic() + self.prazo_fechamento
+            self._fechada = True; self._cond.notify_all()
+        self._thread.join()
+
+# --- INTERFACE DE ARMAZENAMENTO ---
 class Database:
+    """Interface de armazenamento usada pelo bot (via db/adb).
+
+    Aqui fica o que não depende do banco: cache de linhas e agregados, filtros em
+    memória, paginação sobre o cache e a janela de series_mensais. Os backends
+    (FirestoreDatabase, abaixo, e SQLiteDatabase em db_sqlite.py) implementam o resto.
+    O backend é escolhido por DB_BACKEND (ver criar_database).
+    """
     def __init__(self):
-        if not firebase_admin._apps:
-            json_config = os.environ.get('FIREBASE_CREDENTIALS')
-            if not json_config:
-                raise ValueError("Erro: A variável FIREBASE_CREDENTIALS não está configurada.")
+        self.cache = CacheTransacoes()
+        self._perfis = {} # user_id -> nome já gravado no perfil por este processo
+        # Documentos (Firestore) ou linhas (SQLite) lidos/gravados no banco; o cache não conta
+        self.leituras = 0; self.escritas = 0
+        self._lock_contadores = threading.Lock()
+
+    def _contar(self, leituras=0, escritas=0):
+        with self._lock_contadores: self.leituras += leituras; self.escritas += escritas
+        registrar_banco(leituras, escritas)
+
+    def _contando(self, docs):
+        """Repassa um stream de documentos/linhas contando as leituras."""
+        for doc in docs:
+            self._contar(leituras=1)
+            yield doc
+
+    def contadores(self):
+        with self._lock_contadores: return {'leituras': self.leituras, 'escritas': self.escritas}
+
+    def conectar(self):
+        """Abre a conexão com o banco já (pré-aquecimento); sem isso, ela abre no primeiro uso."""
+
+    def _sincronizar(self, user_id=None):
+        """Antes de ler do banco, garante que escritas pendentes (do usuário, ou todas) já foram gravadas (padrão: nada a fazer)."""
+
+    def encerrar(self):
+        """Desligamento: grava o que ainda estiver pendente (padrão: nada a fazer)."""
+
+    # --- USUÁRIOS ---
+    def listar_usuarios(self, apenas_ativos=False): raise NotImplementedError
+    def marcar_usuario_bloqueado(self, user_id): raise NotImplementedError
+    def registrar_migracao(self, user_id, novo_id): raise NotImplementedError
+    def listar_usuarios_com_nome(self): raise NotImplementedError
+
+    # --- TRANSAÇÕES ---
+    def add_transacao(self, user_id, tipo, valor_num, valor_txt, categoria, descricao, metodo="dinheiro", cartao=None, nome=""):
+        """Grava a transação e o perfil do usuário; devolve a linha (Transacao) e atualiza o cache."""
+        return self.add_transacoes(user_id, [{'tipo': tipo, 'valor_num': valor_num, 'valor_txt': valor_txt, 'categoria': categoria,
+                                              'descricao': descricao, 'metodo': metodo, 'cartao': cartao}], nome)[0]
+
+    def add_transacoes(self, user_id, itens, nome=""):
+        """Vários lançamentos num único commit (itens: dicts no formato de interpretar_mensagem, até
+        MAX_ITENS_LOTE); devolve as linhas (Transacao) na ordem dos itens e atualiza o cache."""
+        raise NotImplementedError
+
+    MAX_ITENS_LOTE = 400 # cabe num batch do Firestore (500 operações) com o perfil e o agregado
+
+    @staticmethod
+    def _dados_itens(user_id, itens):
+        """Documentos das transações de um lote. Sem 'data' no item, as datas avançam 1µs por item: a
+        ordem do extrato (e os cursores de página, que usam a data) segue a ordem da mensagem.
+        Itens importados de extrato trazem a própria 'data' e o 'hash_importacao' (deduplicação)."""
+        if len(itens) > Database.MAX_ITENS_LOTE: raise ValueError(f"Lote com {len(itens)} itens (máximo {Database.MAX_ITENS_LOTE}).")
+        agora = agora_local(); lote = []
+        for i, item in enumerate(itens):
+            dados = {'user_id': user_id, 'tipo': item['tipo'], 'valor_num': float(item['valor_num']), 'valor_txt': item.get('valor_txt'),
+                     'categoria': item['categoria'], 'descricao': item.get('descricao'), 'metodo': item.get('metodo') or "dinheiro",
+                     'cartao': item.get('cartao'), 'data': item.get('data') or agora + timedelta(microseconds=i)}
+            if item.get('hash_importacao'): dados['hash_importacao'] = item['hash_importacao']
+            lote.append(dados)
+        return lote
+
+    def importados(self, user_id):
+        """{hash_importacao: data} dos lançamentos de extrato já gravados para o usuário (deduplicação
+        da importação e o próximo horário livre de cada dia, ver importacao.importar)."""
+        raise NotImplementedError
+
+    def limpar_transacoes(self, user_id, opcao=None):
+        """Apaga as transações do período, só do usuário (user_id obrigatório), e devolve
+        {'removidos', 'entrada', 'gasto', 'falhas'} com o que saiu (e o que não conseguiu apagar)."""
+        raise NotImplementedError
+
+    @staticmethod
+    def _exigir_usuario(user_id):
+        # Sem user_id as consultas não filtram usuário: a exclusão pegaria as transações de todos
+        if user_id is None: raise ValueError("limpar_transacoes precisa de user_id.")
+
+    @staticmethod
+    def _resumo_remocao(removidos, falhas=0):
+        """'falhas': exclusões que o banco não confirmou (as transações continuam lá e fora do resumo)."""
+        resumo = {'removidos': len(removidos), 'entrada': Decimal("0.00"), 'gasto': Decimal("0.00"), 'falhas': falhas}
+        for d in removidos:
+            if d.get('tipo') in ("entrada", "gasto"): resumo[d['tipo']] += Decimal(f"{float(d.get('valor_num') or 0.0):.2f}")
+        return resumo
+
+    # --- AGREGADOS POR USUÁRIO ---
+    # Formato: total: {entrada, gasto} | meses: {"AAAA-MM": {entrada, gasto}} | categorias: {tipo: {categoria: valor}}
+    #          | cartoes: {cartao: valor} (só gastos)
+    # 'completo' só fica True depois de um rebuild; sem ele os totais podem não cobrir o histórico antigo.
+    # 'versao' muda quando o formato ganha buckets novos: agregados de versão anterior são reconstruídos.
+    VERSAO_AGREGADO = 2
+
+    @staticmethod
+    def _chave_mes(dt):
+        return data_local(dt).strftime("%Y-%m")
+
+    @classmethod
+    def _aplicar_no_agregado(cls, agregado, linhas, sinal=1):
+        """Soma/subtrai as linhas (dicts de transação) direto no agregado local."""
+        total = agregado.setdefault('total', {}); meses = agregado.setdefault('meses', {}); categorias = agregado.setdefault('categorias', {})
+        cartoes = agregado.setdefault('cartoes', {})
+        for d in linhas:
+            tipo = d.get('tipo'); valor = sinal * float(d.get('valor_num') or 0.0)
+            if tipo not in ("entrada", "gasto"): continue
+            total[tipo] = total.get(tipo, 0.0) + valor
+            if d.get('data'):
+                mes = meses.setdefault(cls._chave_mes(d['data']), {})
+                mes[tipo] = mes.get(tipo, 0.0) + valor
+            cats = categorias.setdefault(tipo, {}); cat = d.get('categoria') or "Outros"
+            cats[cat] = cats.get(cat, 0.0) + valor
+            if tipo == "gasto" and d.get('cartao'): cartoes[d['cartao']] = cartoes.get(d['cartao'], 0.0) + valor
+        return agregado
+
+    def _calcular_agregado(self, linhas, user_id):
+        """Recalcula o agregado completo a partir das linhas brutas (dicts)."""
+        agregado = {'user_id': user_id, 'total': {"entrada": 0.0, "gasto": 0.0}, 'meses': {}, 'categorias': {"entrada": {}, "gasto": {}},
+                    'cartoes': {}, 'completo': True, 'versao': self.VERSAO_AGREGADO}
+        return self._aplicar_no_agregado(agregado, linhas, sinal=1)
+
+    def reconstruir_agregado(self, user_id): raise NotImplementedError
+    def get_agregado(self, user_id): raise NotImplementedError
+
+    def _meses_alinhados(self, inicio, fim):
+        """Se [inicio, fim] cobre meses inteiros, devolve as chaves 'AAAA-MM'; senão None."""
+        if inicio is None or fim is None: return None
+        if (inicio.day, inicio.hour, inicio.minute, inicio.second, inicio.microsecond) != (1, 0, 0, 0, 0): return None
+        prox = (fim.replace(day=1) + timedelta(days=32)).replace(day=1)
+        ultimo_dia = prox - timedelta(days=1)
+        if fim.date() != ultimo_dia.date() or (fim.hour, fim.minute, fim.second) != (23, 59, 59): return None
+        chaves = []; ano, mes = inicio.year, inicio.month
+        while (ano, mes) <= (fim.year, fim.month):
+            chaves.append(f"{ano:04d}-{mes:02d}")
+            mes += 1
+            if mes > 12: mes = 1; ano += 1
+        return chaves
+
+    # --- LEITURA DE DADOS ---
+    def get_soma(self, user_id, tipo, inicio=None, fim=None): raise NotImplementedError
+
+    def iter_todas(self, user_id=None, tipo=None, inicio=None, fim=None):
+        """Versão em streaming: devolve as transações (Transacao) uma a uma, da mais recente para a mais antiga."""
+        raise NotImplementedError
+
+    def get_todas(self, user_id=None, tipo=None, inicio=None, fim=None):
+        if not user_id: return self._consultar_todas(user_id, tipo, inicio, fim)
+        # Por usuário: o histórico inteiro fica no cache e os filtros são aplicados em memória
+        linhas = self.cache.obter_linhas(user_id)
+        if linhas is None:
+            linhas = self._consultar_todas(user_id)
+            self.cache.guardar_linhas(user_id, linhas)
+        return [t for t in linhas
+                if (tipo is None or t.tipo == tipo)
+                and (inicio is None or (t.data is not None and t.data >= inicio))
+                and (fim is None or (t.data is not None and t.data <= fim))]
+
+    def _consultar_todas(self, user_id=None, tipo=None, inicio=None, fim=None):
+        return list(self.iter_todas(user_id, tipo, inicio, fim))
+
+    def get_pagina(self, user_id, tipo, limite=15, apos=None, antes=None):
+        """Uma página do extrato (mais recentes primeiro) usando cursores (data, id).
+
+        apos: (data, id) da última linha da página atual (próxima página).
+        antes: (data, id) da primeira linha da página atual (página anterior).
+        A ordem é (data, id) decrescente, como nas consultas: linhas com a mesma data (extratos
+        importados) não somem na virada da página.
+        Retorna (linhas, tem_anterior, tem_proxima). Lê no máximo limite + 1 linhas do banco.
+        """
+        linhas = self.cache.obter_linhas(user_id)
+        if linhas is not None:
+            # Histórico já em memória: só fatia
+            chave = lambda data, id_: (data, self._chave_id(id_))
+            linhas = [t for t in linhas if t.tipo == tipo and t.data is not None]
+            if antes is not None:
+                anteriores = [t for t in linhas if chave(t.data, t.id) > chave(*antes)]
+                return anteriores[-limite:], len(anteriores) > limite, True
+            if apos is not None: linhas = [t for t in linhas if chave(t.data, t.id) < chave(*apos)]
+            return linhas[:limite], apos is not None, len(linhas) > limite
+        return self._consultar_pagina(user_id, tipo, limite, apos, antes)
+
+    @staticmethod
+    def _chave_id(id_):
+        """Ordem do id no desempate de datas iguais (Firestore: o ID do documento, como texto)."""
+        return id_
+
+    def _consultar_pagina(self, user_id, tipo, limite, apos, antes): raise NotImplementedError
+
+    def gastos_por_categoria(self, user_id=None, inicio=None, fim=None):
+        return self._somar_gastos('categoria', user_id, inicio, fim)
+
+    def get_gastos_por_cartao(self, user_id=None, inicio=None, fim=None):
+        return self._somar_gastos('cartao', user_id, inicio, fim)
+
+    def _somar_gastos(self, campo, user_id, inicio, fim):
+        """Gastos somados por 'categoria' ou 'cartao', como [(chave, valor)].
+
+        Usa o caminho mais barato disponível: o bucket do agregado (histórico todo), as
+        linhas já em cache, ou a agregação no banco (_agrupar_gastos).
+        """
+        if user_id:
+            if inicio is None and fim is None:
+                agregado = self.get_agregado(user_id)
+                bucket = agregado.get('categorias', {}).get('gasto', {}) if campo == 'categoria' else agregado.get('cartoes', {})
+                return [(k, v) for k, v in bucket.items() if round(v, 2)]
+            linhas = self.cache.obter_linhas(user_id)
+            if linhas is not None:
+                agrupado = {}
+                for t in linhas:
+                    if t.tipo != 'gasto' or (inicio is not None and (t.data is None or t.data < inicio)) or (fim is not None and (t.data is None or t.data > fim)): continue
+                    chave = getattr(t, campo)
+                    if campo == 'cartao' and not chave: continue
+                    agrupado[chave] = agrupado.get(chave, 0.0) + float(t.valor)
+                return list(agrupado.items())
+        return self._agrupar_gastos(campo, user_id or None, inicio, fim)
+
+    def _agrupar_gastos(self, campo, user_id, inicio, fim):
+        """Soma os gastos por campo no banco, lendo só campo e valor (sem montar Transacao nem ordenar)."""
+        raise NotImplementedError
+
+    def _somas_por_mes(self, user_id, inicio, fim):
+        """Somas por mês e tipo, {"AAAA-MM": {tipo: valor}}, cobrindo pelo menos [inicio, fim)."""
+        raise NotImplementedError
+
+    def series_mensais(self, user_id=None, meses=6):
+        hoje = agora_local(); janela = []; ano, mes = hoje.year, hoje.month
+        for _ in range(meses):
+            janela.append((ano, mes)); mes -= 1
+            if mes <= 0: mes = 12; ano -= 1
+        janela.reverse()
+        if not janela: return [], [], []
+        labels = [datetime(a, m, 1).strftime("%b/%Y") for a, m in janela]
+        chaves = [f"{a:04d}-{m:02d}" for a, m in janela]
+        inicio = datetime(janela[0][0], janela[0][1], 1)
+        fim = (datetime(hoje.year, hoje.month, 1) + timedelta(days=32)).replace(day=1)
+        buckets = self._somas_por_mes(user_id, inicio, fim)
+        entradas_vals = [round(buckets.get(c, {}).get("entrada", 0.0), 2) for c in chaves]
+        gastos_vals = [round(buckets.get(c, {}).get("gasto", 0.0), 2) for c in chaves]
+        return labels, entradas_vals, gastos_vals
+
+    # --- JOBS DE BROADCAST ---
+    # Job: mensagem, status (pendente|executando|concluido|expirado), cursor (id do último usuário
+    # já tratado), lote_em_andamento/lote_fim (lote gravado ANTES de enviar), contadores e o lease:
+    # dono (quem está enviando) e lease_ate (epoch em s). Só o dono envia; outro processo só
+    # assume o job depois que o lease expira (o dono caiu sem renovar).
+    def listar_usuarios_lote(self, apos=None, limite=100, apenas_ativos=True):
+        """Página de usuários ordenada por ID. Retorna (ids, cursor do último usuário lido ou None no fim)."""
+        raise NotImplementedError
+
+    def contar_usuarios(self, apenas_ativos=False):
+        """Quantos usuários há (apenas_ativos: sem os que bloquearam o bot, os alvos de um broadcast),
+        contados no banco, sem trazer os documentos."""
+        raise NotImplementedError
+
+    def criar_job_broadcast(self, job_id, mensagem):
+        """Cria o job se ainda não existir; devolve o estado atual (novo ou já existente)."""
+        raise NotImplementedError
+
+    def get_job_broadcast(self, job_id): raise NotImplementedError
+    def atualizar_job_broadcast(self, job_id, campos, incrementos=None): raise NotImplementedError
+    def listar_jobs_pendentes(self): raise NotImplementedError
+
+    def reivindicar_job_broadcast(self, job_id, dono, duracao):
+        """Assume o job (ou renova o lease, se dono já é o dono) atomicamente, por `duracao` segundos.
+        Devolve o job, ou None se ele não existe, já terminou ou outro dono tem lease válido."""
+        raise NotImplementedError
+
+    @staticmethod
+    def _pode_assumir(job, dono, agora):
+        return job.get('status') in ('pendente', 'executando') and (job.get('dono') in (None, dono) or (job.get('lease_ate') or 0) < agora)
+
+    # Envios do lote em andamento (checkpoint por envio): 'iniciado' antes do send_message e,
+    # depois, o resultado ('enviado', 'bloqueado', 'falha'). Apagados quando o lote termina.
+    def marcar_envio_broadcast(self, job_id, user_id, estado): raise NotImplementedError
+
+    def envios_broadcast(self, job_id, user_ids):
+        """{user_id: estado} dos envios marcados; quem não aparece ainda não tinha começado."""
+        raise NotImplementedError
+
+    def limpar_envios_broadcast(self, job_id, user_ids): raise NotImplementedError
+
+    @staticmethod
+    def _novo_job(mensagem):
+        return {'mensagem': mensagem, 'status': 'pendente', 'cursor': None, 'lote_em_andamento': [], 'lote_fim': None,
+                'enviados': 0, 'bloqueados': 0, 'migrados': 0, 'falhas': 0, 'incertos': 0, 'criado_em': datetime.now(),
+                'criado_ts': time.time(), 'dono': None, 'lease_ate': None}
+
+    # --- CONFIG ---
+    def get_config(self, key): raise NotImplementedError
+    def set_config(self, key, value): raise NotImplementedError
+
+    # --- ESTADO DA CONVERSA (persistência do user_data, ver persistencia.py) ---
+    def get_estado_usuario(self, user_id): raise NotImplementedError
+
+    def salvar_estados_usuarios(self, estados):
+        """Grava {user_id: dict} numa única escrita em lote; None apaga o estado do usuário."""
+        raise NotImplementedError
+
+# --- BACKEND FIRESTORE ---
+class FirestoreDatabase(Database):
+    """Backend Firestore. A conexão é preguiçosa: o import do firebase-admin, o cliente e as
+    coleções são criados no primeiro acesso a db/fila/collection_* (ou em conectar()).
+
+    Layout das transações (FIRESTORE_LAYOUT):
+    - 'plano' (padrão): coleção transacoes/{id}, filtrada por user_id.
+    - 'usuario': subcoleção usuarios/{uid}/transacoes/{id}; as consultas de um usuário não
+      precisam de índice com user_id. As consultas gerais (user_id=None) viram collection group,
+      que também enxerga a coleção plana: só use depois do --limpar-plano do migrar_layout.py.
+    """
+    LAYOUTS = ('plano', 'usuario')
+
+    def __init__(self, layout=None):
+        super().__init__()
+        self.layout = (layout or os.environ.get('FIRESTORE_LAYOUT', 'plano')).strip().lower()
+        if self.layout not in self.LAYOUTS:
+            raise ValueError(f"Erro: FIRESTORE_LAYOUT desconhecido: {self.layout!r} (use 'plano' ou 'usuario').")
+        self._lock_conexao = threading.Lock()
+        self.cache.validador = self._agregado_no_banco
+
+    def conectar(self):
+        with self._lock_conexao:
+            if 'db' in self.__dict__: return self.db
+            _importar_firebase()
+            if not firebase_admin._apps:
+                json_config = os.environ.get('FIREBASE_CREDENTIALS')
+                if not json_config:
+                    raise ValueError("Erro: A variável FIREBASE_CREDENTIALS não está configurada.")
+                
+                cred_dict = json.loads(json_config)
+                cred = credentials.Certificate(cred_dict)
+                firebase_admin.initialize_app(cred)
             
-            cred_dict = json.loads(json_config)
-            cred = credentials.Certificate(cred_dict)
-            firebase_admin.initialize_app(cred)
-        
-        self.db = firestore.client()
-        self.collection_transacoes = self.db.collection('transacoes')
-        self.collection_usuarios = self.db.collection('usuarios')
-        self.collection_config = self.db.collection('app_config')
+            cliente = firestore.client()
+            self.collection_transacoes = cliente.collection('transacoes')
+            self.collection_usuarios = cliente.collection('usuarios')
+            self.collection_config = cliente.collection('app_config')
+            self.collection_agregados = cliente.collection('agregados')
+            self.collection_jobs = cliente.collection('broadcast_jobs')
+            self.collection_estados = cliente.collection('estado_usuarios')
+            self.fila = FilaEscrita(cliente) if os.environ.get('DB_WRITE_BEHIND') == '1' else None
+            self.db = cliente # por último: a partir daqui a conexão está pronta
+        return self.db
+
+    def __getattr__(self, nome):
+        # Só é chamado para atributos que ainda não existem: conecta no primeiro uso
+        if nome in ('db', 'fila') or nome.startswith('collection_'):
+            self.conectar(); return self.__dict__[nome]
+        raise AttributeError(nome)
 
     # --- USUÁRIOS ---
-    def listar_usuarios(self):
-        docs = self.collection_usuarios.stream()
-        return [int(doc.id) for doc in docs]
+    def _colecao_transacoes(self, user_id):
+        """Onde ficam (e são criadas) as transações do usuário, conforme o layout."""
+        if self.layout == 'usuario': return self.collection_usuarios.document(str(user_id)).collection('transacoes')
+        return self.collection_transacoes
+
+    def _consulta_transacoes(self, user_id=None):
+        """Consulta base das transações de um usuário, ou de todos (user_id=None)."""
+        if user_id is None:
+            return self.db.collection_group('transacoes') if self.layout == 'usuario' else self.collection_transacoes
+        colecao = self._colecao_transacoes(user_id)
+        return colecao if self.layout == 'usuario' else colecao.where(filter=FieldFilter('user_id', '==', user_id))
+
+    def listar_usuarios(self, apenas_ativos=False):
+        docs = self._contando(self.collection_usuarios.stream())
+        return [int(doc.id) for doc in docs if not (apenas_ativos and doc.to_dict().get('bloqueado'))]
+
+    def marcar_usuario_bloqueado(self, user_id):
+        """Usuário bloqueou o bot (Forbidden): sai dos próximos broadcasts até voltar a usar."""
+        self._perfis.pop(user_id, None) # a próxima transação regrava o perfil (bloqueado=False)
+        self.collection_usuarios.document(str(user_id)).set({'bloqueado': True, 'bloqueado_em': datetime.now()}, merge=True)
+        self._contar(escritas=1)
+
+    def registrar_migracao(self, user_id, novo_id):
+        """Chat migrou (ChatMigrated): o ID antigo deixa de receber e o novo passa a existir."""
+        batch = self.db.batch()
+        batch.set(self.collection_usuarios.document(str(user_id)), {'bloqueado': True, 'migrado_para': novo_id}, merge=True)
+        batch.set(self.collection_usuarios.document(str(novo_id)), {'user_id': novo_id, 'migrado_de': user_id}, merge=True)
+        batch.commit(); self._contar(escritas=2)
 
     def listar_usuarios_com_nome(self):
-        docs = self.collection_usuarios.stream()
+        docs = self._contando(self.collection_usuarios.stream())
         lista = []
         for doc in docs:
             dados = doc.to_dict()
@@ -46,155 +722,502 @@ class Database:
         return lista
 
     # --- TRANSAÇÕES ---
-    def add_transacao(self, user_id, tipo, valor_num, valor_txt, categoria, descricao, metodo="dinheiro", cartao=None, nome=""):
-        self.collection_usuarios.document(str(user_id)).set({
-            'user_id': user_id,
-            'nome': nome
-        }, merge=True)
-
-        dados = {
-            'user_id': user_id,
-            'tipo': tipo,
-            'valor_num': float(valor_num), 
-            'valor_txt': valor_txt,
-            'categoria': categoria,
-            'descricao': descricao,
-            'metodo': metodo,
-            'cartao': cartao,
-            'data': datetime.now()
+    def add_transacoes(self, user_id, itens, nome=""):
+        escritas = [] # (referência, dados, merge) -> um único commit
+        # O perfil quase nunca muda: só regrava quando o nome difere do que este processo já gravou
+        if self._perfis.get(user_id) != nome:
+            escritas.append((self.collection_usuarios.document(str(user_id)), {
+                'user_id': user_id,
+                'nome': nome,
+                'bloqueado': False
+            }, True))
+
+        # Perfil, transações e agregado vão no mesmo batch (commit atômico)
+        novos = [(self._colecao_transacoes(user_id).document(), dados) for dados in self._dados_itens(user_id, itens)]
+        # Quando foi gravada (não a 'data' do lançamento, que pode ser passada): o sincronizar da migração usa
+        for _, dados in novos: dados['criado_em'] = firestore.SERVER_TIMESTAMP
+        escritas.extend((ref, {**dados, 'data': data_no_banco(dados['data'])}, False) for ref, dados in novos)
+        escritas.append((self.collection_agregados.document(str(user_id)), self._delta_agregado([d for _, d in novos], sinal=1), True))
+        self._gravar(escritas, user_id)
+        self._perfis[user_id] = nome
+        # Devolve as linhas no mesmo formato de get_todas (permite aplicar a escrita localmente)
+        linhas = []
+        for ref, d in novos:
+            linha = Transacao(ref.id, d['tipo'], Decimal(f"{d['valor_num']:.2f}"), d['categoria'], d['metodo'], d['cartao'], d['data'], d['descricao'])
+            self.cache.adicionar(user_id, linha, d); linhas.append(linha)
+        self.cache.avancar_revisao(user_id)
+        return linhas
+
+    def _gravar(self, escritas, user_id=None):
+        """Commit de uma lista de (referência, dados, merge): direto num batch ou pela fila write-behind."""
+        self._contar(escritas=len(escritas))
+        if self.fila is not None:
+            self.fila.enfileirar(escritas, user_id); return
+        batch = self.db.batch()
+        for ref, dados, merge in escritas: batch.set(ref, dados, merge=merge)
+        batch.commit()
+
+    def _sincronizar(self, user_id=None):
+        """Antes de ler do Firestore, garante que as escritas pendentes na fila já foram gravadas: só as
+        do usuário numa leitura dele (não espera as rajadas dos outros), todas numa leitura geral."""
+        if self.fila is not None: self.fila.descarregar(user_id)
+
+    def encerrar(self):
+        # Sem conexão aberta não há fila (e não vale conectar só para fechar)
+        fila = self.__dict__.get('fila')
+        if fila is not None: fila.fechar()
+
+    def importados(self, user_id):
+        # Desigualdade no campo: só lê os documentos que vieram de extrato (índice user_id + hash_importacao)
+        self._sincronizar(user_id)
+        query = self._consulta_transacoes(user_id).where(filter=FieldFilter('hash_importacao', '>', ''))
+        return {d['hash_importacao']: data_local(d.get('data'))
+                for d in (doc.to_dict() for doc in self._contando(query.select(['hash_importacao', 'data']).stream()))}
+
+    # --- AGREGADOS POR USUÁRIO ---
+    # Documento agregados/{user_id}, no formato descrito em Database; atualizado com Increment a cada escrita.
+    # 'revisao' conta as escritas do usuário (Increment(1) em cada uma): é o que o cache confere.
+    def _delta_agregado(self, linhas, sinal=1):
+        """Monta os incrementos (Increment) do agregado para uma lista de dicts de transação."""
+        total = {}; meses = {}; categorias = {}; cartoes = {}
+        for d in linhas:
+            tipo = d.get('tipo'); valor = sinal * float(d.get('valor_num') or 0.0)
+            if tipo not in ("entrada", "gasto"): continue
+            total[tipo] = total.get(tipo, 0.0) + valor
+            if d.get('data'):
+                mes = meses.setdefault(self._chave_mes(d['data']), {})
+                mes[tipo] = mes.get(tipo, 0.0) + valor
+            cats = categorias.setdefault(tipo, {}); cat = d.get('categoria') or "Outros"
+            cats[cat] = cats.get(cat, 0.0) + valor
+            if tipo == "gasto" and d.get('cartao'): cartoes[d['cartao']] = cartoes.get(d['cartao'], 0.0) + valor
+        delta = {
+            'total': {k: firestore.Increment(v) for k, v in total.items()},
+            'meses': {m: {k: firestore.Increment(v) for k, v in tipos.items()} for m, tipos in meses.items()},
+            'categorias': {t: {c: firestore.Increment(v) for c, v in cats.items()} for t, cats in categorias.items()},
+            'cartoes': {c: firestore.Increment(v) for c, v in cartoes.items()},
         }
-        self.collection_transacoes.add(dados)
+        delta = {k: v for k, v in delta.items() if v}
+        delta['revisao'] = firestore.Increment(1)
+        return delta
+
+    @classmethod
+    def _diferenca_agregado(cls, novo, atual):
+        """Increment de cada valor que difere entre os mapas numéricos (total, meses, ...) recalculados
+        e os gravados; valores que só existem no gravado vão a zero."""
+        numero = lambda v: isinstance(v, (int, float)) and not isinstance(v, bool)
+        delta = {}; atual = atual or {}
+        for chave in set(novo) | set(atual):
+            n, a = novo.get(chave), atual.get(chave)
+            if isinstance(n, dict) or (n is None and isinstance(a, dict)):
+                sub = cls._diferenca_agregado(n or {}, a if isinstance(a, dict) else {})
+                if sub: delta[chave] = sub
+            elif numero(n) or (n is None and numero(a)):
+                diferenca = float(n or 0.0) - (float(a) if numero(a) else 0.0)
+                if abs(diferenca) >= 0.005: delta[chave] = firestore.Increment(diferenca)
+        return delta
+
+    def reconstruir_agregado(self, user_id):
+        """Reparo: recalcula agregados/{user_id} a partir das transações do usuário.
+
+        Fora de transação (um histórico grande estoura o tamanho e o tempo dela): o agregado e as
+        transações são lidos no mesmo instante (read_time) e só a diferença é gravada, com Increment.
+        Os Increment de escritas feitas depois desse instante continuam valendo."""
+        self._sincronizar(user_id)
+        agg_ref = self.collection_agregados.document(str(user_id))
+        instante = datetime.now(timezone.utc)
+        doc = agg_ref.get(read_time=instante); self._contar(leituras=1)
+        query = self._consulta_transacoes(user_id).select(['tipo', 'valor_num', 'categoria', 'cartao', 'data'])
+        novo = self._calcular_agregado((d.to_dict() for d in self._contando(query.stream(read_time=instante))), user_id)
+        atual = doc.to_dict() if doc.exists else {}
+        delta = {k: v for k, v in novo.items() if not isinstance(v, dict)} # user_id, completo, versao
+        delta['revisao'] = firestore.Increment(1)
+        delta.update(self._diferenca_agregado({k: v for k, v in novo.items() if isinstance(v, dict)},
+                                              {k: v for k, v in atual.items() if isinstance(v, dict)}))
+        agg_ref.set(delta, merge=True); self._contar(escritas=1)
+        # O valor final inclui o que chegou depois do instante: relê em vez de supor
+        agregado = agg_ref.get().to_dict(); self._contar(leituras=1)
+        self.cache.guardar_agregado(user_id, agregado)
+        return agregado
+
+    def _agregado_no_banco(self, user_id):
+        """Validador do cache: o agregado como está no banco agora (1 leitura)."""
+        self._sincronizar(user_id)
+        doc = self.collection_agregados.document(str(user_id)).get(); self._contar(leituras=1)
+        return doc.to_dict() if doc.exists else None
+
+    def get_agregado(self, user_id):
+        """Lê o agregado do usuário; reconstrói na primeira vez (usuários com histórico anterior ao agregado)."""
+        agregado = self.cache.obter_agregado(user_id)
+        if agregado is not None: return agregado
+        self._sincronizar(user_id)
+        doc = self.collection_agregados.document(str(user_id)).get(); self._contar(leituras=1)
+        if doc.exists:
+            dados = doc.to_dict()
+            if dados.get('completo') and dados.get('versao', 1) >= self.VERSAO_AGREGADO:
+                dados.setdefault('revisao', 0) # agregados gravados antes do campo
+                self.cache.guardar_agregado(user_id, dados)
+                return dados
+        return self.reconstruir_agregado(user_id)
 
     # --- LEITURA DE DADOS ---
     def get_soma(self, user_id, tipo, inicio=None, fim=None):
+        # O(1) pelo agregado quando o intervalo é "tudo" ou meses inteiros
+        if user_id is not None:
+            if inicio is None and fim is None:
+                total = self.get_agregado(user_id).get('total', {}).get(tipo, 0.0)
+                return Decimal(f"{total:.2f}")
+            meses = self._meses_alinhados(inicio, fim)
+            if meses is not None:
+                buckets = self.get_agregado(user_id).get('meses', {})
+                total = sum(buckets.get(m, {}).get(tipo, 0.0) for m in meses)
+                return Decimal(f"{total:.2f}")
+            # Intervalo arbitrário: soma as linhas do cache (carregadas uma vez por usuário)
+            total = sum((t.valor for t in self.get_todas(user_id, tipo, inicio, fim)), Decimal("0.00"))
+            return total.quantize(Decimal("0.01"))
+
         # Correção dos Warnings: Usando FieldFilter
-        query = self.collection_transacoes
-        query = query.where(filter=FieldFilter('user_id', '==', user_id))
+        query = self._consulta_transacoes()
         query = query.where(filter=FieldFilter('tipo', '==', tipo))
         
-        if inicio: query = query.where(filter=FieldFilter('data', '>=', inicio))
-        if fim: query = query.where(filter=FieldFilter('data', '<=', fim))
+        if inicio: query = query.where(filter=FieldFilter('data', '>=', data_no_banco(inicio)))
+        if fim: query = query.where(filter=FieldFilter('data', '<=', data_no_banco(fim)))
 
-        docs = query.stream()
+        docs = self._contando(query.stream())
         total = 0.0
         for doc in docs:
             total += doc.to_dict().get('valor_num', 0.0)
         
         return Decimal(f"{total:.2f}")
 
-    def get_todas(self, user_id=None, tipo=None, inicio=None, fim=None):
-        query = self.collection_transacoes
+    def iter_todas(self, user_id=None, tipo=None, inicio=None, fim=None):
+        """Versão em streaming: devolve as transações (Transacao) uma a uma, da mais recente para a mais antiga."""
+        self._sincronizar(user_id or None)
+        query = self._consulta_transacoes(user_id or None)
         
-        if user_id: query = query.where(filter=FieldFilter('user_id', '==', user_id))
         if tipo: query = query.where(filter=FieldFilter('tipo', '==', tipo))
-        if inicio: query = query.where(filter=FieldFilter('data', '>=', inicio))
-        if fim: query = query.where(filter=FieldFilter('data', '<=', fim))
-            
-        docs = query.stream()
-        
-        resultados = []
-        for doc in docs:
-            d = doc.to_dict()
-            dt = d.get('data')
-            if dt and hasattr(dt, 'timestamp'):
-                 dt = datetime.fromtimestamp(dt.timestamp())
-
-            linha = [
-                doc.id,             # 0
-                d.get('tipo'),      # 1
-                d.get('valor_num'), # 2
-                d.get('categoria'), # 3
-                d.get('metodo'),    # 4
-                d.get('cartao'),    # 5
-                dt,                 # 6
-                d.get('descricao')  # 7
-            ]
-            resultados.append(linha)
-            
-        resultados.sort(key=lambda x: x[6] if x[6] else datetime.min, reverse=True)
-        return resultados
+        if inicio: query = query.where(filter=FieldFilter('data', '>=', data_no_banco(inicio)))
+        if fim: query = query.where(filter=FieldFilter('data', '<=', data_no_banco(fim)))
+        # A ordem vem do índice (firestore.indexes.json), sem sort em Python; o ID desempata datas iguais
+        query = query.order_by('data', direction=firestore.Query.DESCENDING).order_by('__name__', direction=firestore.Query.DESCENDING)
 
-    def gastos_por_categoria(self, user_id=None, inicio=None, fim=None):
-        transacoes = self.get_todas(user_id, tipo='gasto', inicio=inicio, fim=fim)
-        agrupado = {}
-        for t in transacoes:
-            cat = t[3]
-            val = t[2] 
-            if cat not in agrupado: agrupado[cat] = 0.0
-            agrupado[cat] += float(val)
-        return [(k, v) for k, v in agrupado.items()]
-
-    def get_gastos_por_cartao(self, user_id=None):
-        transacoes = self.get_todas(user_id, tipo='gasto')
+        for doc in self._contando(query.stream()):
+            yield Transacao.de_documento(doc)
+
+    def _consultar_pagina(self, user_id, tipo, limite, apos, antes):
+        self._sincronizar(user_id)
+        query = self._consulta_transacoes(user_id)
+        # (data, __name__) decrescente: o mesmo índice de (tipo, data DESC), que já termina no ID
+        query = (query.where(filter=FieldFilter('tipo', '==', tipo)).order_by('data', direction=firestore.Query.DESCENDING)
+                 .order_by('__name__', direction=firestore.Query.DESCENDING))
+        cursor = lambda data, id_: {'data': data_no_banco(data), '__name__': self._colecao_transacoes(user_id).document(id_)}
+        if antes is not None:
+            docs = list(self._contando(query.end_before(cursor(*antes)).limit_to_last(limite + 1).get()))
+            pagina = [Transacao.de_documento(d) for d in docs]
+            return pagina[-limite:], len(pagina) > limite, True
+        if apos is not None: query = query.start_after(cursor(*apos))
+        pagina = [Transacao.de_documento(d) for d in self._contando(query.limit(limite + 1).stream())]
+        return pagina[:limite], apos is not None, len(pagina) > limite
+
+    def _agrupar_gastos(self, campo, user_id, inicio, fim):
+        self._sincronizar(user_id)
+        query = self._consulta_transacoes(user_id)
+        query = query.where(filter=FieldFilter('tipo', '==', 'gasto'))
+        if inicio: query = query.where(filter=FieldFilter('data', '>=', data_no_banco(inicio)))
+        if fim: query = query.where(filter=FieldFilter('data', '<=', data_no_banco(fim)))
+        # Máscara de campos: cada documento chega só com a chave do grupo e o valor; sem order_by
         agrupado = {}
-        for t in transacoes:
-            cartao = t[5]
-            val = t[2]
-            if cartao: 
-                if cartao not in agrupado: agrupado[cartao] = 0.0
-                agrupado[cartao] += float(val)
-        return [(k, v) for k, v in agrupado.items()]
+        for doc in self._contando(query.select([campo, 'valor_num']).stream()):
+            d = doc.to_dict(); chave = d.get(campo)
+            if campo == 'cartao' and not chave: continue
+            agrupado[chave] = agrupado.get(chave, 0.0) + float(d.get('valor_num') or 0.0)
+        return list(agrupado.items())
 
-    def series_mensais(self, user_id=None, meses=6):
-        hoje = datetime.now(); labels = []; entradas_vals = []; gastos_vals = []
-        for i in reversed(range(meses)):
-            mes_alvo = hoje.month - i; ano_alvo = hoje.year
-            if mes_alvo <= 0: mes_alvo += 12; ano_alvo -= 1
-            primeiro_dia = datetime(ano_alvo, mes_alvo, 1, 0, 0, 0)
-            prox_mes = mes_alvo + 1; prox_ano = ano_alvo
-            if prox_mes > 12: prox_mes = 1; prox_ano += 1
-            ultimo_dia = datetime(prox_ano, prox_mes, 1, 23, 59, 59) - timedelta(days=1)
-
-            labels.append(primeiro_dia.strftime("%b/%Y"))
-            soma_entrada = self.get_soma(user_id, "entrada", inicio=primeiro_dia, fim=ultimo_dia)
-            soma_gasto = self.get_soma(user_id, "gasto", inicio=primeiro_dia, fim=ultimo_dia)
-            entradas_vals.append(float(soma_entrada))
-            gastos_vals.append(float(soma_gasto))
-        return labels, entradas_vals, gastos_vals
+    def _somas_por_mes(self, user_id, inicio, fim):
+        """Usuário: os buckets mensais já estão no agregado (1 leitura). Geral: 1 query no intervalo, em uma passada."""
+        if user_id is not None: return self.get_agregado(user_id).get('meses', {})
+        query = (self._consulta_transacoes().where(filter=FieldFilter('data', '>=', data_no_banco(inicio)))
+                 .where(filter=FieldFilter('data', '<', data_no_banco(fim))))
+        buckets = {}
+        for doc in self._contando(query.select(['tipo', 'valor_num', 'data']).stream()):
+            d = doc.to_dict(); tipo = d.get('tipo')
+            if tipo not in ("entrada", "gasto") or not d.get('data'): continue
+            mes = buckets.setdefault(self._chave_mes(d['data']), {})
+            mes[tipo] = mes.get(tipo, 0.0) + float(d.get('valor_num') or 0.0)
+        return buckets
 
-    def limpar_transacoes(self, user_id=None, opcao=None):
-        query = self.collection_transacoes.where(filter=FieldFilter('user_id', '==', user_id))
-        now = datetime.now()
+    def limpar_transacoes(self, user_id, opcao=None):
+        """Apaga as transações do período e devolve {'removidos', 'entrada', 'gasto', 'falhas'} com o que saiu."""
+        self._exigir_usuario(user_id)
+        self._sincronizar(user_id)
+        query = self._consulta_transacoes(user_id)
+        now = agora_local()
+        agg_ref = self.collection_agregados.document(str(user_id))
+        campos = ['tipo', 'valor_num', 'categoria', 'cartao', 'data'] # só o necessário para o decremento do agregado
         
         if opcao == "ultimo":
-            todos = self.get_todas(user_id) 
-            if todos:
-                id_recente = todos[0][0] 
-                self.collection_transacoes.document(id_recente).delete()
-            return
+            # Índice (user_id, data DESC) em firestore.indexes.json (layout 'usuario': o automático de data)
+            docs = list(self._contando(query.order_by('data', direction=firestore.Query.DESCENDING).limit(1).select(campos).stream()))
+            if not docs: return self._resumo_remocao([])
+            dados = docs[0].to_dict()
+            batch = self.db.batch()
+            batch.delete(docs[0].reference)
+            batch.set(agg_ref, self._delta_agregado([dados], sinal=-1), merge=True)
+            batch.commit(); self._contar(escritas=2)
+            self.cache.remover(user_id, [docs[0].id], [dados]); self.cache.avancar_revisao(user_id)
+            return self._resumo_remocao([dados])
 
         elif opcao == "dia":
             inicio = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            query = query.where(filter=FieldFilter('data', '>=', inicio))
+            query = query.where(filter=FieldFilter('data', '>=', data_no_banco(inicio)))
         elif opcao == "semana":
             semana_inicio = (now - timedelta(days=now.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
-            query = query.where(filter=FieldFilter('data', '>=', semana_inicio))
+            query = query.where(filter=FieldFilter('data', '>=', data_no_banco(semana_inicio)))
         elif opcao == "mes":
             primeiro_dia = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            query = query.where(filter=FieldFilter('data', '>=', primeiro_dia))
+            query = query.where(filter=FieldFilter('data', '>=', data_no_banco(primeiro_dia)))
 
-        batch = self.db.batch()
-        docs = query.stream()
-        count = 0
+        # Projeção mínima + BulkWriter (commits em paralelo, com retry) no lugar de batches sequenciais de 400.
+        # O BulkWriter não é atômico: resumo e agregado contam só as exclusões confirmadas em on_write_result.
+        lidos = {}; confirmados = []; falhas = []; lock = threading.Lock()
+
+        def ao_gravar(referencia, _resultado, _bulk):
+            with lock: confirmados.append(referencia.id)
+
+        def ao_falhar(erro, _bulk):
+            if erro.attempts < self.TENTATIVAS_EXCLUSAO: return True # o BulkWriter refaz com backoff
+            with lock: falhas.append(erro.operation.reference.id)
+            print(f"!!! Exclusão não gravada ({erro.code}: {erro.message}): {erro.operation.reference.path} !!!")
+            return False
+
+        bulk = self.db.bulk_writer(); bulk.on_write_result(ao_gravar); bulk.on_write_error(ao_falhar)
+        for doc in self._contando(query.select(campos).stream()):
+            bulk.delete(doc.reference); lidos[doc.id] = doc.to_dict()
+        bulk.close()
+        ids_removidos = [doc_id for doc_id in confirmados if doc_id in lidos]; removidos = [lidos[doc_id] for doc_id in ids_removidos]
+        self._contar(escritas=len(ids_removidos))
+
+        if opcao not in ("dia", "semana", "mes") and not falhas:
+            # "Tudo": zera o agregado em vez de acumular decrementos
+            zerado = self._calcular_agregado([], user_id)
+            # merge só nos campos do agregado: substitui os mapas e mantém a contagem de 'revisao'
+            agg_ref.set({**zerado, 'revisao': firestore.Increment(1)}, merge=list(zerado) + ['revisao']); self._contar(escritas=1)
+            self.cache.guardar_linhas(user_id, []); self.cache.guardar_agregado(user_id, zerado); self.cache.avancar_revisao(user_id)
+        elif removidos:
+            # Depois que as exclusões foram gravadas; com falhas, só o que de fato saiu
+            agg_ref.set(self._delta_agregado(removidos, sinal=-1), merge=True); self._contar(escritas=1)
+            self.cache.remover(user_id, ids_removidos, removidos); self.cache.avancar_revisao(user_id)
+        return self._resumo_remocao(removidos, falhas=len(falhas))
+
+    TENTATIVAS_EXCLUSAO = 5 # por documento no BulkWriter, antes de contar como falha
+
+    # --- JOBS DE BROADCAST ---
+    # Documento broadcast_jobs/{job_id}, no formato descrito em Database (ver _novo_job).
+    def listar_usuarios_lote(self, apos=None, limite=100, apenas_ativos=True):
+        """Página de usuários ordenada pelo ID do documento. Retorna (ids, id do último documento ou None no fim)."""
+        query = self.collection_usuarios.order_by('__name__')
+        if apos is not None: query = query.start_after({'__name__': self.collection_usuarios.document(str(apos))})
+        docs = list(self._contando(query.limit(limite).stream()))
+        if not docs: return [], None
+        ids = []
         for doc in docs:
-            batch.delete(doc.reference)
-            count += 1
-            if count >= 400: 
-                batch.commit()
-                batch = self.db.batch()
-                count = 0
-        if count > 0:
-            batch.commit()
+            if apenas_ativos and doc.to_dict().get('bloqueado'): continue
+            try: ids.append(int(doc.id))
+            except ValueError: pass
+        return ids, docs[-1].id
+
+    def contar_usuarios(self, apenas_ativos=False):
+        # Agregações count(): 'bloqueado' falta nos perfis antigos, então ativos = todos - bloqueados
+        total = int(self.collection_usuarios.count().get()[0][0].value); self._contar(leituras=1)
+        if not apenas_ativos: return total
+        consulta = self.collection_usuarios.where(filter=FieldFilter('bloqueado', '==', True))
+        bloqueados = int(consulta.count().get()[0][0].value); self._contar(leituras=1)
+        return total - bloqueados
+
+    def criar_job_broadcast(self, job_id, mensagem):
+        """Cria o job se ainda não existir; devolve o estado atual (novo ou já existente)."""
+        ref = self.collection_jobs.document(job_id)
+
+        @firestore.transactional
+        def _criar(transaction):
+            doc = ref.get(transaction=transaction)
+            if doc.exists: return doc.to_dict()
+            job = self._novo_job(mensagem)
+            transaction.set(ref, job)
+            return job
+
+        self._contar(leituras=1, escritas=1)
+        return _criar(self.db.transaction())
+
+    def get_job_broadcast(self, job_id):
+        doc = self.collection_jobs.document(job_id).get(); self._contar(leituras=1)
+        return doc.to_dict() if doc.exists else None
+
+    def atualizar_job_broadcast(self, job_id, campos, incrementos=None):
+        ref = self.collection_jobs.document(job_id) # conecta antes de usar firestore.Increment
+        dados = dict(campos); dados['atualizado_em'] = datetime.now()
+        for k, v in (incrementos or {}).items():
+            if v: dados[k] = firestore.Increment(v)
+        ref.update(dados); self._contar(escritas=1)
+
+    def reivindicar_job_broadcast(self, job_id, dono, duracao):
+        ref = self.collection_jobs.document(job_id)
+
+        @firestore.transactional
+        def _reivindicar(transaction):
+            doc = ref.get(transaction=transaction)
+            if not doc.exists: return None
+            job = doc.to_dict(); agora = time.time()
+            if not self._pode_assumir(job, dono, agora): return None
+            lease = {'dono': dono, 'lease_ate': agora + duracao, 'status': 'executando'}
+            transaction.update(ref, lease); job.update(lease)
+            return job
+
+        self._contar(leituras=1, escritas=1)
+        return _reivindicar(self.db.transaction())
+
+    def listar_jobs_pendentes(self):
+        docs = self._contando(self.collection_jobs.where(filter=FieldFilter('status', 'in', ['pendente', 'executando'])).stream())
+        return [doc.id for doc in docs]
+
+    # Subcoleção broadcast_jobs/{job_id}/envios/{user_id}: um documento por envio (sem disputa no documento do job)
+    def _envios(self, job_id): return self.collection_jobs.document(job_id).collection('envios')
+
+    def marcar_envio_broadcast(self, job_id, user_id, estado):
+        self._envios(job_id).document(str(user_id)).set({'estado': estado}); self._contar(escritas=1)
+
+    def envios_broadcast(self, job_id, user_ids):
+        refs = [self._envios(job_id).document(str(u)) for u in user_ids]
+        if not refs: return {}
+        return {int(doc.id): doc.to_dict().get('estado') for doc in self._contando(self.db.get_all(refs)) if doc.exists}
+
+    def limpar_envios_broadcast(self, job_id, user_ids):
+        if not user_ids: return
+        batch = self.db.batch()
+        for u in user_ids: batch.delete(self._envios(job_id).document(str(u)))
+        batch.commit(); self._contar(escritas=len(user_ids))
 
     # --- CONFIG ---
     def get_config(self, key):
-        doc = self.collection_config.document(key).get()
+        doc = self.collection_config.document(key).get(); self._contar(leituras=1)
         if doc.exists:
             return doc.to_dict().get('value')
         return None
 
     def set_config(self, key, value):
-        self.collection_config.document(key).set({'value': value})
+        self.collection_config.document(key).set({'value': value}); self._contar(escritas=1)
+
+    # --- ESTADO DA CONVERSA ---
+    def get_estado_usuario(self, user_id):
+        doc = self.collection_estados.document(str(user_id)).get(); self._contar(leituras=1)
+        return doc.to_dict().get('dados') if doc.exists else None
+
+    def salvar_estados_usuarios(self, estados):
+        itens = list(estados.items())
+        for i in range(0, len(itens), 500): # limite de operações por batch
+            batch = self.db.batch()
+            for user_id, dados in itens[i:i + 500]:
+                ref = self.collection_estados.document(str(user_id))
+                if dados is None: batch.delete(ref)
+                else: batch.set(ref, {'dados': dados, 'atualizado_em': datetime.now()})
+            batch.commit()
+        self._contar(escritas=len(itens))
+
+# --- CAMADA ASSÍNCRONA ---
+class AsyncDatabase:
+    """Expõe os métodos do Database como corrotinas, executadas num pool de threads limitado.
+
+    Os backends (Firestore, SQLite) são síncronos; rodar as chamadas fora do loop evita
+    que um round-trip lento trave o bot para todos os usuários.
+    """
+    def __init__(self, database, max_workers=None):
+        self._db = database
+        max_workers = max_workers or int(os.environ.get('DB_MAX_WORKERS', '8'))
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+
+    async def executar(self, func, *args, **kwargs):
+        """Roda qualquer função síncrona que fala com o banco (ex.: a leitura de um import) no pool do banco."""
+        loop = asyncio.get_running_loop()
+        # O contexto vai junto para a thread: as leituras/escritas caem nos escopos de métricas abertos
+        contexto = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, functools.partial(contexto.run, func, *args, **kwargs))
+
+    def __getattr__(self, nome):
+        metodo = getattr(self._db, nome)
+        if not callable(metodo): return metodo
+
+        async def _chamada(*args, **kwargs):
+            with metricas.cronometrar("db_operacao_segundos", contar_banco=True, metodo=nome):
+                return await self.executar(metodo, *args, **kwargs)
+        return _chamada
+
+# --- SNAPSHOT POR ATUALIZAÇÃO ---
+class SnapshotUsuario:
+    """Unidade de trabalho de uma atualização do Telegram para um usuário.
+
+    Carrega as transações do usuário no máximo uma vez e responde somas, listas e
+    categorias da memória. Enquanto só os totais forem pedidos, usa o agregado
+    (uma leitura). Escritas feitas no handler são aplicadas localmente via registrar().
+    """
+    def __init__(self, adb, user_id):
+        self._adb = adb; self.user_id = user_id
+        self._linhas = None; self._totais = None
+        self._lock = asyncio.Lock()
+
+    async def linhas(self):
+        async with self._lock:
+            if self._linhas is None: self._linhas = await self._adb.get_todas(self.user_id)
+        return self._linhas
+
+    async def totais(self):
+        """Retorna (entradas, gastos) de todo o histórico."""
+        async with self._lock:
+            if self._totais is None:
+                if self._linhas is not None:
+                    self._totais = {tipo: sum(float(t.valor) for t in self._linhas if t.tipo == tipo) for tipo in ("entrada", "gasto")}
+                else:
+                    total = (await self._adb.get_agregado(self.user_id)).get('total', {})
+                    self._totais = {tipo: float(total.get(tipo, 0.0)) for tipo in ("entrada", "gasto")}
+        return Decimal(f"{self._totais['entrada']:.2f}"), Decimal(f"{self._totais['gasto']:.2f}")
+
+    async def todas(self, tipo=None, inicio=None, fim=None):
+        return [t for t in await self.linhas()
+                if (tipo is None or t.tipo == tipo)
+                and (inicio is None or (t.data is not None and t.data >= inicio))
+                and (fim is None or (t.data is not None and t.data <= fim))]
+
+    async def soma(self, tipo, inicio=None, fim=None):
+        if inicio is None and fim is None:
+            entradas, gastos = await self.totais()
+            return entradas if tipo == "entrada" else gastos
+        total = sum((t.valor for t in await self.todas(tipo, inicio, fim)), Decimal("0.00"))
+        return total.quantize(Decimal("0.01"))
+
+    async def categorias(self):
+        return sorted({t.categoria for t in await self.linhas() if t.categoria and t.valor > 0})
+
+    def registrar(self, linha):
+        """Aplica localmente uma transação recém-gravada (Transacao devolvida por add_transacao)."""
+        if self._linhas is not None: self._linhas.insert(0, linha)
+        if self._totais is not None and linha.tipo in self._totais: self._totais[linha.tipo] += float(linha.valor)
+
+    def invalidar(self):
+        """Descarta o que foi lido (ex.: depois de apagar transações)."""
+        self._linhas = None; self._totais = None
+
+def criar_database(backend=None):
+    """Instancia o backend configurado: DB_BACKEND=firestore (padrão) ou sqlite (arquivo em SQLITE_PATH)."""
+    backend = (backend or os.environ.get('DB_BACKEND', 'firestore')).strip().lower()
+    if backend == 'firestore': return FirestoreDatabase()
+    if backend == 'sqlite':
+        from db_sqlite import SQLiteDatabase
+        return SQLiteDatabase(os.environ.get('SQLITE_PATH', 'financeiro.db'))
+    raise ValueError(f"Erro: DB_BACKEND desconhecido: {backend!r} (use 'firestore' ou 'sqlite').")
 
 # Instância Global
-db = Database()
\ No newline at end of file
+db = criar_database()
+adb = AsyncDatabase(db)
+
+@metricas.coletor
+def _metricas_banco(m):
+    for chave, valor in db.cache.estatisticas().items(): m.definir(f"cache_transacoes_{chave}", valor)
+    for chave, valor in db.contadores().items(): m.definir(f"db_{chave}_acumuladas", valor, ajuda=f"Documentos/linhas ({chave}) desde o início do processo")
\ No newline at end of file
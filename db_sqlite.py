@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+"""Backend SQLite do Database (DB_BACKEND=sqlite, arquivo em SQLITE_PATH).
+
+Um arquivo local em modo WAL: leituras não esperam escritas, sem rede e sem custo,
+bom para instalações de um único nó, testes e benchmarks. Somas e agrupamentos
+(get_soma, gastos por categoria/cartão, series_mensais, agregado) são feitos pelo próprio
+SQLite com SUM/GROUP BY sobre o índice (user_id, tipo, data).
+
+Aproveita o financeiro.db da versão antiga: as tabelas existentes ganham as
+colunas que faltam na abertura.
+"""
+import json
+import time
+import sqlite3
+import threading
+import contextlib
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from db import Database, Transacao, agora_local, data_local
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS usuarios (
+    user_id INTEGER PRIMARY KEY,
+    nome TEXT
+);
+CREATE TABLE IF NOT EXISTS transacoes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    tipo TEXT,
+    valor_num REAL,
+    valor_txt TEXT,
+    categoria TEXT,
+    metodo TEXT,
+    cartao TEXT,
+    data TEXT,
+    descricao TEXT,
+    hash_importacao TEXT,
+    FOREIGN KEY (user_id) REFERENCES usuarios (user_id)
+);
+CREATE TABLE IF NOT EXISTS app_config (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS broadcast_jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT,
+    dados TEXT
+);
+CREATE TABLE IF NOT EXISTS broadcast_envios (
+    job_id TEXT,
+    user_id INTEGER,
+    estado TEXT,
+    PRIMARY KEY (job_id, user_id)
+);
+CREATE TABLE IF NOT EXISTS estado_usuarios (
+    user_id INTEGER PRIMARY KEY,
+    dados TEXT,
+    atualizado_em TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_transacoes_usuario_tipo_data ON transacoes (user_id, tipo, data);
+CREATE INDEX IF NOT EXISTS idx_transacoes_usuario_data ON transacoes (user_id, data);
+CREATE INDEX IF NOT EXISTS idx_transacoes_tipo_data ON transacoes (tipo, data);
+CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON broadcast_jobs (status);
+"""
+# Colunas que o financeiro.db antigo não tem (tabela -> [(coluna, tipo)])
+COLUNAS_NOVAS = {
+    'transacoes': [('descricao', 'TEXT'), ('hash_importacao', 'TEXT')],
+    'usuarios': [('bloqueado', 'INTEGER DEFAULT 0'), ('bloqueado_em', 'TEXT'), ('migrado_para', 'INTEGER'), ('migrado_de', 'INTEGER')],
+}
+CAMPOS_LINHA = "id, tipo, valor_num, categoria, metodo, cartao, data, descricao"
+
+def _texto_data(dt):
+    """Datas gravadas como texto ISO de largura fixa (horário local, sem fuso): a ordem do texto é a ordem cronológica."""
+    return data_local(dt).isoformat(sep=' ', timespec='microseconds') if dt is not None else None
+
+def _data_texto(texto):
+    return datetime.fromisoformat(texto) if texto else None
+
+def _json_padrao(valor):
+    if isinstance(valor, datetime): return valor.isoformat()
+    if isinstance(valor, Decimal): return float(valor)
+    raise TypeError(f"Tipo não serializável: {type(valor).__name__}")
+
+class SQLiteDatabase(Database):
+    def __init__(self, caminho="financeiro.db"):
+        super().__init__()
+        self.caminho = caminho
+        self._local = threading.local() # uma conexão por thread (pool do AsyncDatabase)
+        con = self._conexao()
+        con.execute("PRAGMA journal_mode=WAL")
+        con.executescript(ESQUEMA)
+        self._migrar(con)
+
+    def _conexao(self):
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            # isolation_level=None: as transações são abertas explicitamente em _transacao()
+            con = self._local.con = sqlite3.connect(self.caminho, timeout=30, isolation_level=None)
+            con.execute("PRAGMA synchronous=NORMAL")
+        return con
+
+    @contextlib.contextmanager
+    def _transacao(self):
+        """BEGIN IMMEDIATE ... COMMIT: pega a trava de escrita logo no início (sem deadlock de upgrade)."""
+        con = self._conexao(); antes = con.total_changes
+        con.execute("BEGIN IMMEDIATE")
+        try: yield con
+        except BaseException:
+            con.execute("ROLLBACK"); raise
+        con.execute("COMMIT")
+        self._contar(escritas=con.total_changes - antes)
+
+    def _ler(self, sql, params=(), con=None):
+        """Executa um SELECT e devolve todas as linhas (contadas como leituras)."""
+        registros = (con or self._conexao()).execute(sql, params).fetchall()
+        self._contar(leituras=len(registros))
+        return registros
+
+    def _migrar(self, con):
+        for tabela, colunas in COLUNAS_NOVAS.items():
+            existentes = {linha[1] for linha in con.execute(f"PRAGMA table_info({tabela})")}
+            for coluna, tipo in colunas:
+                if coluna not in existentes: con.execute(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {tipo}")
+        # Índices sobre colunas novas: só depois que a coluna existe nos bancos antigos
+        con.execute("CREATE INDEX IF NOT EXISTS idx_transacoes_usuario_hash ON transacoes (user_id, hash_importacao) "
+                    "WHERE hash_importacao IS NOT NULL")
+
+    @staticmethod
+    def _filtros(user_id=None, tipo=None, inicio=None, fim=None):
+        """Monta o WHERE (na ordem do índice) e os parâmetros."""
+        condicoes = []; params = []
+        if user_id is not None: condicoes.append("user_id = ?"); params.append(user_id)
+        if tipo is not None: condicoes.append("tipo = ?"); params.append(tipo)
+        if inicio is not None: condicoes.append("data >= ?"); params.append(_texto_data(inicio))
+        if fim is not None: condicoes.append("data <= ?"); params.append(_texto_data(fim))
+        return (" WHERE " + " AND ".join(condicoes) if condicoes else ""), params
+
+    @staticmethod
+    def _linha(registro):
+        id_, tipo, valor, categoria, metodo, cartao, data, descricao = registro
+        return Transacao(str(id_), tipo, Decimal(f"{float(valor or 0.0):.2f}"), categoria, metodo, cartao, _data_texto(data), descricao)
+
+    # --- USUÁRIOS ---
+    def listar_usuarios(self, apenas_ativos=False):
+        sql = "SELECT user_id FROM usuarios" + (" WHERE COALESCE(bloqueado, 0) = 0" if apenas_ativos else "")
+        return [uid for (uid,) in self._ler(sql)]
+
+    def marcar_usuario_bloqueado(self, user_id):
+        """Usuário bloqueou o bot (Forbidden): sai dos próximos broadcasts até voltar a usar."""
+        self._perfis.pop(user_id, None) # a próxima transação regrava o perfil (bloqueado=0)
+        with self._transacao() as con:
+            con.execute("INSERT INTO usuarios (user_id, bloqueado, bloqueado_em) VALUES (?, 1, ?) "
+                        "ON CONFLICT(user_id) DO UPDATE SET bloqueado = 1, bloqueado_em = excluded.bloqueado_em",
+                        (user_id, _texto_data(datetime.now())))
+
+    def registrar_migracao(self, user_id, novo_id):
+        """Chat migrou (ChatMigrated): o ID antigo deixa de receber e o novo passa a existir."""
+        with self._transacao() as con:
+            con.execute("INSERT INTO usuarios (user_id, bloqueado, migrado_para) VALUES (?, 1, ?) "
+                        "ON CONFLICT(user_id) DO UPDATE SET bloqueado = 1, migrado_para = excluded.migrado_para", (user_id, novo_id))
+            con.execute("INSERT INTO usuarios (user_id, migrado_de) VALUES (?, ?) "
+                        "ON CONFLICT(user_id) DO UPDATE SET migrado_de = excluded.migrado_de", (novo_id, user_id))
+
+    def listar_usuarios_com_nome(self):
+        return [(uid, nome or f"Usuário {uid}") for uid, nome in self._ler("SELECT user_id, nome FROM usuarios")]
+
+    # --- TRANSAÇÕES ---
+    def add_transacoes(self, user_id, itens, nome=""):
+        novos = self._dados_itens(user_id, itens); ids = []
+        # Perfil e transações no mesmo commit; o perfil só é regravado quando o nome muda
+        with self._transacao() as con:
+            if self._perfis.get(user_id) != nome:
+                con.execute("INSERT INTO usuarios (user_id, nome, bloqueado) VALUES (?, ?, 0) "
+                            "ON CONFLICT(user_id) DO UPDATE SET nome = excluded.nome, bloqueado = 0", (user_id, nome))
+            for d in novos:
+                cur = con.execute("INSERT INTO transacoes (user_id, tipo, valor_num, valor_txt, categoria, metodo, cartao, data, descricao, hash_importacao) "
+                                  "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                  (user_id, d['tipo'], d['valor_num'], d['valor_txt'], d['categoria'], d['metodo'], d['cartao'], _texto_data(d['data']),
+                                   d['descricao'], d.get('hash_importacao')))
+                ids.append(str(cur.lastrowid))
+        self._perfis[user_id] = nome
+        linhas = []
+        for id_, d in zip(ids, novos):
+            linha = Transacao(id_, d['tipo'], Decimal(f"{d['valor_num']:.2f}"), d['categoria'], d['metodo'], d['cartao'], d['data'], d['descricao'])
+            self.cache.adicionar(user_id, linha, d); linhas.append(linha)
+        return linhas
+
+    def limpar_transacoes(self, user_id, opcao=None):
+        self._exigir_usuario(user_id) # _filtros(None) não gera WHERE: o DELETE apagaria tudo
+        now = agora_local()
+        if opcao == "ultimo":
+            where = " WHERE id = (SELECT id FROM transacoes WHERE user_id = ? ORDER BY data DESC, id DESC LIMIT 1)"; params = [user_id]
+        else:
+            inicio = None
+            if opcao == "dia": inicio = now.replace(hour=0, minute=0, second=0, microsecond=0)
+            elif opcao == "semana": inicio = (now - timedelta(days=now.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+            elif opcao == "mes": inicio = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+            where, params = self._filtros(user_id, inicio=inicio)
+
+        # Lê só o necessário para o resumo/cache e apaga com o mesmo WHERE, na mesma transação
+        with self._transacao() as con:
+            registros = self._ler(f"SELECT id, tipo, valor_num, categoria, cartao, data FROM transacoes{where}", params, con)
+            if registros: con.execute(f"DELETE FROM transacoes{where}", params)
+        removidos = [{'tipo': tipo, 'valor_num': valor, 'categoria': categoria, 'cartao': cartao, 'data': _data_texto(data)}
+                     for _, tipo, valor, categoria, cartao, data in registros]
+
+        if opcao not in ("ultimo", "dia", "semana", "mes"):
+            self.cache.guardar_linhas(user_id, []); self.cache.guardar_agregado(user_id, self._calcular_agregado([], user_id))
+        elif removidos:
+            self.cache.remover(user_id, [str(r[0]) for r in registros], removidos)
+        return self._resumo_remocao(removidos)
+
+    # --- AGREGADOS POR USUÁRIO ---
+    def reconstruir_agregado(self, user_id):
+        """No SQLite o agregado não é gravado: é um GROUP BY (tipo, mês, categoria, cartão), guardado no cache."""
+        agregado = self._calcular_agregado([], user_id)
+        total = agregado['total']; meses = agregado['meses']; categorias = agregado['categorias']; cartoes = agregado['cartoes']
+        sql = ("SELECT tipo, substr(data, 1, 7), categoria, cartao, SUM(valor_num) FROM transacoes "
+               "WHERE user_id = ? AND tipo IN ('entrada', 'gasto') GROUP BY tipo, substr(data, 1, 7), categoria, cartao")
+        for tipo, mes, categoria, cartao, soma in self._ler(sql, (user_id,)):
+            soma = float(soma or 0.0)
+            total[tipo] += soma
+            if mes:
+                bucket = meses.setdefault(mes, {})
+                bucket[tipo] = bucket.get(tipo, 0.0) + soma
+            cats = categorias[tipo]; cat = categoria or "Outros"
+            cats[cat] = cats.get(cat, 0.0) + soma
+            if tipo == "gasto" and cartao: cartoes[cartao] = cartoes.get(cartao, 0.0) + soma
+        self.cache.guardar_agregado(user_id, agregado)
+        return agregado
+
+    def get_agregado(self, user_id):
+        agregado = self.cache.obter_agregado(user_id)
+        return agregado if agregado is not None else self.reconstruir_agregado(user_id)
+
+    # --- LEITURA DE DADOS ---
+    def get_soma(self, user_id, tipo, inicio=None, fim=None):
+        where, params = self._filtros(user_id, tipo, inicio, fim)
+        total = self._ler(f"SELECT COALESCE(SUM(valor_num), 0) FROM transacoes{where}", params)[0][0]
+        return Decimal(f"{float(total):.2f}")
+
+    def iter_todas(self, user_id=None, tipo=None, inicio=None, fim=None):
+        where, params = self._filtros(user_id or None, tipo, inicio, fim)
+        for registro in self._contando(self._conexao().execute(f"SELECT {CAMPOS_LINHA} FROM transacoes{where} ORDER BY data DESC, id DESC", params)):
+            yield self._linha(registro)
+
+    @staticmethod
+    def _chave_id(id_): return int(id_) # rowid: mesma ordem do "ORDER BY data, id"
+
+    def _consultar_pagina(self, user_id, tipo, limite, apos, antes):
+        # Cursor (data, id) com comparação de row values: datas iguais não somem na virada da página
+        if antes is not None:
+            # As limite + 1 linhas logo acima do cursor, devolvidas da mais recente para a mais antiga
+            registros = self._ler(f"SELECT {CAMPOS_LINHA} FROM transacoes WHERE user_id = ? AND tipo = ? AND (data, id) > (?, ?) "
+                                  "ORDER BY data ASC, id ASC LIMIT ?", (user_id, tipo, _texto_data(antes[0]), int(antes[1]), limite + 1))
+            pagina = [self._linha(r) for r in reversed(registros)]
+            return pagina[-limite:], len(pagina) > limite, True
+        where, params = self._filtros(user_id, tipo)
+        if apos is not None: where += " AND (data, id) < (?, ?)"; params += [_texto_data(apos[0]), int(apos[1])]
+        registros = self._ler(f"SELECT {CAMPOS_LINHA} FROM transacoes{where} ORDER BY data DESC, id DESC LIMIT ?", params + [limite + 1])
+        pagina = [self._linha(r) for r in registros]
+        return pagina[:limite], apos is not None, len(pagina) > limite
+
+    def _agrupar_gastos(self, campo, user_id, inicio, fim):
+        where, params = self._filtros(user_id, 'gasto', inicio, fim)
+        if campo == 'cartao': where += " AND cartao IS NOT NULL AND cartao != ''"
+        sql = f"SELECT {campo}, SUM(valor_num) FROM transacoes{where} GROUP BY {campo}"
+        return [(chave, float(soma or 0.0)) for chave, soma in self._ler(sql, params)]
+
+    def _somas_por_mes(self, user_id, inicio, fim):
+        where, params = self._filtros(user_id, inicio=inicio)
+        where += " AND data < ? AND tipo IN ('entrada', 'gasto')"; params.append(_texto_data(fim))
+        buckets = {}
+        for mes, tipo, soma in self._ler(f"SELECT substr(data, 1, 7), tipo, SUM(valor_num) FROM transacoes{where} GROUP BY 1, 2", params):
+            buckets.setdefault(mes, {})[tipo] = float(soma or 0.0)
+        return buckets
+
+    # --- JOBS DE BROADCAST ---
+    # Tabela broadcast_jobs: o estado do job (formato de Database._novo_job) fica em JSON na coluna dados.
+    def listar_usuarios_lote(self, apos=None, limite=100, apenas_ativos=True):
+        sql = "SELECT user_id, COALESCE(bloqueado, 0) FROM usuarios" + (" WHERE user_id > ?" if apos is not None else "") + " ORDER BY user_id LIMIT ?"
+        registros = self._ler(sql, ([int(apos)] if apos is not None else []) + [limite])
+        if not registros: return [], None
+        ids = [uid for uid, bloqueado in registros if not (apenas_ativos and bloqueado)]
+        return ids, str(registros[-1][0])
+
+    def contar_usuarios(self, apenas_ativos=False):
+        return self._ler("SELECT COUNT(*) FROM usuarios" + (" WHERE COALESCE(bloqueado, 0) = 0" if apenas_ativos else ""))[0][0]
+
+    def criar_job_broadcast(self, job_id, mensagem):
+        with self._transacao() as con:
+            registros = self._ler("SELECT dados FROM broadcast_jobs WHERE job_id = ?", (job_id,), con)
+            if registros: return json.loads(registros[0][0])
+            job = self._novo_job(mensagem)
+            con.execute("INSERT INTO broadcast_jobs (job_id, status, dados) VALUES (?, ?, ?)",
+                        (job_id, job['status'], json.dumps(job, default=_json_padrao)))
+        return job
+
+    def get_job_broadcast(self, job_id):
+        registros = self._ler("SELECT dados FROM broadcast_jobs WHERE job_id = ?", (job_id,))
+        return json.loads(registros[0][0]) if registros else None
+
+    def atualizar_job_broadcast(self, job_id, campos, incrementos=None):
+        with self._transacao() as con:
+            registros = self._ler("SELECT dados FROM broadcast_jobs WHERE job_id = ?", (job_id,), con)
+            if not registros: raise KeyError(f"Job de broadcast {job_id!r} não existe.")
+            job = json.loads(registros[0][0]); job.update(campos); job['atualizado_em'] = datetime.now()
+            for k, v in (incrementos or {}).items():
+                if v: job[k] = job.get(k, 0) + v
+            con.execute("UPDATE broadcast_jobs SET status = ?, dados = ? WHERE job_id = ?",
+                        (job.get('status'), json.dumps(job, default=_json_padrao), job_id))
+
+    def reivindicar_job_broadcast(self, job_id, dono, duracao):
+        with self._transacao() as con: # BEGIN IMMEDIATE: ler e gravar o lease sem outro processo no meio
+            registros = self._ler("SELECT dados FROM broadcast_jobs WHERE job_id = ?", (job_id,), con)
+            if not registros: return None
+            job = json.loads(registros[0][0]); agora = time.time()
+            if not self._pode_assumir(job, dono, agora): return None
+            job.update({'dono': dono, 'lease_ate': agora + duracao, 'status': 'executando'})
+            con.execute("UPDATE broadcast_jobs SET status = ?, dados = ? WHERE job_id = ?",
+                        (job['status'], json.dumps(job, default=_json_padrao), job_id))
+        return job
+
+    def listar_jobs_pendentes(self):
+        return [job_id for (job_id,) in self._ler("SELECT job_id FROM broadcast_jobs WHERE status IN ('pendente', 'executando')")]
+
+    def marcar_envio_broadcast(self, job_id, user_id, estado):
+        with self._transacao() as con:
+            con.execute("INSERT INTO broadcast_envios (job_id, user_id, estado) VALUES (?, ?, ?) "
+                        "ON CONFLICT(job_id, user_id) DO UPDATE SET estado = excluded.estado", (job_id, user_id, estado))
+
+    def envios_broadcast(self, job_id, user_ids):
+        ids = set(user_ids)
+        return {uid: estado for uid, estado in self._ler("SELECT user_id, estado FROM broadcast_envios WHERE job_id = ?", (job_id,)) if uid in ids}
+
+    def limpar_envios_broadcast(self, job_id, user_ids):
+        with self._transacao() as con:
+            con.executemany("DELETE FROM broadcast_envios WHERE job_id = ? AND user_id = ?", [(job_id, u) for u in user_ids])
+
+    # --- CONFIG ---
+    def get_config(self, key):
+        registros = self._ler("SELECT value FROM app_config WHERE key = ?", (key,))
+        return json.loads(registros[0][0]) if registros else None
+
+    def set_config(self, key, value):
+        with self._transacao() as con:
+            con.execute("INSERT INTO app_config (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                        (key, json.dumps(value, default=_json_padrao)))
+
+    def importados(self, user_id):
+        sql = "SELECT hash_importacao, data FROM transacoes WHERE user_id = ? AND hash_importacao IS NOT NULL"
+        return {h: _data_texto(data) for h, data in self._ler(sql, (user_id,))}
+
+    # --- ESTADO DA CONVERSA ---
+    def get_estado_usuario(self, user_id):
+        registros = self._ler("SELECT dados FROM estado_usuarios WHERE user_id = ?", (user_id,))
+        return json.loads(registros[0][0]) if registros else None
+
+    def salvar_estados_usuarios(self, estados):
+        agora = _texto_data(datetime.now())
+        with self._transacao() as con:
+            con.executemany("DELETE FROM estado_usuarios WHERE user_id = ?", [(u,) for u, d in estados.items() if d is None])
+            con.executemany("INSERT INTO estado_usuarios (user_id, dados, atualizado_em) VALUES (?, ?, ?) "
+                            "ON CONFLICT(user_id) DO UPDATE SET dados = excluded.dados, atualizado_em = excluded.atualizado_em",
+                            [(u, json.dumps(d, default=_json_padrao), agora) for u, d in estados.items() if d is not None])
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Despacho das atualizações do Telegram: chats diferentes em paralelo, o mesmo chat em ordem.
+
+O responder guarda estado em context.user_data (aguardando_filtro, admin_selecionado): duas
+mensagens do mesmo chat processadas ao mesmo tempo corromperiam esse estado. Cada chat tem
+sua fila (um asyncio.Lock, que atende por ordem de chegada) e só a atualização da vez ocupa
+uma das vagas globais. Assim o PDF de um usuário não atrasa o "50 lanche" dos outros.
+"""
+import time
+import asyncio
+import inspect
+from telegram.ext import BaseUpdateProcessor
+
+from metricas import metricas
+
+class ProcessadorPorChat(BaseUpdateProcessor):
+    """UpdateProcessor do Application: até max_concurrent_updates chats ao mesmo tempo, um por
+    vez dentro de cada chat, e no máximo max_por_chat atualizações esperando por chat."""
+    def __init__(self, max_concurrent_updates, max_por_chat=20):
+        super().__init__(max_concurrent_updates)
+        self.max_por_chat = max_por_chat
+        self._vagas = asyncio.Semaphore(max_concurrent_updates)
+        self._filas = {} # chave do chat -> [asyncio.Lock, atualizações esperando ou rodando]
+        self._rodando = 0
+        metricas.coletor(self._exportar)
+
+    @staticmethod
+    def chave(update):
+        chat = getattr(update, 'effective_chat', None)
+        if chat is not None: return chat.id
+        user = getattr(update, 'effective_user', None)
+        return user.id if user is not None else None # sem chat/usuário (ex.: poll): não precisa de ordem
+
+    async def process_update(self, update, coroutine):
+        # Sobrescreve o da base: primeiro a vez no chat, depois a vaga global. Na ordem da base
+        # (vaga antes), um usuário com 10 mensagens na fila ocuparia 10 vagas só esperando.
+        chegada = time.perf_counter(); chave = self.chave(update); fila = None
+        try:
+            if chave is not None:
+                fila = self._filas.get(chave)
+                if fila is None: fila = self._filas[chave] = [asyncio.Lock(), 0]
+                if fila[1] >= self.max_por_chat:
+                    fila = None
+                    metricas.contar("bot_updates_descartados_total", ajuda="Atualizações descartadas com a fila do chat cheia")
+                    print(f"Fila do chat {chave} cheia ({self.max_por_chat}): atualização descartada.")
+                    return
+                fila[1] += 1
+                await fila[0].acquire()
+            try:
+                async with self._vagas:
+                    metricas.observar("bot_fila_espera_segundos", time.perf_counter() - chegada,
+                                      ajuda="Espera da atualização na fila do chat e por uma vaga global")
+                    self._rodando += 1
+                    try: await self.do_process_update(update, coroutine)
+                    finally: self._rodando -= 1
+            finally:
+                if fila is not None: fila[0].release()
+        finally:
+            if fila is not None:
+                fila[1] -= 1
+                if not fila[1]: self._filas.pop(chave, None)
+            # Descartada ou cancelada antes da vez: fecha a corrotina (sem aviso de "never awaited")
+            if inspect.getcoroutinestate(coroutine) == inspect.CORO_CREATED: coroutine.close()
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass # o Application.stop() já espera as tarefas em andamento
+
+    def _exportar(self, m):
+        profundidades = [f[1] for f in list(self._filas.values())]
+        m.definir("bot_fila_atualizacoes", sum(profundidades), ajuda="Atualizações esperando ou rodando, somando todos os chats")
+        m.definir("bot_fila_maior_chat", max(profundidades, default=0), ajuda="Atualizações na fila do chat mais carregado")
+        m.definir("bot_fila_chats", len(profundidades), ajuda="Chats com atualizações na fila")
+        m.definir("bot_updates_em_andamento", self._rodando, ajuda="Atualizações sendo processadas agora")
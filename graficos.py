@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""Renderização dos gráficos fora do loop do bot.
+
+Desenha com a API orientada a objetos do matplotlib (Figure), sem o estado global
+do pyplot, num pool de processos já aquecido. Devolve o PNG em bytes e guarda os
+últimos gráficos por (usuário, tipo, impressão digital dos dados).
+"""
+import io
+import os
+import asyncio
+import hashlib
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from metricas import metricas
+
+# ===================================================================
+# --- Desenho (roda dentro dos workers) ---
+# ===================================================================
+def _aquecer():
+    """Importa o matplotlib no worker para que o primeiro gráfico não pague o import."""
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib.figure import Figure  # noqa: F401
+    return os.getpid()
+
+def _figura_png(fig):
+    buf = io.BytesIO(); fig.savefig(buf, format="png", bbox_inches="tight")
+    return buf.getvalue()
+
+def desenhar_pizza(labels, valores):
+    from matplotlib.figure import Figure
+    fig = Figure(); ax = fig.subplots()
+    ax.pie(valores, labels=labels, autopct="%1.1f%%", startangle=90); ax.set_title("Gastos por Categoria (Pai)")
+    return _figura_png(fig)
+
+def desenhar_barras(labels, entradas_vals, gastos_vals):
+    from matplotlib.figure import Figure
+    x = list(range(len(labels))); width = 0.4
+    fig = Figure(); ax = fig.subplots()
+    ax.bar([i - width/2 for i in x], entradas_vals, width=width, label="Entradas", align="center")
+    ax.bar([i + width/2 for i in x], gastos_vals, width=width, label="Gastos", align="center")
+    ax.set_xticks(x); ax.set_xticklabels(labels, rotation=45); ax.set_ylabel("R$")
+    ax.set_title("Entradas x Gastos por Mês"); ax.legend(); fig.tight_layout()
+    return _figura_png(fig)
+
+DESENHOS = {"pizza": desenhar_pizza, "barras": desenhar_barras}
+
+# ===================================================================
+# --- Serviço ---
+# ===================================================================
+class ServicoGraficos:
+    """Pool de processos para desenhar os gráficos + cache LRU dos PNGs."""
+    def __init__(self, max_workers=None, max_cache=None):
+        self.max_workers = max_workers or int(os.environ.get('GRAFICOS_WORKERS', '2'))
+        self.max_cache = max_cache or int(os.environ.get('GRAFICOS_CACHE', '256'))
+        self._pool = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0; self.misses = 0
+
+    @staticmethod
+    def _contexto():
+        """fork só enquanto o processo não tem outras threads (a chamada cedo de iniciar). Depois
+        (pool recriado após um BrokenProcessPool, com o bot, o Waitress e o pool do banco rodando),
+        forkserver ou spawn: o fork de um processo com threads pode travar o filho num lock herdado."""
+        metodos = multiprocessing.get_all_start_methods()
+        if "fork" in metodos and threading.active_count() == 1: return multiprocessing.get_context("fork")
+        return multiprocessing.get_context("forkserver" if "forkserver" in metodos else "spawn")
+
+    def iniciar(self):
+        """Cria o pool e aquece os workers. Chamar cedo, antes de abrir conexões/threads (fork)."""
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=self._contexto())
+                for _ in range(self.max_workers): self._pool.submit(_aquecer)
+            return self._pool
+
+    @staticmethod
+    def impressao_digital(dados):
+        return hashlib.sha1(repr(dados).encode("utf-8")).hexdigest()
+
+    async def renderizar(self, user_id, tipo, dados):
+        """Devolve o PNG (bytes) do gráfico; se os dados não mudaram, sai do cache sem desenhar."""
+        chave = (user_id, tipo, self.impressao_digital(dados))
+        with self._lock:
+            png = self._cache.get(chave)
+            if png is not None:
+                self._cache.move_to_end(chave); self.hits += 1
+            else: self.misses += 1
+        metricas.contar("graficos_cache_total", tipo=tipo, resultado="hit" if png is not None else "miss")
+        if png is not None: return png
+
+        loop = asyncio.get_running_loop()
+        with metricas.cronometrar("graficos_render_segundos", tipo=tipo):
+            try:
+                png = await loop.run_in_executor(self.iniciar(), DESENHOS[tipo], *dados)
+            except BrokenProcessPool:
+                # Worker morreu: recria o pool na próxima chamada (sem fork, ver _contexto) e desenha numa thread desta vez
+                with self._lock: self._pool = None
+                png = await asyncio.to_thread(DESENHOS[tipo], *dados)
+
+        with self._lock:
+            self._cache[chave] = png
+            while len(self._cache) > self.max_cache: self._cache.popitem(last=False)
+        return png
+
+    def encerrar(self):
+        with self._lock:
+            if self._pool is not None: self._pool.shutdown(wait=False, cancel_futures=True); self._pool = None
+
+# Instância Global
+graficos = ServicoGraficos()
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""Importação de extratos bancários (CSV, OFX, XLSX) enviados ao bot como documento.
+
+O arquivo é lido em streaming (CSV linha a linha, OFX em blocos, XLSX em modo read-only) e
+os lançamentos vão para o banco em lotes de add_transacoes: a memória não cresce com o
+tamanho do extrato, só com os hashes do que o usuário já importou.
+
+- Tipo pelo sinal do valor (negativo = gasto), ou pelas colunas de crédito/débito.
+- Categoria pelo classificador, com o mesmo índice de palavras-chave das mensagens.
+- Deduplicação: cada linha vira um hash de conteúdo (data, tipo, valor, descrição e o FITID
+  do OFX, mais a ocorrência no arquivo), gravado em hash_importacao. Reenviar o mesmo
+  extrato, ou um que se sobrepõe a ele, não duplica nada.
+"""
+import re
+import csv
+import time
+import codecs
+import hashlib
+import unicodedata
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
+from classificador import encontrar_categoria_e_descricao
+from metricas import metricas
+
+FORMATOS = {'.csv': 'csv', '.txt': 'csv', '.ofx': 'ofx', '.qfx': 'ofx', '.xlsx': 'xlsx'}
+TAMANHO_MAXIMO = 20 * 1024 * 1024 # limite de download de arquivos da Bot API
+LOTE = 400 # lançamentos por add_transacoes (até Database.MAX_ITENS_LOTE)
+LINHAS_CABECALHO = 20 # linhas procuradas pelo cabeçalho (os bancos põem título e saldo antes)
+HORA_LANCAMENTO = 15 # datas só com o dia vão às 15h (horário do bot, ver db.data_local): longe da virada do dia
+
+# coluna -> nomes aceitos no cabeçalho (normalizados: minúsculas, sem acento)
+COLUNAS = {
+    'data': ('data', 'date', 'dt', 'data lancamento', 'data do lancamento', 'data movimento', 'data da transacao'),
+    'descricao': ('descricao', 'historico', 'description', 'title', 'titulo', 'lancamento', 'memo', 'estabelecimento', 'detalhes'),
+    'valor': ('valor', 'amount', 'value', 'quantia', 'valor (r$)', 'valor r$'),
+    'credito': ('credito', 'credito (r$)', 'entrada', 'entradas', 'credit'),
+    'debito': ('debito', 'debito (r$)', 'saida', 'saidas', 'debit'),
+}
+FORMATOS_DATA = ("%d/%m/%Y", "%Y-%m-%d", "%d/%m/%y", "%d-%m-%Y", "%d.%m.%Y", "%Y/%m/%d")
+_RE_MILHAR = re.compile(r"^\d{1,3}(\.\d{3})+$")
+_RE_TAG_OFX = re.compile(r"^(/?[A-Za-z0-9_.]+)>(.*)$", re.S)
+
+class ErroImportacao(ValueError):
+    """Problema no arquivo, com mensagem para o usuário."""
+
+def formato_arquivo(nome, mime=None):
+    nome = (nome or "").lower()
+    for extensao, formato in FORMATOS.items():
+        if nome.endswith(extensao): return formato
+    if mime == "text/csv": return "csv"
+    if mime == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": return "xlsx"
+    return None
+
+# ===================================================================
+# --- Valores ---
+# ===================================================================
+def _normalizar(texto):
+    texto = unicodedata.normalize("NFKD", str(texto).lower().strip())
+    return " ".join("".join(c for c in texto if not unicodedata.combining(c)).split())
+
+def _valor(celula):
+    """'1.234,56', '-50.00', 'R$ (12,90)', '30,00 D', 12.5 -> Decimal com sinal (None se vazio/inválido)."""
+    if celula is None or celula == "": return None
+    if isinstance(celula, (int, float, Decimal)): return Decimal(str(celula))
+    texto = str(celula).strip().upper().replace("R$", "").replace(" ", "").replace(" ", "")
+    negativo = texto.startswith("-") or texto.endswith(("-", "D")) or (texto.startswith("(") and texto.endswith(")"))
+    texto = texto.strip("-+()DC")
+    if not texto: return None
+    if "," in texto and "." in texto: # o último separador é o decimal
+        texto = texto.replace(".", "").replace(",", ".") if texto.rfind(",") > texto.rfind(".") else texto.replace(",", "")
+    elif "," in texto: texto = texto.replace(",", ".")
+    elif _RE_MILHAR.match(texto): texto = texto.replace(".", "")
+    try: valor = Decimal(texto)
+    except InvalidOperation: return None
+    return -valor if negativo else valor
+
+def _data(celula):
+    if isinstance(celula, datetime): return celula.date()
+    if isinstance(celula, date): return celula
+    texto = str(celula or "").strip()
+    if not texto: return None
+    if len(texto) >= 8 and texto[:8].isdigit(): # OFX: AAAAMMDD[HHMMSS][.xxx][fuso]
+        try: return datetime.strptime(texto[:8], "%Y%m%d").date()
+        except ValueError: return None
+    texto = texto.split()[0]
+    for formato in FORMATOS_DATA:
+        try: return datetime.strptime(texto, formato).date()
+        except ValueError: continue
+    return None
+
+# ===================================================================
+# --- Leitura em streaming ---
+# ===================================================================
+def _codificacao(caminho):
+    """UTF-8 (com ou sem BOM) se o começo do arquivo decodifica; senão Windows-1252 (bancos brasileiros)."""
+    with open(caminho, 'rb') as f: amostra = f.read(65536)
+    try: codecs.getincrementaldecoder('utf-8')().decode(amostra, final=False); return 'utf-8-sig'
+    except UnicodeDecodeError: return 'cp1252'
+
+def _linhas_csv(caminho):
+    with open(caminho, encoding=_codificacao(caminho), errors='replace', newline='') as f:
+        amostra = f.read(8192); f.seek(0)
+        try: dialeto = csv.Sniffer().sniff(amostra, delimiters=";,\t|")
+        except csv.Error: dialeto = 'excel-tab' if amostra.count("\t") > amostra.count(";") else csv.excel
+        try: yield from csv.reader(f, dialeto)
+        except csv.Error as e: raise ErroImportacao(f"CSV inválido: {e}") from e
+
+def _linhas_xlsx(caminho):
+    from openpyxl import load_workbook # import tardio, como nos relatórios
+    try: wb = load_workbook(caminho, read_only=True, data_only=True)
+    except Exception as e: raise ErroImportacao("Não consegui abrir a planilha (XLSX corrompido ou protegido).") from e
+    try: yield from wb.active.iter_rows(values_only=True)
+    finally: wb.close()
+
+def _tags_ofx(caminho, bloco=65536):
+    """(tag, valor) do OFX, lido em blocos. Serve para o SGML (tags sem fechamento) e para o XML."""
+    with open(caminho, 'rb') as f:
+        inicio = f.read(bloco)
+        cabecalho = inicio[:1024].decode('ascii', errors='ignore').upper()
+        codificacao = 'utf-8' if ('UTF-8' in cabecalho or 'CHARSET:65001' in cabecalho) else 'cp1252'
+        decodificador = codecs.getincrementaldecoder(codificacao)(errors='replace'); resto = ""
+        while inicio:
+            partes = (resto + decodificador.decode(inicio)).split("<"); resto = partes.pop() # a última pode estar incompleta
+            for parte in partes:
+                achado = _RE_TAG_OFX.match(parte)
+                if achado: yield achado.group(1).upper(), achado.group(2).strip()
+            inicio = f.read(bloco)
+        achado = _RE_TAG_OFX.match(resto + decodificador.decode(b"", final=True))
+        if achado: yield achado.group(1).upper(), achado.group(2).strip()
+
+def _registros_ofx(caminho):
+    atual = None
+    for tag, valor in _tags_ofx(caminho):
+        if tag == "STMTTRN": atual = {}
+        elif tag == "/STMTTRN" and atual is not None:
+            yield {'data': _data(atual.get("DTPOSTED")), 'valor': _valor(atual.get("TRNAMT")),
+                   'descricao': atual.get("MEMO") or atual.get("NAME") or "", 'id': atual.get("FITID")}
+            atual = None
+        elif atual is not None and not tag.startswith("/"): atual[tag] = valor
+
+def _mapear_colunas(linha):
+    """Índice de cada coluna conhecida, se a linha parece um cabeçalho (data + valor ou crédito/débito)."""
+    nomes = [_normalizar(c) if c is not None else "" for c in linha]; colunas = {}
+    for coluna, aceitos in COLUNAS.items():
+        for i, nome in enumerate(nomes):
+            if nome in aceitos and i not in colunas.values(): colunas[coluna] = i; break
+    if 'data' in colunas and ('valor' in colunas or 'credito' in colunas or 'debito' in colunas): return colunas
+    return None
+
+def _registros_tabela(linhas):
+    """Linhas de CSV/XLSX (listas de células) -> {data, valor, descricao}, a partir do cabeçalho."""
+    colunas = None
+    for n, linha in enumerate(linhas):
+        if colunas is None:
+            colunas = _mapear_colunas(linha)
+            if colunas is None and n >= LINHAS_CABECALHO:
+                raise ErroImportacao("Não encontrei o cabeçalho com as colunas de data e valor nas primeiras linhas.")
+            continue
+        if not any(c not in (None, "") for c in linha): continue # linha em branco
+        celula = lambda nome: linha[colunas[nome]] if nome in colunas and colunas[nome] < len(linha) else None
+        valor = _valor(celula('valor'))
+        if valor is None: # colunas separadas de crédito e débito
+            credito = _valor(celula('credito')); debito = _valor(celula('debito'))
+            valor = abs(credito) if credito else (-abs(debito) if debito else None)
+        yield {'data': _data(celula('data')), 'valor': valor, 'descricao': str(celula('descricao') or ""), 'id': None}
+    if colunas is None: raise ErroImportacao("Arquivo vazio ou sem cabeçalho reconhecível.")
+
+LEITORES = {'csv': lambda caminho: _registros_tabela(_linhas_csv(caminho)),
+            'xlsx': lambda caminho: _registros_tabela(_linhas_xlsx(caminho)),
+            'ofx': _registros_ofx}
+
+# ===================================================================
+# --- Lançamentos ---
+# ===================================================================
+def lancamento(registro, ocorrencias, por_dia):
+    """Registro do extrato -> item de add_transacoes (com data e hash_importacao), ou None se inválido."""
+    if registro['data'] is None or not registro['valor']: return None
+    tipo = "gasto" if registro['valor'] < 0 else "entrada"; valor = abs(registro['valor']).quantize(Decimal("0.01"))
+    descricao = " ".join(registro['descricao'].split())[:120]
+    base = f"{registro['data']:%Y-%m-%d}|{tipo}|{valor}|{descricao.lower()}|{registro.get('id') or ''}"
+    # Linhas idênticas no mesmo arquivo (dois cafés iguais no dia) são lançamentos distintos
+    ocorrencias[base] = ocorrencias.get(base, 0) + 1
+    chave = hashlib.blake2b(f"{base}|{ocorrencias[base]}".encode("utf-8"), digest_size=16).hexdigest()
+    # Mesmo dia: microssegundos em sequência, para a ordem (e os cursores de página) seguirem o extrato.
+    # por_dia começa do último já usado pelo usuário no dia (ver ultimos_por_dia): outro extrato do mesmo dia continua a sequência
+    por_dia[registro['data']] = por_dia.get(registro['data'], -1) + 1
+    categoria, palavra = encontrar_categoria_e_descricao(descricao.split())
+    if categoria is None: categoria = "Outras Entradas" if tipo == "entrada" else "Outros"
+    return {'tipo': tipo, 'valor_num': valor, 'valor_txt': f"{valor:.2f}".replace(".", ","), 'categoria': categoria.capitalize(),
+            'descricao': palavra or descricao[:60].capitalize() or "Extrato", 'metodo': "extrato", 'cartao': None,
+            'data': datetime.combine(registro['data'], datetime.min.time()) + timedelta(hours=HORA_LANCAMENTO, microseconds=por_dia[registro['data']]),
+            'hash_importacao': chave}
+
+def ultimos_por_dia(datas):
+    """{dia: último microssegundo usado depois de HORA_LANCAMENTO} das datas de lançamentos já importados."""
+    ultimos = {}
+    for data in datas:
+        if data is None: continue
+        deslocamento = (data - datetime.combine(data.date(), datetime.min.time())) // timedelta(microseconds=1) - HORA_LANCAMENTO * 3600 * 10**6
+        if deslocamento >= 0: ultimos[data.date()] = max(ultimos.get(data.date(), -1), deslocamento)
+    return ultimos
+
+def lotes(caminho, formato, existentes, resumo, tamanho=LOTE, por_dia=None):
+    """Gera listas de até `tamanho` lançamentos novos; atualiza resumo (lidas/duplicadas/invalidas) e existentes.
+    por_dia: último microssegundo já usado em cada dia (ultimos_por_dia); vazio se None."""
+    ocorrencias = {}; por_dia = {} if por_dia is None else por_dia; lote = []
+    for registro in LEITORES[formato](caminho):
+        resumo['lidas'] += 1
+        item = lancamento(registro, ocorrencias, por_dia)
+        if item is None: resumo['invalidas'] += 1; continue
+        if item['hash_importacao'] in existentes: resumo['duplicadas'] += 1; continue
+        existentes.add(item['hash_importacao']); lote.append(item)
+        if len(lote) >= tamanho: yield lote; lote = []
+    if lote: yield lote
+
+async def importar(adb, user_id, nome, caminho, formato, progresso=None, intervalo=3.0):
+    """Importa o extrato em lotes (cada um num commit). progresso(resumo) é aguardado a cada `intervalo`
+    segundos. Se algo falhar no meio, o que já foi gravado fica: reenviar o arquivo não duplica."""
+    resumo = {'lidas': 0, 'novas': 0, 'duplicadas': 0, 'invalidas': 0}
+    importados = await adb.importados(user_id)
+    gerador = lotes(caminho, formato, set(importados), resumo, por_dia=ultimos_por_dia(importados.values())); ultimo = time.monotonic()
+    try:
+        while True:
+            lote = await adb.executar(next, gerador, None) # leitura e classificação fora do event loop
+            if lote is None: break
+            await adb.add_transacoes(user_id, lote, nome); resumo['novas'] += len(lote)
+            if progresso is not None and time.monotonic() - ultimo >= intervalo:
+                ultimo = time.monotonic(); await progresso(resumo)
+    finally:
+        gerador.close()
+        adb.cache.invalidar(user_id) # as linhas antigas entraram no topo do cache: recarrega na ordem certa
+        for resultado in ('novas', 'duplicadas', 'invalidas'):
+            metricas.contar("importacao_linhas_total", resumo[resultado], ajuda="Linhas de extrato importadas", formato=formato, resultado=resultado)
+    return resumo
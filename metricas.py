@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""Métricas do processo no formato texto do Prometheus (rota /metrics do Flask).
+
+Contadores e histogramas com rótulos, num registro global thread-safe, sem
+dependências. cronometrar()/cronometrado() medem um trecho e, com contar_banco=True,
+também as leituras/escritas do Database feitas dentro dele: o escopo vive num
+ContextVar, que o AsyncDatabase repassa para as threads do pool.
+"""
+import time
+import asyncio
+import functools
+import threading
+import contextlib
+import contextvars
+
+BUCKETS_PADRAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Escopos abertos por cronometrar(contar_banco=True): tupla de dicts {'leituras', 'escritas'}
+_escopos_banco = contextvars.ContextVar('escopos_banco', default=())
+
+def _rotulos_texto(rotulos):
+    if not rotulos: return ""
+    escapar = lambda v: str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escapar(v)}"' for k, v in rotulos) + "}"
+
+class Metricas:
+    def __init__(self, buckets=BUCKETS_PADRAO):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._ajuda = {}        # nome -> (tipo, texto)
+        self._contadores = {}   # (nome, rótulos) -> valor
+        self._medidores = {}    # (nome, rótulos) -> valor
+        self._histogramas = {}  # (nome, rótulos) -> [contagens por bucket..., soma, total]
+        self._coletores = []    # funções chamadas em exportar() para atualizar medidores
+        self.loop_lag = 0.0; self.batimento = None # preenchidos por vigiar_loop()
+        self.ultima_atualizacao = None # monotonic da última mensagem tratada pelo responder
+
+    def _registrar(self, nome, tipo, ajuda):
+        if nome not in self._ajuda: self._ajuda[nome] = (tipo, ajuda or nome)
+
+    def contar(self, nome, valor=1, ajuda=None, **rotulos):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self._lock:
+            self._registrar(nome, "counter", ajuda)
+            self._contadores[chave] = self._contadores.get(chave, 0) + valor
+
+    def definir(self, nome, valor, ajuda=None, **rotulos):
+        with self._lock:
+            self._registrar(nome, "gauge", ajuda)
+            self._medidores[(nome, tuple(sorted(rotulos.items())))] = valor
+
+    def observar(self, nome, valor, ajuda=None, **rotulos):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self._lock:
+            self._registrar(nome, "histogram", ajuda)
+            h = self._histogramas.get(chave)
+            if h is None: h = self._histogramas[chave] = [0] * len(self.buckets) + [0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite: h[i] += 1
+            h[-2] += valor; h[-1] += 1
+
+    def coletor(self, func):
+        """Registra func(metricas), chamada a cada exportar() (ex.: estatísticas do cache)."""
+        self._coletores.append(func)
+        return func
+
+    @contextlib.contextmanager
+    def cronometrar(self, nome, contar_banco=False, **rotulos):
+        """Observa a duração do bloco em nome (histograma) e, opcionalmente, o uso do banco em
+        <nome sem _segundos>_leituras_total/_escritas_total. Exceções contam em <prefixo>_erros_total."""
+        prefixo = nome[:-len("_segundos")] if nome.endswith("_segundos") else nome
+        uso = {'leituras': 0, 'escritas': 0}; token = _escopos_banco.set(_escopos_banco.get() + (uso,)) if contar_banco else None
+        inicio = time.perf_counter()
+        try: yield uso
+        except BaseException:
+            self.contar(f"{prefixo}_erros_total", **rotulos); raise
+        finally:
+            self.observar(nome, time.perf_counter() - inicio, **rotulos)
+            if token is not None:
+                _escopos_banco.reset(token)
+                self.contar(f"{prefixo}_leituras_total", uso['leituras'], **rotulos)
+                self.contar(f"{prefixo}_escritas_total", uso['escritas'], **rotulos)
+
+    def cronometrado(self, nome, contar_banco=False, **rotulos):
+        """Decorador de cronometrar() para funções síncronas e corrotinas."""
+        def decorar(func):
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def _async(*args, **kwargs):
+                    with self.cronometrar(nome, contar_banco, **rotulos): return await func(*args, **kwargs)
+                return _async
+            @functools.wraps(func)
+            def _sync(*args, **kwargs):
+                with self.cronometrar(nome, contar_banco, **rotulos): return func(*args, **kwargs)
+            return _sync
+        return decorar
+
+    def exportar(self):
+        """Texto no formato de exposição do Prometheus (text/plain; version=0.0.4)."""
+        for func in list(self._coletores):
+            try: func(self)
+            except Exception as e: print(f"Métricas: coletor {getattr(func, '__name__', func)} falhou: {e}")
+        linhas = []
+        with self._lock:
+            series = {}
+            for (nome, rotulos), valor in self._contadores.items(): series.setdefault(nome, []).append((rotulos, valor))
+            for (nome, rotulos), valor in self._medidores.items(): series.setdefault(nome, []).append((rotulos, valor))
+            for (nome, rotulos), h in self._histogramas.items(): series.setdefault(nome, []).append((rotulos, list(h)))
+            ajuda = dict(self._ajuda)
+        for nome in sorted(series):
+            tipo, texto = ajuda[nome]
+            linhas.append(f"# HELP {nome} {texto}"); linhas.append(f"# TYPE {nome} {tipo}")
+            for rotulos, valor in sorted(series[nome], key=lambda s: s[0]):
+                if tipo != "histogram":
+                    linhas.append(f"{nome}{_rotulos_texto(rotulos)} {valor}"); continue
+                for limite, contagem in zip(self.buckets, valor):
+                    linhas.append(f"{nome}_bucket{_rotulos_texto(rotulos + (('le', repr(limite)),))} {contagem}")
+                linhas.append(f"{nome}_bucket{_rotulos_texto(rotulos + (('le', '+Inf'),))} {valor[-1]}")
+                linhas.append(f"{nome}_sum{_rotulos_texto(rotulos)} {valor[-2]}")
+                linhas.append(f"{nome}_count{_rotulos_texto(rotulos)} {valor[-1]}")
+        return "\n".join(linhas) + "\n"
+
+def registrar_banco(leituras=0, escritas=0):
+    """Chamado pelo Database a cada leitura/escrita: soma nos escopos de cronometrar() abertos."""
+    for uso in _escopos_banco.get():
+        uso['leituras'] += leituras; uso['escritas'] += escritas
+
+async def vigiar_loop(intervalo=1.0):
+    """Mede o atraso do event loop (quanto um sleep(intervalo) passou do previsto) e marca o batimento."""
+    while True:
+        inicio = time.monotonic()
+        await asyncio.sleep(intervalo)
+        metricas.loop_lag = max(0.0, time.monotonic() - inicio - intervalo); metricas.batimento = time.monotonic()
+        metricas.definir("bot_loop_lag_segundos", metricas.loop_lag, ajuda="Atraso do event loop do bot na última medição")
+
+# Instância Global
+metricas = Metricas()
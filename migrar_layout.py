@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""Migração online das transações do Firestore para o layout por usuário.
+
+transacoes/{id} (layout 'plano')  ->  usuarios/{uid}/transacoes/{id} (layout 'usuario')
+
+Os documentos mantêm o mesmo ID e o mesmo conteúdo (inclusive user_id); os agregados não
+mudam. A verificação compara, por usuário, os conjuntos de IDs e o tipo/valor de cada
+documento (com um checksum por layout no relatório): falta, sobra ou conteúdo diferente
+reprova a troca.
+
+O sincronizar escolhe as transações pelo criado_em (momento da gravação, não a 'data' do
+lançamento, que pode ser passada em lançamentos retroativos e extratos importados): o bot
+precisa estar nesta versão antes do verificar.
+
+Roteiro, com o bot no ar:
+    python migrar_layout.py copiar              # em lotes; retoma do cursor salvo em app_config
+    python migrar_layout.py verificar --corrigir # IDs e tipo/valor por usuário; corrige quem divergiu
+    # troque FIRESTORE_LAYOUT=usuario e reinicie o bot
+    python migrar_layout.py sincronizar         # copia o que entrou no plano entre a verificação e a troca
+    python migrar_layout.py limpar-plano --confirmar
+
+Antes da troca o bot ainda apaga no layout plano: rode o verificar --corrigir por último,
+o mais perto possível da troca. Depois dela, não rode o --corrigir (apagaria as transações
+novas, que só existem no layout por usuário).
+"""
+import sys
+import time
+import hashlib
+import argparse
+from datetime import datetime, timedelta, timezone
+
+from db import FirestoreDatabase
+
+CHAVE_ESTADO = "migracao_layout" # documento em app_config com o progresso
+MARGEM_RELOGIO = timedelta(minutes=5) # o sincronizar recua a marca da verificação (cópia idempotente)
+
+def checksum(conteudos):
+    """Resumo de {id: (tipo, centavos)} independente da ordem, para o relatório."""
+    h = hashlib.blake2b(digest_size=8)
+    for doc_id in sorted(conteudos): h.update(f"{doc_id}|{conteudos[doc_id][0]}|{conteudos[doc_id][1]}\n".encode())
+    return h.hexdigest()
+
+class Migracao:
+    def __init__(self, lote=400, pausa=0.0):
+        self.plano = FirestoreDatabase(layout='plano'); self.usuario = FirestoreDatabase(layout='usuario')
+        self.lote = lote; self.pausa = pausa # pausa entre lotes: não disputar cota com o bot
+        self.estado = self.plano.get_config(CHAVE_ESTADO) or {}
+
+    def salvar_estado(self, **campos):
+        self.estado.update(campos); self.estado['atualizado_em'] = datetime.now()
+        self.plano.set_config(CHAVE_ESTADO, self.estado)
+
+    def _copiar_docs(self, docs):
+        """Copia um lote de documentos do plano para as subcoleções (idempotente: mesmo ID)."""
+        batch = self.plano.db.batch(); copiados = sem_usuario = 0
+        for doc in docs:
+            dados = doc.to_dict(); user_id = dados.get('user_id')
+            if user_id is None: sem_usuario += 1; continue
+            batch.set(self.usuario._colecao_transacoes(user_id).document(doc.id), dados); copiados += 1
+        if copiados: batch.commit(); self.plano._contar(escritas=copiados)
+        return copiados, sem_usuario
+
+    def copiar(self, do_inicio=False):
+        cursor = None if do_inicio else self.estado.get('cursor')
+        copiados = 0 if do_inicio else self.estado.get('copiados', 0); sem_usuario = 0 if do_inicio else self.estado.get('sem_usuario', 0)
+        if cursor: print(f"Retomando a cópia depois de {cursor} ({copiados} já copiados).")
+        if do_inicio or 'copia_iniciada_em' not in self.estado: self.salvar_estado(copia_iniciada_em=datetime.now())
+        colecao = self.plano.collection_transacoes; inicio = time.monotonic()
+        while True:
+            query = colecao.order_by('__name__')
+            if cursor: query = query.start_after({'__name__': colecao.document(cursor)})
+            docs = list(self.plano._contando(query.limit(self.lote).stream()))
+            if not docs: break
+            n, s = self._copiar_docs(docs); copiados += n; sem_usuario += s; cursor = docs[-1].id
+            self.salvar_estado(cursor=cursor, copiados=copiados, sem_usuario=sem_usuario)
+            print(f"  {copiados} copiados ({copiados / (time.monotonic() - inicio):.0f}/s), cursor {cursor}")
+            if self.pausa: time.sleep(self.pausa)
+        self.salvar_estado(copia_concluida_em=datetime.now())
+        print(f"Cópia concluída: {copiados} transações ({sem_usuario} sem user_id, ignoradas). Banco: {self.plano.contadores()}")
+
+    def _conteudos(self, database, user_id):
+        """{id: (tipo, valor em centavos)} das transações do usuário num layout (só os dois campos)."""
+        conteudos = {}
+        for doc in self.plano._contando(database._consulta_transacoes(user_id).select(['tipo', 'valor_num']).stream()):
+            d = doc.to_dict(); conteudos[doc.id] = (d.get('tipo'), round(float(d.get('valor_num') or 0.0) * 100))
+        return conteudos
+
+    def _corrigir_usuario(self, user_id, copiar, apagar):
+        """Deixa a subcoleção do usuário igual ao plano: recopia os IDs em `copiar` (faltando ou
+        diferentes) e apaga os em `apagar` (só existem no layout por usuário)."""
+        copiar = list(copiar)
+        for i in range(0, len(copiar), self.lote):
+            refs = [self.plano.collection_transacoes.document(doc_id) for doc_id in copiar[i:i + self.lote]]
+            docs = [doc for doc in self.plano._contando(self.plano.db.get_all(refs)) if doc.exists]
+            self._copiar_docs(docs)
+        sobrando = list(apagar)
+        for i in range(0, len(sobrando), self.lote):
+            batch = self.plano.db.batch()
+            for doc_id in sobrando[i:i + self.lote]: batch.delete(self.usuario._colecao_transacoes(user_id).document(doc_id))
+            batch.commit(); self.plano._contar(escritas=len(sobrando[i:i + self.lote]))
+        return len(copiar), len(sobrando)
+
+    def verificar(self, corrigir=False):
+        marca = datetime.now(timezone.utc); divergentes = []; usuarios = self.plano.listar_usuarios()
+        for n, user_id in enumerate(usuarios, 1):
+            no_plano = self._conteudos(self.plano, user_id); no_usuario = self._conteudos(self.usuario, user_id)
+            faltando = no_plano.keys() - no_usuario.keys(); sobrando = no_usuario.keys() - no_plano.keys()
+            diferentes = {i for i in no_plano.keys() & no_usuario.keys() if no_plano[i] != no_usuario[i]}
+            if faltando or sobrando or diferentes:
+                linha = (f"  usuário {user_id}: plano={len(no_plano)} ({checksum(no_plano)}) usuario={len(no_usuario)} ({checksum(no_usuario)})"
+                         f" faltando={len(faltando)} sobrando={len(sobrando)} diferentes={len(diferentes)}")
+                if corrigir:
+                    copiados, apagados = self._corrigir_usuario(user_id, faltando | diferentes, sobrando)
+                    linha += f" -> corrigido (+{copiados} / -{apagados})"
+                else: divergentes.append(user_id)
+                print(linha)
+            if n % 100 == 0: print(f"  {n}/{len(usuarios)} usuários verificados")
+        self.salvar_estado(verificado_em=marca, divergentes=len(divergentes))
+        if divergentes: print(f"{len(divergentes)} de {len(usuarios)} usuários divergem (rode com --corrigir antes de trocar o layout).")
+        else: print(f"Verificação ok: {len(usuarios)} usuários com os mesmos IDs, tipos e valores nos dois layouts.")
+        return not divergentes
+
+    def sincronizar(self):
+        """Depois da troca: copia as transações gravadas no plano (criado_em) desde o início da última verificação."""
+        desde = self.estado.get('verificado_em')
+        if desde is None: sys.exit("Nenhuma verificação registrada: rode 'verificar --corrigir' antes de trocar o layout.")
+        if desde.tzinfo is None: desde = desde.replace(tzinfo=timezone.utc) # marcas antigas (UTC ingênuo)
+        desde -= MARGEM_RELOGIO
+        colecao = self.plano.collection_transacoes # conecta (e importa o firebase-admin)
+        from db import FieldFilter
+        query = colecao.where(filter=FieldFilter('criado_em', '>=', desde))
+        docs = list(self.plano._contando(query.stream())); copiados = 0
+        for i in range(0, len(docs), self.lote): copiados += self._copiar_docs(docs[i:i + self.lote])[0]
+        self.salvar_estado(sincronizado_em=datetime.now())
+        print(f"Sincronização: {copiados} transações gravadas no plano desde {desde} copiadas.")
+
+    def limpar_plano(self):
+        if self.estado.get('verificado_em') is None or self.estado.get('divergentes'):
+            sys.exit("A última verificação não passou: rode 'verificar --corrigir' (antes da troca) primeiro.")
+        colecao = self.plano.collection_transacoes; apagados = 0
+        while True: # sempre do começo: retomável por natureza
+            docs = list(self.plano._contando(colecao.select(['user_id']).limit(self.lote).stream()))
+            if not docs: break
+            batch = self.plano.db.batch()
+            for doc in docs: batch.delete(doc.reference)
+            batch.commit(); self.plano._contar(escritas=len(docs)); apagados += len(docs)
+            print(f"  {apagados} apagados do layout plano")
+            if self.pausa: time.sleep(self.pausa)
+        self.salvar_estado(plano_removido_em=datetime.now())
+        print(f"Coleção plana removida ({apagados} documentos). Banco: {self.plano.contadores()}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Migra as transações do Firestore para usuarios/{uid}/transacoes.")
+    parser.add_argument("comando", choices=["copiar", "verificar", "sincronizar", "limpar-plano", "estado"])
+    parser.add_argument("--lote", type=int, default=400, help="documentos por batch (máx. 500)")
+    parser.add_argument("--pausa", type=float, default=0.0, help="segundos entre lotes")
+    parser.add_argument("--do-inicio", action="store_true", help="copiar: ignora o cursor salvo")
+    parser.add_argument("--corrigir", action="store_true", help="verificar: copia o que falta e apaga o que sobra")
+    parser.add_argument("--confirmar", action="store_true", help="limpar-plano: obrigatório")
+    args = parser.parse_args()
+
+    migracao = Migracao(lote=min(args.lote, 500), pausa=args.pausa)
+    if args.comando == "copiar": migracao.copiar(do_inicio=args.do_inicio)
+    elif args.comando == "verificar": sys.exit(0 if migracao.verificar(corrigir=args.corrigir) else 1)
+    elif args.comando == "sincronizar": migracao.sincronizar()
+    elif args.comando == "limpar-plano":
+        if not args.confirmar: sys.exit("limpar-plano apaga a coleção 'transacoes' inteira: repita com --confirmar.")
+        migracao.limpar_plano()
+    else: print(migracao.estado or "Nenhuma migração iniciada.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""Persistência do user_data (estado da conversa) no nosso banco, para várias réplicas e restarts.
+
+O responder guarda os fluxos em andamento em context.user_data (aguardando_filtro,
+aguardando_filtro_categoria, admin_selecionado). Aqui esse estado vai para o Database:
+
+- Leitura: o Application chama refresh_user_data antes de cada atualização; o estado é lido
+  do banco no máximo a cada PERSISTENCIA_TTL segundos por usuário (2 s, o mesmo prazo do
+  CACHE_REVALIDAR das transações). Numa conversa as mensagens seguidas saem da memória, sem
+  uma leitura síncrona antes de cada handler; o que outra réplica gravou vale depois do TTL.
+  Só a cópia local com alteração ainda não gravada é mais nova que o banco e não é
+  substituída. PERSISTENCIA_TTL=0 volta a ler do banco toda vez.
+- Memória: o que se sabe do banco (hora da leitura e último estado) fica num LRU de até
+  PERSISTENCIA_MAX_USUARIOS usuários (5000); quem sai dele é lido de novo na próxima mensagem.
+- Escrita: o Application entrega o user_data alterado a cada PERSISTENCIA_INTERVALO (0,5 s);
+  as alterações saem num único salvar_estados_usuarios (lote) após PERSISTENCIA_ATRASO.
+  No desligamento (SIGTERM, polling ou webhook) o stop do Application entrega o que mudou e
+  flush() grava antes do processo sair.
+
+Com várias réplicas, a janela de inconsistência é a da escrita mais o TTL (~INTERVALO + ATRASO
++ TTL): uma mensagem do mesmo chat que chegue a outra réplica dentro dela ainda vê o estado
+anterior.
+
+Os valores passam por JSON: tuplas voltam como listas (admin_selecionado é desempacotado,
+então tanto faz).
+"""
+import os
+import json
+import time
+import asyncio
+from collections import OrderedDict
+from telegram.ext import BasePersistence, PersistenceInput
+
+from metricas import metricas
+
+def _normalizar(dados):
+    """Cópia independente só com tipos JSON (o que o banco devolve numa leitura)."""
+    return json.loads(json.dumps(dados, default=str))
+
+class PersistenciaBanco(BasePersistence):
+    def __init__(self, adb, update_interval=None, ttl=None, atraso=None, max_usuarios=None):
+        super().__init__(store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+                         update_interval=update_interval or float(os.environ.get('PERSISTENCIA_INTERVALO', '0.5')))
+        self.adb = adb
+        self.ttl = ttl if ttl is not None else float(os.environ.get('PERSISTENCIA_TTL', '2'))
+        self.atraso = atraso if atraso is not None else float(os.environ.get('PERSISTENCIA_ATRASO', '0.05'))
+        self.max_usuarios = max_usuarios or int(os.environ.get('PERSISTENCIA_MAX_USUARIOS', '5000'))
+        self._conhecidos = OrderedDict() # user_id -> (monotonic da última leitura/escrita, último estado normalizado no banco)
+        self._sujos = {}   # user_id -> estado a gravar (None = apagar)
+        self._descarga = None # tarefa da próxima gravação em lote
+
+    # --- user_data ---
+    async def get_user_data(self):
+        return {} # carregado sob demanda em refresh_user_data: o start não lê o estado de todos
+
+    def _conhecer(self, user_id, dados):
+        self._conhecidos[user_id] = (time.monotonic(), dados); self._conhecidos.move_to_end(user_id)
+        while len(self._conhecidos) > self.max_usuarios: self._conhecidos.popitem(last=False)
+
+    async def refresh_user_data(self, user_id, user_data):
+        if user_id in self._sujos: return # a cópia local é mais nova que o banco
+        conhecido = self._conhecidos.get(user_id)
+        if conhecido is not None and time.monotonic() - conhecido[0] < self.ttl:
+            self._conhecidos.move_to_end(user_id); return
+        dados = await self.adb.get_estado_usuario(user_id) or {}
+        self._conhecer(user_id, dados)
+        metricas.contar("persistencia_leituras_total", ajuda="Estados de conversa lidos do banco")
+        if user_id in self._sujos: return # alterado enquanto lia
+        if dados != _normalizar(user_data): user_data.clear(); user_data.update(dados)
+
+    async def update_user_data(self, user_id, data):
+        dados = _normalizar(data)
+        conhecido = self._conhecidos.get(user_id)
+        if conhecido is not None and dados == conhecido[1] and user_id not in self._sujos: return # nada mudou
+        self._sujos[user_id] = dados; self._agendar()
+
+    async def drop_user_data(self, user_id):
+        self._sujos[user_id] = None; self._agendar()
+
+    # --- gravação em lote ---
+    def _agendar(self):
+        if self._descarga is None or self._descarga.done():
+            self._descarga = asyncio.get_running_loop().create_task(self._descarregar_depois())
+
+    async def _descarregar_depois(self):
+        await asyncio.sleep(self.atraso) # junta as alterações de vários usuários numa escrita só
+        await self._descarregar()
+
+    async def _descarregar(self):
+        lote = dict(self._sujos)
+        if not lote: return
+        try:
+            with metricas.cronometrar("persistencia_gravacao_segundos"):
+                await self.adb.salvar_estados_usuarios(lote)
+        except Exception as e:
+            print(f"Persistência: falha ao gravar {len(lote)} estados (ficam pendentes para a próxima gravação): {e}"); return
+        for user_id, dados in lote.items():
+            if self._sujos.get(user_id, ...) is dados: del self._sujos[user_id] # não mudou durante a gravação
+            self._conhecer(user_id, dados or {})
+        metricas.contar("persistencia_estados_gravados_total", len(lote), ajuda="Estados de conversa gravados no banco")
+
+    async def flush(self):
+        if self._descarga is not None and not self._descarga.done(): await self._descarga
+        await self._descarregar()
+
+    # --- o resto não é persistido (store_data só com user_data) ---
+    async def get_chat_data(self): return {}
+    async def get_bot_data(self): return {}
+    async def get_callback_data(self): return None
+    async def get_conversations(self, name): return {}
+    async def update_conversation(self, name, key, new_state): pass
+    async def update_chat_data(self, chat_id, data): pass
+    async def update_bot_data(self, data): pass
+    async def update_callback_data(self, data): pass
+    async def drop_chat_data(self, chat_id): pass
+    async def refresh_chat_data(self, chat_id, chat_data): pass
+    async def refresh_bot_data(self, bot_data): pass
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+import contextvars
+
+import pytest
+
+pytest.importorskip("telegram")
+pytest.importorskip("flask")
+from bot import MAX_LANCAMENTOS_MENSAGEM, executar_relatorio, texto_confirmacao_lote
+from classificador import interpretar_mensagens
+
+def test_confirmacao_de_50_linhas_longas_cabe_numa_mensagem():
+    descricao = "mercado " + "compra do mês com muitos itens diferentes " * 6
+    linhas = [f"{i + 10} {descricao}{i}" for i in range(MAX_LANCAMENTOS_MENSAGEM + 5)]
+    linhas += ["isso aqui não é um lançamento " * 8] * 20
+    partes = interpretar_mensagens("\n".join(linhas))
+    entendidos = [r for _, r in partes if r["acao"] == "add"]; ignoradas = [p for p, r in partes if r["acao"] != "add"]
+    assert len(entendidos) == MAX_LANCAMENTOS_MENSAGEM + 5 and len(ignoradas) == 20
+    texto = texto_confirmacao_lote(MAX_LANCAMENTOS_MENSAGEM, entendidos[:MAX_LANCAMENTOS_MENSAGEM], True, ignoradas)
+    assert len(texto) < 4096 - 200 # sobra para o saldo ou o alerta
+    assert f"✅ {MAX_LANCAMENTOS_MENSAGEM} lançamentos registrados" in texto and "e mais 35" in texto and "e mais 10" in texto
+
+def test_relatorio_nao_ocupa_o_pool_do_banco():
+    marca = contextvars.ContextVar("marca")
+    def relatorio(): return threading.current_thread().name, marca.get()
+    async def rodar():
+        marca.set("handler"); return await executar_relatorio(relatorio)
+    nome, valor = asyncio.run(rodar())
+    assert nome.startswith("relatorio") and valor == "handler" # métricas do handler continuam valendo
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+pytest.importorskip("telegram")
+import broadcast
+from broadcast import LeasePerdido
+
+@pytest.fixture
+def banco(tmp_path, monkeypatch):
+    from db import AsyncDatabase
+    from db_sqlite import SQLiteDatabase
+    banco = SQLiteDatabase(str(tmp_path / "teste.db"))
+    for uid in range(1, 6): banco.add_transacoes(uid, [{'tipo': "gasto", 'valor_num': 1, 'categoria': "Outros", 'descricao': "x"}])
+    monkeypatch.setattr(broadcast, "adb", AsyncDatabase(banco, max_workers=2))
+    return banco
+
+def test_so_um_dono_por_vez(banco):
+    banco.criar_job_broadcast("j", "oi")
+    assert banco.reivindicar_job_broadcast("j", "a", 60)['dono'] == "a"
+    assert banco.reivindicar_job_broadcast("j", "b", 60) is None # lease de "a" ainda vale
+    assert banco.reivindicar_job_broadcast("j", "a", 60) is not None # renovação
+    banco.atualizar_job_broadcast("j", {'lease_ate': 0}) # "a" caiu sem renovar
+    assert banco.reivindicar_job_broadcast("j", "b", 60)['dono'] == "b"
+    assert banco.reivindicar_job_broadcast("j", "a", 60) is None
+    banco.atualizar_job_broadcast("j", {'status': 'concluido'})
+    assert banco.reivindicar_job_broadcast("j", "b", 60) is None
+
+class _Bot:
+    def __init__(self, ao_enviar=None): self.enviados = []; self.ao_enviar = ao_enviar
+    async def send_message(self, chat_id, text):
+        self.enviados.append(chat_id)
+        if self.ao_enviar: self.ao_enviar()
+
+def test_job_com_lease_de_outro_nao_envia(banco):
+    banco.criar_job_broadcast("j", "oi"); banco.reivindicar_job_broadcast("j", "outra-replica", 60)
+    bot = _Bot()
+    with pytest.raises(LeasePerdido): asyncio.run(broadcast.executar_job(bot, "j"))
+    assert bot.enviados == []
+
+def test_lease_assumido_no_meio_para_antes_de_avancar_o_cursor(banco, monkeypatch):
+    monkeypatch.setattr(broadcast, "TAMANHO_LOTE", 2); monkeypatch.setattr(broadcast, "CONCORRENCIA", 1)
+    banco.criar_job_broadcast("j", "oi")
+    def assumir(): # outra réplica acha o lease expirado e assume o job
+        if banco.get_job_broadcast("j")['dono'] != "outra-replica":
+            banco.atualizar_job_broadcast("j", {'lease_ate': 0}); banco.reivindicar_job_broadcast("j", "outra-replica", 60)
+    bot = _Bot(ao_enviar=assumir)
+    with pytest.raises(LeasePerdido): asyncio.run(broadcast.executar_job(bot, "j"))
+    job = banco.get_job_broadcast("j")
+    assert bot.enviados == [1, 2] and job['cursor'] is None and job['lote_em_andamento'] == [1, 2] # a outra réplica retoma o lote
+    assert banco.envios_broadcast("j", [1, 2]) == {1: "enviado", 2: "enviado"}
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from decimal import Decimal
+
+from classificador import classificar, encontrar_categoria_e_descricao, interpretar_mensagem, singulares
+
+def test_primeira_palavra_chave_exata_vence():
+    assert classificar("40 lanches escola".split())[:2] == ("Educação", "Escola")
+    assert classificar("30 cafe escola".split())[:2] == ("Alimentação", "Café")
+
+def test_singular_so_quando_nada_casa_como_esta():
+    assert classificar("40 lanches".split())[:2] == ("Alimentação", "Lanche")
+    assert classificar("40 pizzas uber".split())[:2] == ("Transporte", "Uber")
+
+def test_chave_de_varias_palavras_antes_da_palavra_solta():
+    assert encontrar_categoria_e_descricao("100 internet celular".split()) == ("Moradia", "Internet celular")
+
+def test_acentos_e_maiusculas():
+    assert classificar(["SALARIO"]) == ("Salário", "Salário", True)
+    assert classificar(["metro"])[0] == "Transporte"
+
+def test_entrada_mesmo_depois_da_categoria():
+    assert classificar("200 presentes".split())[2] is True
+    assert classificar("50 mercado".split())[2] is False
+
+def test_singulares():
+    assert "lanche" in singulares("lanches") and "acao" in singulares("acoes")
+
+def test_interpretar_mensagem_com_cartao():
+    item = interpretar_mensagem("50 uber nubank")
+    assert (item['tipo'], item['valor_num'], item['categoria'], item['metodo'], item['cartao']) == ("gasto", Decimal("50"), "Transporte", "cartao", "Nubank")
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from db import Database, Transacao, data_local, data_no_banco
+
+class _Documento:
+    def __init__(self, id, dados): self.id = id; self._dados = dados
+    def to_dict(self): return dict(self._dados)
+
+def test_data_do_firestore_vira_horario_local():
+    # 02:30 UTC do dia 1º ainda é dia 31 em Brasília (UTC-3)
+    doc = _Documento("x", {'tipo': "gasto", 'valor_num': 10, 'data': datetime(2024, 2, 1, 2, 30, tzinfo=timezone.utc)})
+    assert Transacao.de_documento(doc).data == datetime(2024, 1, 31, 23, 30)
+    assert Database._chave_mes(datetime(2024, 2, 1, 2, 30, tzinfo=timezone.utc)) == "2024-01"
+
+def test_ida_e_volta_pelo_banco():
+    local = datetime(2024, 1, 31, 23, 30)
+    assert data_no_banco(local).astimezone(timezone.utc) == datetime(2024, 2, 1, 2, 30, tzinfo=timezone.utc)
+    assert data_local(data_no_banco(local)) == local and data_local(local) is local
+
+def _paginas(banco, user_id, tipo, limite):
+    """Percorre o extrato para a frente e depois de volta, como os botões Próxima/Anterior."""
+    paginas = []; pagina, _, tem_proxima = banco.get_pagina(user_id, tipo, limite); paginas.append(pagina)
+    while tem_proxima:
+        pagina, _, tem_proxima = banco.get_pagina(user_id, tipo, limite, apos=(pagina[-1].data, pagina[-1].id)); paginas.append(pagina)
+    volta = [pagina]; tem_anterior = True
+    while tem_anterior:
+        pagina, tem_anterior, _ = banco.get_pagina(user_id, tipo, limite, antes=(pagina[0].data, pagina[0].id)); volta.append(pagina)
+    return [t.id for p in paginas for t in p], [t.id for p in reversed(volta) for t in p]
+
+def test_paginacao_com_datas_iguais(tmp_path):
+    from db_sqlite import SQLiteDatabase
+    banco = SQLiteDatabase(str(tmp_path / "teste.db"))
+    mesmo_instante = datetime(2024, 3, 5, 15)
+    itens = [{'tipo': "gasto", 'valor_num': i + 1, 'categoria': "Outros", 'descricao': f"item {i}", 'data': mesmo_instante} for i in range(7)]
+    itens.append({'tipo': "gasto", 'valor_num': 99, 'categoria': "Outros", 'descricao': "depois", 'data': datetime(2024, 3, 6)})
+    banco.add_transacoes(1, itens)
+    banco.cache.invalidar(1)
+    ida, volta = _paginas(banco, 1, "gasto", 3) # consultas no banco
+    assert len(ida) == len(set(ida)) == 8 and volta == ida
+    banco.get_todas(1) # histórico no cache: o mesmo resultado fatiando a memória
+    assert _paginas(banco, 1, "gasto", 3) == (ida, ida)
+
+class _Transitorio(Exception): pass
+
+class _Ref:
+    def __init__(self, path): self.path = path
+    def document(self): return _Ref(f"{self.path}/novo")
+
+class _Cliente:
+    """Cliente falso do Firestore: 'ruim/...' é recusado sempre; os primeiros `instavel` commits dão erro transitório."""
+    def __init__(self, instavel=0): self.gravados = []; self.instavel = instavel; self.commits = 0
+    def collection(self, nome): return _Ref(nome)
+    def batch(self):
+        cliente = self; escritas = []
+        class _Batch:
+            def set(self, ref, dados, merge=False): escritas.append(ref.path)
+            def commit(self):
+                cliente.commits += 1
+                if cliente.instavel: cliente.instavel -= 1; raise _Transitorio("unavailable")
+                if any(p.startswith("ruim/") for p in escritas): raise ValueError("InvalidArgument")
+                cliente.gravados.extend(escritas)
+        return _Batch()
+
+def _fila(cliente, monkeypatch):
+    from db import FilaEscrita
+    monkeypatch.setattr("time.sleep", lambda s: None)
+    return FilaEscrita(cliente, latencia_ms=1, transitorios=(_Transitorio,))
+
+def test_fila_erro_permanente_descarta_so_o_grupo_ruim(monkeypatch):
+    cliente = _Cliente(); fila = _fila(cliente, monkeypatch)
+    fila.enfileirar([(_Ref("t/1"), {}, False), (_Ref("agregados/1"), {}, True)])
+    fila.enfileirar([(_Ref("ruim/2"), {}, False)])
+    fila.enfileirar([(_Ref("t/3"), {}, False)])
+    fila.descarregar() # não trava: o grupo ruim vai para o dead letter
+    assert set(cliente.gravados) == {"t/1", "agregados/1", "t/3", "escritas_falhas/novo"}
+    fila.enfileirar([(_Ref("t/4"), {}, False)]); fila.fechar()
+    assert "t/4" in cliente.gravados
+
+def test_fila_refaz_erro_transitorio_ate_o_limite(monkeypatch):
+    cliente = _Cliente(instavel=3); fila = _fila(cliente, monkeypatch)
+    fila.enfileirar([(_Ref("t/1"), {}, False)]); fila.descarregar()
+    assert cliente.gravados == ["t/1"] and cliente.commits == 4
+    cliente.instavel = 100; fila.enfileirar([(_Ref("t/2"), {}, False)]); fila.descarregar()
+    assert "t/2" not in cliente.gravados and cliente.commits == 4 + fila.tentativas + 1 # +1: o dead letter
+    fila.fechar()
+
+def test_fila_descarregar_de_um_usuario_nao_espera_os_outros(monkeypatch):
+    import threading
+    liberar = threading.Event(); cliente = _Cliente(); batch_original = cliente.batch
+    def batch():
+        b = batch_original(); commit = b.commit; escritas = []; set_original = b.set
+        def set_(ref, dados, merge=False): escritas.append(ref.path); set_original(ref, dados, merge)
+        def commit_():
+            if any(p.startswith("u2/") for p in escritas): liberar.wait(5)
+            commit()
+        b.set = set_; b.commit = commit_; return b
+    cliente.batch = batch
+    from db import FilaEscrita
+    fila = FilaEscrita(cliente, latencia_ms=60000, transitorios=(_Transitorio,))
+    for n in range(3): fila.enfileirar([(_Ref(f"u2/{n}/{i}"), {}, False) for i in range(100)], 2)
+    fila.enfileirar([(_Ref("u1/a"), {}, False)], 1)
+    fila.descarregar(1) # passa à frente do usuário 2, num commit só dele
+    assert cliente.gravados == ["u1/a"]
+    liberar.set(); fila.descarregar()
+    assert len(cliente.gravados) == 1 + 300
+    fila.fechar()
+
+class _Falha:
+    def __init__(self, referencia, attempts): self.operation = type("Op", (), {'reference': referencia})(); self.attempts = attempts; self.code = 7; self.message = "denied"
+
+class _Bulk:
+    """BulkWriter falso: as referências em `recusar` falham em todas as tentativas."""
+    def __init__(self, recusar): self.recusar = recusar; self.apagados = []; self._ok = self._erro = None
+    def on_write_result(self, f): self._ok = f
+    def on_write_error(self, f): self._erro = f
+    def delete(self, referencia):
+        tentativa = 1
+        while referencia.id in self.recusar:
+            if not self._erro(_Falha(referencia, tentativa), self): return
+            tentativa += 1
+        self.apagados.append(referencia.id); self._ok(referencia, None, self)
+    def close(self): pass
+
+def test_limpar_no_firestore_conta_so_as_exclusoes_confirmadas(monkeypatch):
+    import db as modulo
+    from db import FirestoreDatabase
+    class _Doc:
+        def __init__(self, id, dados): self.id = id; self._dados = dados; self.reference = type("R", (), {'id': id, 'path': f"transacoes/{id}"})()
+        def to_dict(self): return dict(self._dados)
+    docs = [_Doc(str(i), {'tipo': "gasto", 'valor_num': 10.0, 'categoria': "Outros", 'data': datetime(2024, 3, 5)}) for i in range(4)]
+    class _Consulta:
+        def where(self, **_): return self
+        def select(self, _): return self
+        def stream(self): return iter(docs)
+    gravados = []
+    class _Agregado:
+        def set(self, dados, merge=None): gravados.append(dados)
+    class _Colecao:
+        def document(self, _): return _Agregado()
+    bulk = _Bulk({"2"})
+    monkeypatch.setattr(modulo, "FieldFilter", lambda *a: a)
+    monkeypatch.setattr(modulo, "firestore", type("F", (), {'Increment': staticmethod(lambda v: ("inc", v))}))
+    banco = FirestoreDatabase()
+    banco.__dict__.update(fila=None, collection_transacoes=_Consulta(), collection_agregados=_Colecao(),
+                          db=type("C", (), {'bulk_writer': lambda self: bulk})())
+    resumo = banco.limpar_transacoes(1, "tudo")
+    assert (resumo['removidos'], resumo['gasto'], resumo['falhas']) == (3, Decimal("30.00"), 1)
+    # Com falha, "tudo" não zera o agregado: desconta só as 3 que saíram
+    assert gravados == [{'total': {'gasto': ("inc", -30.0)}, 'meses': {'2024-03': {'gasto': ("inc", -30.0)}},
+                         'categorias': {'gasto': {'Outros': ("inc", -30.0)}}, 'revisao': ("inc", 1)}]
+    assert banco.escritas == 4 # 3 exclusões + o agregado
+
+def test_contar_usuarios_ativos_sem_ler_os_perfis(tmp_path, monkeypatch):
+    from db_sqlite import SQLiteDatabase
+    banco = SQLiteDatabase(str(tmp_path / "teste.db"))
+    for uid in (1, 2, 3): banco.add_transacoes(uid, [{'tipo': "gasto", 'valor_num': 1, 'categoria': "Outros", 'descricao': "x"}])
+    banco.marcar_usuario_bloqueado(2)
+    assert (banco.contar_usuarios(), banco.contar_usuarios(apenas_ativos=True)) == (3, 2)
+    # Firestore: duas agregações count(), nenhum documento de usuário lido
+    import db as modulo
+    from db import FirestoreDatabase
+    class _Contagem:
+        def __init__(self, n): self.n = n
+        def get(self): return [[type("A", (), {'value': self.n})()]]
+    class _Usuarios:
+        def where(self, filter): assert filter == ('bloqueado', '==', True); return type("Q", (), {'count': lambda self: _Contagem(4)})()
+        def count(self): return _Contagem(10)
+        def stream(self): raise AssertionError("não deveria ler os perfis")
+    monkeypatch.setattr(modulo, "FieldFilter", lambda *a: a)
+    firestore = FirestoreDatabase(); firestore.__dict__['collection_usuarios'] = _Usuarios()
+    assert (firestore.contar_usuarios(), firestore.contar_usuarios(apenas_ativos=True)) == (10, 6)
+    assert firestore.leituras == 3
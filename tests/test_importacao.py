@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+import importacao
+from importacao import ErroImportacao, _data, _valor, lancamento, lotes
+
+EXTRATO_CSV = ("Banco Exemplo S.A.;;\n"
+               "Saldo anterior;;1.000,00\n"
+               "Data;Histórico;Valor (R$)\n"
+               "05/03/2024;Padaria Pão Quente;-12,90\n"
+               "05/03/2024;Padaria Pão Quente;-12,90\n"
+               "06/03/2024;Salário março;3.500,00\n"
+               "07/03/2024;Uber viagem;-27,35\n"
+               ";;\n")
+
+EXTRATO_OFX = """OFXHEADER:100
+DATA:OFXSGML
+CHARSET:1252
+
+<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20240305120000[-3:BRT]<TRNAMT>-50.00<FITID>A1<MEMO>Mercado Central
+</STMTTRN>
+<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20240306<TRNAMT>1200.00<FITID>A2<NAME>Pix recebido
+</STMTTRN>
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+"""
+
+def _arquivo(tmp_path, nome, conteudo, codificacao="cp1252"):
+    caminho = tmp_path / nome
+    caminho.write_bytes(conteudo.encode(codificacao))
+    return str(caminho)
+
+def _lancamentos(caminho, formato, existentes=None):
+    resumo = {'lidas': 0, 'novas': 0, 'duplicadas': 0, 'invalidas': 0}
+    itens = [item for lote in lotes(caminho, formato, set() if existentes is None else existentes, resumo) for item in lote]
+    return itens, resumo
+
+@pytest.mark.parametrize("celula, esperado", [
+    ("1.234,56", Decimal("1234.56")), ("-50.00", Decimal("-50.00")), ("R$ (12,90)", Decimal("-12.90")),
+    ("30,00 D", Decimal("-30.00")), ("1,234.56", Decimal("1234.56")), ("1.000", Decimal("1000")),
+    (12.5, Decimal("12.5")), ("", None), ("abc", None)])
+def test_valor(celula, esperado):
+    assert _valor(celula) == esperado
+
+@pytest.mark.parametrize("celula, esperado", [
+    ("05/03/2024", date(2024, 3, 5)), ("2024-03-05", date(2024, 3, 5)), ("05/03/24", date(2024, 3, 5)),
+    ("20240305120000[-3:BRT]", date(2024, 3, 5)), ("05/03/2024 10:00", date(2024, 3, 5)),
+    (datetime(2024, 3, 5, 23, 59), date(2024, 3, 5)), ("32/13/2024", None), (None, None)])
+def test_data(celula, esperado):
+    assert _data(celula) == esperado
+
+def test_formato_arquivo():
+    assert importacao.formato_arquivo("Extrato.CSV") == "csv"
+    assert importacao.formato_arquivo("extrato.qfx") == "ofx"
+    assert importacao.formato_arquivo("sem_extensao", "text/csv") == "csv"
+    assert importacao.formato_arquivo("foto.jpg") is None
+
+def test_csv_cp1252_com_titulo_antes_do_cabecalho(tmp_path):
+    itens, resumo = _lancamentos(_arquivo(tmp_path, "extrato.csv", EXTRATO_CSV), "csv")
+    assert resumo == {'lidas': 4, 'novas': 0, 'duplicadas': 0, 'invalidas': 0}
+    assert [(i['tipo'], i['valor_num']) for i in itens] == [("gasto", Decimal("12.90")), ("gasto", Decimal("12.90")),
+                                                              ("entrada", Decimal("3500.00")), ("gasto", Decimal("27.35"))]
+    assert itens[0]['descricao'] == "Padaria" and itens[0]['categoria'] == "Alimentação"
+    assert itens[2]['categoria'] == "Salário" and itens[3]['categoria'] == "Transporte"
+    assert all(i['metodo'] == "extrato" for i in itens)
+
+def test_csv_sem_cabecalho(tmp_path):
+    caminho = _arquivo(tmp_path, "lixo.csv", "a;b\n" * 30)
+    with pytest.raises(ErroImportacao): _lancamentos(caminho, "csv")
+
+def test_ofx(tmp_path):
+    itens, resumo = _lancamentos(_arquivo(tmp_path, "extrato.ofx", EXTRATO_OFX), "ofx")
+    assert resumo['lidas'] == 2 and resumo['invalidas'] == 0
+    assert [(i['tipo'], i['valor_num'], i['data'].date()) for i in itens] == [("gasto", Decimal("50.00"), date(2024, 3, 5)),
+                                                                             ("entrada", Decimal("1200.00"), date(2024, 3, 6))]
+    assert itens[0]['categoria'] == "Alimentação" and itens[1]['descricao'] == "Pix"
+
+def test_linhas_iguais_no_mesmo_arquivo_sao_lancamentos_distintos():
+    ocorrencias = {}; por_dia = {}
+    registro = {'data': date(2024, 3, 5), 'valor': Decimal("-12.90"), 'descricao': "Padaria", 'id': None}
+    primeiro = lancamento(registro, ocorrencias, por_dia); segundo = lancamento(registro, ocorrencias, por_dia)
+    assert primeiro['hash_importacao'] != segundo['hash_importacao']
+    # O hash depende só do conteúdo e da ocorrência: o mesmo arquivo lido de novo gera os mesmos hashes
+    assert lancamento(registro, {}, {})['hash_importacao'] == primeiro['hash_importacao']
+    assert lancamento({**registro, 'id': "FITID-1"}, {}, {})['hash_importacao'] != primeiro['hash_importacao']
+
+def test_data_ingenua_as_15h_com_microssegundos_na_ordem_do_extrato(tmp_path):
+    itens, _ = _lancamentos(_arquivo(tmp_path, "extrato.csv", EXTRATO_CSV), "csv")
+    assert all(i['data'].tzinfo is None for i in itens)
+    assert [i['data'] for i in itens] == [datetime(2024, 3, 5, 15, 0, 0, 0), datetime(2024, 3, 5, 15, 0, 0, 1),
+                                         datetime(2024, 3, 6, 15, 0, 0, 0), datetime(2024, 3, 7, 15, 0, 0, 0)]
+
+def test_registro_invalido():
+    assert lancamento({'data': None, 'valor': Decimal("-1"), 'descricao': "x"}, {}, {}) is None
+    assert lancamento({'data': date(2024, 3, 5), 'valor': Decimal("0"), 'descricao': "x"}, {}, {}) is None
+
+def test_existentes_sao_ignorados(tmp_path):
+    caminho = _arquivo(tmp_path, "extrato.csv", EXTRATO_CSV)
+    itens, _ = _lancamentos(caminho, "csv")
+    novos, resumo = _lancamentos(caminho, "csv", {i['hash_importacao'] for i in itens})
+    assert novos == [] and resumo['duplicadas'] == 4
+
+# --- Ponta a ponta no SQLite ---
+@pytest.fixture
+def adb(tmp_path):
+    from db import AsyncDatabase
+    from db_sqlite import SQLiteDatabase
+    return AsyncDatabase(SQLiteDatabase(str(tmp_path / "teste.db")), max_workers=2)
+
+def test_reimportar_nao_grava_nada(tmp_path, adb):
+    caminho = _arquivo(tmp_path, "extrato.csv", EXTRATO_CSV)
+    primeiro = asyncio.run(importacao.importar(adb, 1, "Ana", caminho, "csv"))
+    assert primeiro == {'lidas': 4, 'novas': 4, 'duplicadas': 0, 'invalidas': 0}
+    segundo = asyncio.run(importacao.importar(adb, 1, "Ana", caminho, "csv"))
+    assert segundo == {'lidas': 4, 'novas': 0, 'duplicadas': 4, 'invalidas': 0}
+    assert len(adb._db.get_todas(1)) == 4
+
+def test_extrato_sobreposto_so_grava_o_que_falta(tmp_path, adb):
+    asyncio.run(importacao.importar(adb, 1, "Ana", _arquivo(tmp_path, "a.csv", EXTRATO_CSV), "csv"))
+    maior = EXTRATO_CSV + "08/03/2024;Mercado;-100,00\n"
+    resumo = asyncio.run(importacao.importar(adb, 1, "Ana", _arquivo(tmp_path, "b.csv", maior), "csv"))
+    assert (resumo['novas'], resumo['duplicadas']) == (1, 4)
+
+def test_agregado_e_paginacao_depois_da_importacao(tmp_path, adb):
+    asyncio.run(importacao.importar(adb, 1, "Ana", _arquivo(tmp_path, "extrato.csv", EXTRATO_CSV), "csv"))
+    banco = adb._db; banco.cache.invalidar(1)
+    agregado = banco.get_agregado(1)
+    assert agregado['total']['gasto'] == pytest.approx(53.15) and agregado['total']['entrada'] == pytest.approx(3500.0)
+    assert agregado['meses']['2024-03']['gasto'] == pytest.approx(53.15)
+    assert banco.get_soma(1, "gasto") == Decimal("53.15")
+    # Páginas de 2 gastos: as duas padarias do mesmo dia ficam na ordem do extrato (microssegundos)
+    pagina, tem_anterior, tem_proxima = banco.get_pagina(1, "gasto", 2)
+    assert [(t.descricao, t.data) for t in pagina] == [("Uber", datetime(2024, 3, 7, 15)), ("Padaria", datetime(2024, 3, 5, 15, 0, 0, 1))]
+    assert not tem_anterior and tem_proxima
+    seguinte, tem_anterior, tem_proxima = banco.get_pagina(1, "gasto", 2, apos=(pagina[-1].data, pagina[-1].id))
+    assert [t.data for t in seguinte] == [datetime(2024, 3, 5, 15)] and tem_anterior and not tem_proxima
+    anterior, _, tem_proxima = banco.get_pagina(1, "gasto", 2, antes=(seguinte[0].data, seguinte[0].id))
+    assert [t.id for t in anterior] == [t.id for t in pagina] and tem_proxima
+
+def test_dois_extratos_do_mesmo_dia_nao_repetem_horario(tmp_path, adb):
+    asyncio.run(importacao.importar(adb, 1, "Ana", _arquivo(tmp_path, "extrato.csv", EXTRATO_CSV), "csv"))
+    asyncio.run(importacao.importar(adb, 1, "Ana", _arquivo(tmp_path, "extrato.ofx", EXTRATO_OFX), "ofx"))
+    banco = adb._db; gastos = banco.get_todas(1, "gasto")
+    do_dia = sorted(t.data for t in gastos if t.data.date() == date(2024, 3, 5))
+    assert do_dia == [datetime(2024, 3, 5, 15, 0, 0, n) for n in range(3)] # o OFX continua depois das duas padarias
+    # Página a página (do banco e do cache), todas as linhas aparecem uma vez
+    banco.cache.invalidar(1)
+    for _ in range(2):
+        vistos = []; pagina, _, tem_proxima = banco.get_pagina(1, "gasto", 2); vistos += pagina
+        while tem_proxima:
+            pagina, _, tem_proxima = banco.get_pagina(1, "gasto", 2, apos=(pagina[-1].data, pagina[-1].id)); vistos += pagina
+        assert sorted(t.id for t in vistos) == sorted(t.id for t in gastos) and len(vistos) == 4
+        banco.get_todas(1)
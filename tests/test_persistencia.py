@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+pytest.importorskip("telegram")
+from persistencia import PersistenciaBanco
+
+class _Banco:
+    def __init__(self): self.leituras = 0; self.estados = {}
+    async def get_estado_usuario(self, user_id): self.leituras += 1; return self.estados.get(user_id)
+    async def salvar_estados_usuarios(self, estados): self.estados.update(estados)
+
+def test_mensagens_seguidas_nao_releem_o_banco():
+    banco = _Banco(); banco.estados[1] = {'aguardando_filtro': True}
+    persistencia = PersistenciaBanco(banco, ttl=60, max_usuarios=2)
+    async def conversa():
+        for _ in range(5):
+            user_data = {}; await persistencia.refresh_user_data(1, user_data)
+        return user_data
+    asyncio.run(conversa())
+    assert banco.leituras == 1
+
+def test_memoria_limitada_aos_usuarios_recentes():
+    banco = _Banco(); persistencia = PersistenciaBanco(banco, ttl=60, max_usuarios=2)
+    async def mensagens(*usuarios):
+        for user_id in usuarios: await persistencia.refresh_user_data(user_id, {})
+    asyncio.run(mensagens(1, 2, 3, 1))
+    assert list(persistencia._conhecidos) == [3, 1] and banco.leituras == 4 # o 1 saiu do LRU e foi relido